@@ -14,6 +14,7 @@ import os
 
 # --- Imports for agent and tools ---
 from shared_code.openai_clients import get_agent_oai_client
+from shared_code.json_utils import json_loads, json_dumps
 from shared_code.agent_tool_definitions import get_invoice_agent_tools_definition
 from shared_code.agent_tool_implementations import (
     execute_sql_query_tool,
@@ -171,7 +172,7 @@ def invoice_agent_chat(req: func.HttpRequest) -> func.HttpResponse:
 
         if not tool_calls:
             final_answer = assistant_msg.content or ""
-            return func.HttpResponse(json.dumps({"answer": final_answer, "history": history}), mimetype="application/json")
+            return func.HttpResponse(json_dumps({"answer": final_answer, "history": history}), mimetype="application/json")
 
         # Handle consent tool separately
         call = tool_calls[0]
@@ -189,7 +190,7 @@ def invoice_agent_chat(req: func.HttpRequest) -> func.HttpResponse:
                 return func.HttpResponse(json.dumps({"error": f"Error processing consent request: {e}"}), status_code=500)
 
         # Process other tool calls
-        messages.append(json.loads(assistant_msg.model_dump_json()))
+        messages.append(json_loads(assistant_msg.model_dump_json()))
         for call in tool_calls:
             fn_name = call.function.name
             fn_impl = available_tool_functions.get(fn_name)
@@ -198,7 +199,7 @@ def invoice_agent_chat(req: func.HttpRequest) -> func.HttpResponse:
                 tool_content = json.dumps({"error": f"Tool '{fn_name}' is not available."})
             else:
                 try:
-                    args = json.loads(call.function.arguments)
+                    args = json_loads(call.function.arguments)
 
                     # INJECT SECURE CREDENTIALS INTO THE EMAIL TOOL CALL
                     if fn_name == "send_email_with_attachments_tool":
@@ -207,7 +208,7 @@ def invoice_agent_chat(req: func.HttpRequest) -> func.HttpResponse:
 
                     tool_result = fn_impl(**args)
                     # The CSV tool returns a dict, so we ensure it's a string for the history
-                    tool_content = tool_result if isinstance(tool_result, str) else json.dumps(tool_result)
+                    tool_content = tool_result if isinstance(tool_result, str) else json_dumps(tool_result)
                 except Exception as ex:
                     logging.error(f"Tool execution error for {fn_name}", exc_info=True)
                     tool_content = json.dumps({"error": str(ex)})
@@ -221,7 +222,7 @@ def invoice_agent_chat(req: func.HttpRequest) -> func.HttpResponse:
 
     fallback_message = "The agent could not complete your request within the allowed steps. Please try rephrasing your request."
     return func.HttpResponse(
-        json.dumps({"answer": fallback_message, "history": history}),
+        json_dumps({"answer": fallback_message, "history": history}),
         status_code=200,
         mimetype="application/json",
     )
\ No newline at end of file
@@ -12,11 +12,9 @@ contract PDFs. It performs the following steps:
 
 import azure.functions as func
 import logging
-import json
 import os
 import datetime
 
-import pymssql
 from shared_code import blob_service, pdf_utils, openai_service, database_service as db
 
 from azure.core.credentials import AzureKeyCredential
@@ -90,9 +88,9 @@ def process_contract_pdf_with_llm(contractBlob: func.InputStream):
     except Exception as e:
         logging.warning(f"Text extraction failed for '{filename}': {e}. Proceeding with images only.")
 
-    # 4. LLM extraction
+    # 4. LLM extraction (validated and normalized item dicts)
     try:
-        json_str = openai_service.extract_contract_data_as_json(
+        items = openai_service.extract_contract_data_as_list(
             images_base64=images,
             pdf_text_content=text_content,
             original_filename=filename
@@ -101,29 +99,17 @@ def process_contract_pdf_with_llm(contractBlob: func.InputStream):
         logging.error(f"LLM extraction error for '{filename}': {e}", exc_info=True)
         return
 
-    if not json_str:
+    if items is None:
         logging.error(f"LLM returned empty output for '{filename}'. Skipping.")
         return
-    logging.info(f"Received JSON output from LLM for '{filename}'.")
-
-    # 5. Parse JSON array
-    try:
-        items = json.loads(json_str)
-        if not isinstance(items, list):
-            logging.error(f"LLM output for '{filename}' is not a list.")
-            return
-    except json.JSONDecodeError as e:
-        logging.error(f"JSON decode error for '{filename}': {e}", exc_info=True)
-        return
-
     logging.info(f"Parsed {len(items)} items from LLM for '{filename}'.")
 
-    # 6. Insert into SQL via pymssql
+    # 5. Insert into SQL via pymssql
     conn = None
     success = False
     ts = datetime.datetime.utcnow().isoformat() + 'Z'
     try:
-        # get_sql_connection now returns a pymssql.Connection
+        # get_sql_connection returns a pymssql or pyodbc connection (SQL_DRIVER)
         conn = db.get_sql_connection()
         db.create_contracts_table_if_not_exist(conn)
 
@@ -133,7 +119,7 @@ def process_contract_pdf_with_llm(contractBlob: func.InputStream):
             success = True
         else:
             logging.error(f"No items inserted for '{filename}'.")
-    except pymssql.Error as e:
+    except db.DB_ERRORS as e:
         logging.error(f"Database error for '{filename}': {e}", exc_info=True)
         if conn:
             try:
@@ -146,7 +132,7 @@ def process_contract_pdf_with_llm(contractBlob: func.InputStream):
         if conn:
             conn.close()
 
-    # 7. Trigger indexer if successful
+    # 6. Trigger indexer if successful
     # if success:
     #     logging.info(f"SQL insert complete for '{filename}', triggering indexer.")
     #     if run_contracts_itemized_indexer():
@@ -15,9 +15,9 @@ import azure.functions as func
 import logging
 import json
 import os
-import pymssql
 
 from shared_code import database_service as db
+from shared_code.json_utils import json_loads
 
 bp = func.Blueprint()
 
@@ -52,7 +52,7 @@ def load_final_report_to_sql(finalReportBlob: func.InputStream):
     try:
         # 1. Read & parse JSON
         raw = finalReportBlob.read().decode('utf-8')
-        report_json = json.loads(raw)
+        report_json = json_loads(raw)
 
         # 2. Validate structure
         if report_json.get("status") == "Failed" or report_json.get("error"):
@@ -66,7 +66,7 @@ def load_final_report_to_sql(finalReportBlob: func.InputStream):
             return
 
         # 3. Connect & ensure tables exist
-        conn = db.get_sql_connection()   # should return pymssql.Connection
+        conn = db.get_sql_connection()
         db.create_tables_if_not_exist(conn)
 
         # 4. Prepare header payload
@@ -134,7 +134,7 @@ def load_final_report_to_sql(finalReportBlob: func.InputStream):
     except json.JSONDecodeError as jde:
         logging.error(f"JSON parse error in '{filename}': {jde}. Raw: {raw[:200] if raw else 'N/A'}", exc_info=True)
 
-    except pymssql.Error as db_err:
+    except db.DB_ERRORS as db_err:
         logging.error(f"Database error for '{filename}': {db_err}", exc_info=True)
         if conn:
             try:
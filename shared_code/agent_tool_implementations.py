@@ -27,7 +27,8 @@ from datetime import datetime, timedelta, date,timezone
 # from blueprints.invoice_ingestion_bp import get_invoice_by_id
 # from shared_code.po_data_service import get_po_data_by_number
 # from shared_code.openai_service import chat_complete
-from shared_code.database_service import get_sql_connection
+from shared_code.database_service import get_sql_connection, fetchall_as_dicts
+from shared_code.json_utils import json_dumps
 
 import io
 import csv
@@ -142,10 +143,10 @@ def execute_sql_query_tool(sql_query: str) -> str:
 
     try:
         conn = get_sql_connection()
-        cursor = conn.cursor(as_dict=True)
+        cursor = conn.cursor()
         logging.info(f"Executing rewritten query: {final_sql_query}")
         cursor.execute(final_sql_query)
-        rows = cursor.fetchall()
+        rows = fetchall_as_dicts(cursor)
         cursor.close()
         conn.close()
 
@@ -157,7 +158,7 @@ def execute_sql_query_tool(sql_query: str) -> str:
                 elif isinstance(v, (date, datetime)):
                     row[k] = v.isoformat()
 
-        return json.dumps({"results": rows})
+        return json_dumps({"results": rows})
     except Exception as e:
         logging.error(f"SQL execution error for query '{final_sql_query}'", exc_info=True)
         return json.dumps({"error": str(e)})
@@ -230,12 +231,12 @@ def export_sql_query_to_csv_tool(
     # 2) Execute the query
     try:
         conn = get_sql_connection()
-        cursor = conn.cursor(as_dict=True)
+        cursor = conn.cursor()
         logging.info(f"Executing rewritten query for export: {final_sql_query}")
         # [MODIFIED] Use the rewritten query
         cursor.execute(final_sql_query)
-        rows = cursor.fetchall()
         cols = [col[0] for col in cursor.description]
+        rows = fetchall_as_dicts(cursor)
         cursor.close()
         conn.close()
     except Exception as e:
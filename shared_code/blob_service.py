@@ -14,8 +14,50 @@ Configuration for the blob storage connection string is expected via the
 expected in the format 'container_name/path/to/blob.ext'.
 """
 import os
+import time
 import logging
-from azure.storage.blob import BlobServiceClient
+import threading
+import requests
+from cachetools import TTLCache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from azure.core.exceptions import ResourceNotFoundError
+from azure.core.pipeline.transport import RequestsTransport
+from azure.storage.blob import BlobClient, BlobServiceClient
+
+# Parallel range GETs per download. The SDK only splits blobs larger than its
+# single-GET size (32 MB), so small invoices are still fetched in one request.
+DEFAULT_DOWNLOAD_CONCURRENCY = 4
+# Sized so parallel range GETs never exhaust urllib3's per-host pool.
+_HTTP_POOL_MAXSIZE = max(32, 4 * DEFAULT_DOWNLOAD_CONCURRENCY)
+_http_session = None
+
+# check_blob_exists results keyed by (connection_string, path). Misses are
+# cached only briefly so newly uploaded blobs show up quickly.
+_EXISTS_HITS = TTLCache(maxsize=4096, ttl=30)
+_EXISTS_MISSES = TTLCache(maxsize=4096, ttl=5)
+_EXISTS_LOCK = threading.Lock()
+
+# Same-account copies normally finish inside the copy request; this bounds
+# the wait for the rare copy that is still pending.
+_COPY_WAIT_TIMEOUT_SECONDS = 60
+
+def _get_http_session() -> requests.Session:
+    """
+    Returns the process-wide requests session shared by all blob clients.
+    """
+    global _http_session
+    if _http_session is None:
+        session = requests.Session()
+        # Retries are handled by the Azure SDK pipeline, not urllib3.
+        adapter = HTTPAdapter(
+            pool_maxsize=_HTTP_POOL_MAXSIZE,
+            max_retries=Retry(total=False, redirect=False, raise_on_status=False)
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        _http_session = session
+    return _http_session
 
 def get_blob_service_client(connection_string: str = None) -> BlobServiceClient | None:
     """
@@ -38,11 +80,40 @@ def get_blob_service_client(connection_string: str = None) -> BlobServiceClient
         logging.error("BLOB_CONNECTION_STRING not configured.")
         return None
     try:
-        return BlobServiceClient.from_connection_string(connection_string)
+        return BlobServiceClient.from_connection_string(
+            connection_string,
+            transport=RequestsTransport(session=_get_http_session(), session_owner=False)
+        )
     except Exception as e:
         logging.error(f"Failed to create BlobServiceClient: {e}", exc_info=True)
         return None
 
+def _remember_blob_exists(full_blob_path: str, connection_string: str | None, exists: bool):
+    key = (connection_string, full_blob_path)
+    with _EXISTS_LOCK:
+        if exists:
+            _EXISTS_HITS[key] = True
+            _EXISTS_MISSES.pop(key, None)
+        else:
+            _EXISTS_HITS.pop(key, None)
+            _EXISTS_MISSES[key] = True
+
+def _get_blob_client(blob_full_path: str, connection_string: str = None) -> BlobClient:
+    """
+    Resolves a 'container/path/to/blob' path to a BlobClient.
+
+    Raises:
+        ValueError: If the storage connection is not configured or the path
+                    does not include a container name.
+    """
+    blob_service_client = get_blob_service_client(connection_string)
+    if not blob_service_client:
+        raise ValueError("Blob storage connection is not configured.")
+    container_name, sep, blob_name = blob_full_path.partition('/')
+    if not sep or not blob_name:
+        raise ValueError(f"Invalid blob path '{blob_full_path}'. Must include container name.")
+    return blob_service_client.get_blob_client(container=container_name, blob=blob_name)
+
 def upload_text_to_blob(content: str, blob_full_path: str, connection_string: str = None) -> bool:
     """
     Uploads string content to a specified blob in Azure Blob Storage.
@@ -60,19 +131,9 @@ def upload_text_to_blob(content: str, blob_full_path: str, connection_string: st
     Returns:
         bool: True if the upload was successful, False otherwise.
     """
-    blob_service_client = get_blob_service_client(connection_string)
-    if not blob_service_client:
-        return False
-
     try:
-        container_name, *blob_name_parts = blob_full_path.split('/', 1)
-        if not blob_name_parts:
-            logging.error(f"Invalid blob_full_path for upload: '{blob_full_path}'. Must include container name.")
-            return False
-        actual_blob_name = blob_name_parts[0]
-
-        blob_client = blob_service_client.get_blob_client(container=container_name, blob=actual_blob_name)
-        blob_client.upload_blob(content.encode('utf-8'), overwrite=True)
+        _get_blob_client(blob_full_path, connection_string).upload_blob(content.encode('utf-8'), overwrite=True)
+        _remember_blob_exists(blob_full_path, connection_string, True)
         logging.info(f"Successfully uploaded text to blob: {blob_full_path}")
         return True
     except Exception as e:
@@ -83,9 +144,9 @@ def move_blob(source_blob_full_path: str, destination_blob_full_path: str, conne
     """
     Moves a blob from a source path to a destination path within the same Azure Storage account.
 
-    This operation involves copying the source blob to the destination and then
-    deleting the source blob. Both source and destination paths should include
-    the container name.
+    This operation involves a server-side copy of the source blob to the destination,
+    followed by deleting the source blob once the copy has succeeded. Both source
+    and destination paths should include the container name.
 
     Args:
         source_blob_full_path (str): The full path of the source blob,
@@ -98,38 +159,36 @@ def move_blob(source_blob_full_path: str, destination_blob_full_path: str, conne
     Returns:
         bool: True if the move was successful, False otherwise.
     """
-    blob_service_client = get_blob_service_client(connection_string)
-    if not blob_service_client:
-        return False
-
     try:
-        source_container_name, *s_blob_name_parts = source_blob_full_path.split('/', 1)
-        dest_container_name, *d_blob_name_parts = destination_blob_full_path.split('/', 1)
-
-        if not s_blob_name_parts or not d_blob_name_parts:
-            logging.error(f"Invalid source or destination blob path for move. Source: {source_blob_full_path}, Dest: {destination_blob_full_path}")
+        source_blob_client = _get_blob_client(source_blob_full_path, connection_string)
+        destination_blob_client = _get_blob_client(destination_blob_full_path, connection_string)
+
+        # A missing source surfaces as ResourceNotFoundError from the copy
+        # itself, so no separate exists() round trip is needed.
+        copy_props = destination_blob_client.start_copy_from_url(source_blob_client.url)
+        copy_status = copy_props.get("copy_status")
+        deadline = time.monotonic() + _COPY_WAIT_TIMEOUT_SECONDS
+        while copy_status == "pending" and time.monotonic() < deadline:
+            time.sleep(0.5)
+            copy_status = destination_blob_client.get_blob_properties().copy.status
+        if copy_status != "success":
+            logging.error(f"Copy for move did not complete (status: {copy_status}). Source kept: {source_blob_full_path}")
             return False
 
-        source_actual_blob_name = s_blob_name_parts[0]
-        dest_actual_blob_name = d_blob_name_parts[0]
-
-        source_blob_client = blob_service_client.get_blob_client(container=source_container_name, blob=source_actual_blob_name)
-        destination_blob_client = blob_service_client.get_blob_client(container=dest_container_name, blob=dest_actual_blob_name)
-
-        if not source_blob_client.exists():
-            logging.warning(f"Source blob for move not found: {source_blob_full_path}")
-            return False
-
-        destination_blob_client.start_copy_from_url(source_blob_client.url)
-        
         source_blob_client.delete_blob()
+        _remember_blob_exists(source_blob_full_path, connection_string, False)
+        _remember_blob_exists(destination_blob_full_path, connection_string, True)
         logging.info(f"Successfully moved blob from '{source_blob_full_path}' to '{destination_blob_full_path}'")
         return True
+    except ResourceNotFoundError:
+        logging.warning(f"Source blob for move not found: {source_blob_full_path}")
+        return False
     except Exception as e:
         logging.error(f"Failed to move blob from '{source_blob_full_path}' to '{destination_blob_full_path}': {e}", exc_info=True)
         return False
 
-def download_blob_bytes(full_blob_path: str, connection_string: str = None) -> bytes | None:
+def download_blob_bytes(full_blob_path: str, connection_string: str = None,
+                        max_concurrency: int = DEFAULT_DOWNLOAD_CONCURRENCY) -> bytes | None:
     """
     Downloads the content of a blob as bytes.
 
@@ -138,28 +197,20 @@ def download_blob_bytes(full_blob_path: str, connection_string: str = None) -> b
                               e.g., 'mycontainer/data/file.bin'.
         connection_string (str, optional): The Azure Blob Storage connection string.
                                            If None, uses the environment variable.
+        max_concurrency (int, optional): Parallel range GETs used for large blobs.
+                                         Use 1 when fanning out over many small files.
 
     Returns:
         bytes | None: The content of the blob as bytes if successful and blob exists,
                       otherwise None.
     """
-    blob_service_client = get_blob_service_client(connection_string)
-    if not blob_service_client:
-        return None
     try:
-        container_name, *blob_name_parts = full_blob_path.split('/', 1)
-        if not blob_name_parts:
-            logging.error(f"Invalid blob_full_path for download: '{full_blob_path}'. Must include container name.")
-            return None
-        actual_blob_name = blob_name_parts[0]
-
-        blob_client = blob_service_client.get_blob_client(container=container_name, blob=actual_blob_name)
+        blob_client = _get_blob_client(full_blob_path, connection_string)
         if blob_client.exists():
-            downloader = blob_client.download_blob()
-            return downloader.readall()
-        else:
-            logging.warning(f"Blob not found for download: {full_blob_path}")
-            return None
+            return blob_client.download_blob(max_concurrency=max_concurrency).readall()
+        _remember_blob_exists(full_blob_path, connection_string, False)
+        logging.warning(f"Blob not found for download: {full_blob_path}")
+        return None
     except Exception as e:
         logging.error(f"Failed to download blob '{full_blob_path}': {e}", exc_info=True)
         return None
@@ -177,15 +228,16 @@ def check_blob_exists(full_blob_path: str, connection_string: str = None) -> boo
     Returns:
         bool: True if the blob exists, False otherwise or if an error occurs.
     """
-    blob_service_client = get_blob_service_client(connection_string)
-    if not blob_service_client:
-        return False
+    key = (connection_string, full_blob_path)
+    with _EXISTS_LOCK:
+        if key in _EXISTS_HITS:
+            return True
+        if key in _EXISTS_MISSES:
+            return False
     try:
-        container_name, *blob_name_parts = full_blob_path.split('/', 1)
-        if not blob_name_parts: return False
-        actual_blob_name = blob_name_parts[0]
-        blob_client = blob_service_client.get_blob_client(container=container_name, blob=actual_blob_name)
-        return blob_client.exists()
+        exists = _get_blob_client(full_blob_path, connection_string).exists()
+        _remember_blob_exists(full_blob_path, connection_string, exists)
+        return exists
     except Exception as e:
         logging.error(f"Error checking blob existence for '{full_blob_path}': {e}", exc_info=True)
-        return False
\ No newline at end of file
+        return False
@@ -1,5 +1,5 @@
 """
-Service module for database interactions, primarily with a SQL database using pymssql.
+Service module for database interactions, primarily with a SQL database using pymssql or pyodbc.
 
 This module provides functions for:
 - Establishing database connections.
@@ -14,6 +14,12 @@ Configuration for the SQL database connection uses the following environment var
 - `SQL_DATABASE_NAME`
 - `SQL_USERNAME`
 - `SQL_PASSWORD`
+
+The driver is chosen at import time with `SQL_DRIVER` (`pymssql`, the default,
+or `pyodbc`). The pyodbc backend uses `SQL_ODBC_DRIVER` (defaults to
+"ODBC Driver 18 for SQL Server") and enables `fast_executemany` for bulk inserts.
+Its connections are encrypted and verify the server certificate unless
+`SQL_TRUST_SERVER_CERT` is `yes` (e.g. for a local server with a self-signed certificate).
 """
 
 import os
@@ -21,7 +27,63 @@ import pymssql
 import logging
 from decimal import Decimal, ROUND_HALF_UP, InvalidOperation
 import datetime
-import json
+from .json_utils import json_dumps
+import threading
+from cachetools import TTLCache
+
+
+SQL_DRIVER = os.environ.get("SQL_DRIVER", "pymssql").strip().lower()
+if SQL_DRIVER == "pyodbc":
+    import pyodbc
+    DB_ERRORS = (pymssql.Error, pyodbc.Error)
+    _INTEGRITY_ERRORS = (pymssql.IntegrityError, pyodbc.IntegrityError)
+else:
+    pyodbc = None
+    DB_ERRORS = (pymssql.Error,)
+    _INTEGRITY_ERRORS = (pymssql.IntegrityError,)
+
+# Schema objects already ensured by this worker process, keyed by
+# (server, database, object). DDL probes only run once per key.
+_SCHEMA_READY = set()
+
+
+# Files check_if_file_processed has seen ingested. Only positive answers are
+# cached: a cached "not processed" could miss an insert by another worker and
+# let the caller insert the invoice's line items a second time.
+_PROCESSED_HITS = TTLCache(maxsize=4096, ttl=30)
+_PROCESSED_LOCK = threading.Lock()
+
+
+def _remember_processed(source_json_filename: str):
+    with _PROCESSED_LOCK:
+        _PROCESSED_HITS[source_json_filename] = True
+
+
+def _schema_key(object_name: str) -> tuple:
+    return (os.environ.get("SQL_SERVER_NAME"), os.environ.get("SQL_DATABASE_NAME"), object_name)
+
+
+def adapt_placeholders(sql: str) -> str:
+    """
+    Convert pymssql-style '%s' placeholders to the active driver's style.
+    """
+    return sql.replace("%s", "?") if pyodbc else sql
+
+
+def fetchall_as_dicts(cursor) -> list[dict]:
+    """
+    Fetch all remaining rows as dicts keyed by column name, for either driver.
+    """
+    cols = [col[0] for col in cursor.description]
+    return [dict(zip(cols, row)) for row in cursor.fetchall()]
+
+
+def _is_duplicate_key_error(e) -> bool:
+    # pymssql exposes the SQL Server error number as args[0]; pyodbc only
+    # carries it inside the message text, e.g. "... (2627) (SQLExecDirectW)".
+    if e.args and e.args[0] == 2627:
+        return True
+    return "(2627)" in str(e)
 
 
 def get_nested_val(data_dict, keys, default=None):
@@ -53,8 +115,12 @@ def safe_decimal(value, default=None, precision_places=2):
     """
     if value is None:
         return default
+    if isinstance(value, str):
+        value = value.strip()
+        if not value:
+            return default
     try:
-        if not isinstance(value, (int, float, Decimal)):
+        if not isinstance(value, (int, float, Decimal, str)):
             val_str = str(value).strip()
             if not val_str:
                 return default
@@ -68,9 +134,21 @@ def safe_decimal(value, default=None, precision_places=2):
         return default
 
 
+def _parse_iso_date(value) -> datetime.date | None:
+    """
+    Parse a 'YYYY-MM-DD' string into a date, returning None if empty or invalid.
+    """
+    if not value:
+        return None
+    try:
+        return datetime.date.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
 def get_sql_connection():
     """
-    Establishes and returns a pymssql connection.
+    Establishes and returns a connection using the driver selected by SQL_DRIVER.
 
     Reads config from env vars: SQL_SERVER_NAME, SQL_DATABASE_NAME, SQL_USERNAME, SQL_PASSWORD.
     """
@@ -88,16 +166,26 @@ def get_sql_connection():
         raise ValueError(f"Missing DB config: {', '.join(missing)}")
 
     try:
-        conn = pymssql.connect(
-            server=server,
-            user=user,
-            password=password,
-            database=database,
-            port=1433
-        )
+        if pyodbc:
+            odbc_driver = os.environ.get("SQL_ODBC_DRIVER", "ODBC Driver 18 for SQL Server")
+            pwd = password.replace("}", "}}")
+            trust_cert = "yes" if os.environ.get("SQL_TRUST_SERVER_CERT", "no").strip().lower() in ("yes", "true", "1") else "no"
+            conn = pyodbc.connect(
+                f"DRIVER={{{odbc_driver}}};SERVER={server},1433;DATABASE={database};"
+                f"UID={user};PWD={{{pwd}}};Encrypt=yes;TrustServerCertificate={trust_cert}",
+                autocommit=False
+            )
+        else:
+            conn = pymssql.connect(
+                server=server,
+                user=user,
+                password=password,
+                database=database,
+                port=1433
+            )
         logging.info("SQL DB connection successful.")
         return conn
-    except pymssql.Error as e:
+    except DB_ERRORS as e:
         logging.error(f"Failed to connect to SQL DB: {e}", exc_info=True)
         raise
 
@@ -105,10 +193,15 @@ def get_sql_connection():
 def create_tables_if_not_exist(conn):
     """
     Create Invoices and InvoiceLineItems if missing.
+
+    Both tables are ensured in a single batch, and only once per process.
     """
+    key = _schema_key("Invoices+InvoiceLineItems")
+    if key in _SCHEMA_READY:
+        return
     cursor = conn.cursor()
     try:
-        invoices_sql = (
+        schema_sql = (
             "IF OBJECT_ID('Invoices','U') IS NULL "
             "CREATE TABLE Invoices ("
             "InvoiceRecordID INT IDENTITY(1,1) PRIMARY KEY,"
@@ -123,10 +216,6 @@ def create_tables_if_not_exist(conn):
             ");"
             "IF NOT EXISTS(SELECT * FROM sys.indexes WHERE name='IX_Invoices_InvoiceID_File') "
             "CREATE INDEX IX_Invoices_InvoiceID_File ON Invoices(InvoiceID, SourceJsonFileName);"
-        )
-        cursor.execute(invoices_sql)
-
-        line_items_sql = (
             "IF OBJECT_ID('InvoiceLineItems','U') IS NULL "
             "CREATE TABLE InvoiceLineItems ("
             "LineItemID INT IDENTITY(1,1) PRIMARY KEY,"
@@ -137,11 +226,11 @@ def create_tables_if_not_exist(conn):
             "TotalPriceWithTax DECIMAL(18,2)"
             ");"
         )
-        cursor.execute(line_items_sql)
-
+        cursor.execute(schema_sql)
         conn.commit()
+        _SCHEMA_READY.add(key)
         logging.info("Ensured database schemas for Invoices and InvoiceLineItems.")
-    except pymssql.Error as e:
+    except DB_ERRORS as e:
         conn.rollback()
         logging.error(f"Error creating tables: {e}", exc_info=True)
         raise
@@ -152,16 +241,25 @@ def create_tables_if_not_exist(conn):
 def check_if_file_processed(conn, source_json_filename: str) -> bool:
     """
     Return True if an invoice from this JSON file has been ingested.
+
+    Positive answers are cached per process for a few seconds to absorb retry
+    and duplicate-event storms; negative ones always query the database.
     """
+    with _PROCESSED_LOCK:
+        if source_json_filename in _PROCESSED_HITS:
+            return True
     cursor = conn.cursor()
     try:
         cursor.execute(
-            "SELECT COUNT(1) FROM Invoices WHERE SourceJsonFileName=%s;",
+            adapt_placeholders("SELECT COUNT(1) FROM Invoices WHERE SourceJsonFileName=%s;"),
             (source_json_filename,)
         )
-        return cursor.fetchone()[0] > 0
+        processed = cursor.fetchone()[0] > 0
     finally:
         cursor.close()
+    if processed:
+        _remember_processed(source_json_filename)
+    return processed
 
 
 def insert_invoice_data(conn, invoice_data: dict, source_json_filename: str) -> int:
@@ -218,28 +316,31 @@ def insert_invoice_data(conn, invoice_data: dict, source_json_filename: str) ->
 
     cursor = conn.cursor()
     try:
-        cursor.execute(sql, tuple(vals))
+        cursor.execute(adapt_placeholders(sql), tuple(vals))
         new_id = cursor.fetchone()[0]
         conn.commit()
+        _remember_processed(source_json_filename)
         return new_id
 
-    except pymssql.IntegrityError as e:
+    except _INTEGRITY_ERRORS as e:
         # 2627 = unique‐key violation on SourceJsonFileName
-        if e.args[0] == 2627:
+        if _is_duplicate_key_error(e):
             logging.warning(
                 f"Duplicate JSON '{source_json_filename}', fetching existing ID."
             )
             cursor.execute(
-                "SELECT InvoiceRecordID FROM Invoices WHERE SourceJsonFileName=%s;",
+                adapt_placeholders("SELECT InvoiceRecordID FROM Invoices WHERE SourceJsonFileName=%s;"),
                 (source_json_filename,)
             )
-            return cursor.fetchone()[0]
+            existing_id = cursor.fetchone()[0]
+            _remember_processed(source_json_filename)
+            return existing_id
         else:
             conn.rollback()
             logging.error(f"Error inserting invoice data: {e}", exc_info=True)
             raise
 
-    except pymssql.Error as e:
+    except DB_ERRORS as e:
         conn.rollback()
         logging.error(f"Error inserting invoice data: {e}", exc_info=True)
         raise
@@ -259,10 +360,12 @@ def insert_line_items_data(conn, invoice_record_id: int, invoice_id: str,
     try:
         for item in line_items:
             cursor.execute(
-                "INSERT INTO InvoiceLineItems ("
-                "InvoiceRecordID, InvoiceID, PONumber, VendorName, ItemName, Quantity,"
-                "UnitPrice, AmountWithoutTax, ExpectedTaxAmount, TaxPercentage, TotalPriceWithTax"
-                ") VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s);",
+                adapt_placeholders(
+                    "INSERT INTO InvoiceLineItems ("
+                    "InvoiceRecordID, InvoiceID, PONumber, VendorName, ItemName, Quantity,"
+                    "UnitPrice, AmountWithoutTax, ExpectedTaxAmount, TaxPercentage, TotalPriceWithTax"
+                    ") VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s);"
+                ),
                 (
                     invoice_record_id, invoice_id, po_number, vendor_name,
                     item.get('Description'),
@@ -275,7 +378,7 @@ def insert_line_items_data(conn, invoice_record_id: int, invoice_id: str,
                 )
             )
         conn.commit()
-    except pymssql.Error as e:
+    except DB_ERRORS as e:
         conn.rollback()
         logging.error(f"Error inserting line items: {e}", exc_info=True)
         raise
@@ -291,8 +394,10 @@ def get_invoice_and_line_items_as_dict(conn, invoice_record_id: int=None, invoic
     try:
         if not invoice_record_id and invoice_id_str:
             cursor.execute(
-                "SELECT TOP 1 InvoiceRecordID FROM Invoices "
-                "WHERE InvoiceID=%s ORDER BY ProcessedAt DESC, InvoiceRecordID DESC;",
+                adapt_placeholders(
+                    "SELECT TOP 1 InvoiceRecordID FROM Invoices "
+                    "WHERE InvoiceID=%s ORDER BY ProcessedAt DESC, InvoiceRecordID DESC;"
+                ),
                 (invoice_id_str,)
             )
             row = cursor.fetchone()
@@ -304,7 +409,7 @@ def get_invoice_and_line_items_as_dict(conn, invoice_record_id: int=None, invoic
             return None
 
         cursor.execute(
-            "SELECT * FROM Invoices WHERE InvoiceRecordID=%s;",
+            adapt_placeholders("SELECT * FROM Invoices WHERE InvoiceRecordID=%s;"),
             (invoice_record_id,)
         )
         cols = [col[0] for col in cursor.description]
@@ -320,11 +425,10 @@ def get_invoice_and_line_items_as_dict(conn, invoice_record_id: int=None, invoic
                 invoice[k] = v.isoformat()
 
         cursor.execute(
-            "SELECT * FROM InvoiceLineItems WHERE InvoiceRecordID=%s ORDER BY LineItemID;",
+            adapt_placeholders("SELECT * FROM InvoiceLineItems WHERE InvoiceRecordID=%s ORDER BY LineItemID;"),
             (invoice_record_id,)
         )
-        li_cols = [col[0] for col in cursor.description]
-        items = [dict(zip(li_cols, r)) for r in cursor.fetchall()]
+        items = fetchall_as_dicts(cursor)
         for item in items:
             for k, v in item.items():
                 if isinstance(v, Decimal):
@@ -332,7 +436,7 @@ def get_invoice_and_line_items_as_dict(conn, invoice_record_id: int=None, invoic
         invoice['LineItems'] = items
 
         return invoice
-    except pymssql.Error as e:
+    except DB_ERRORS as e:
         logging.error(f"Error fetching invoice details: {e}", exc_info=True)
         return None
     finally:
@@ -342,15 +446,25 @@ def get_invoice_and_line_items_as_dict(conn, invoice_record_id: int=None, invoic
 def check_if_table_exists(conn, table_name: str, schema_name: str='dbo') -> bool:
     """
     Check if a table exists in the database.
+
+    Positive results are remembered for the lifetime of the process.
     """
+    key = _schema_key(f"{schema_name}.{table_name}")
+    if key in _SCHEMA_READY:
+        return True
     cursor = conn.cursor()
     try:
         cursor.execute(
-            "SELECT COUNT(*) FROM INFORMATION_SCHEMA.TABLES "
-            "WHERE TABLE_SCHEMA=%s AND TABLE_NAME=%s;",
+            adapt_placeholders(
+                "SELECT COUNT(*) FROM INFORMATION_SCHEMA.TABLES "
+                "WHERE TABLE_SCHEMA=%s AND TABLE_NAME=%s;"
+            ),
             (schema_name, table_name)
         )
-        return cursor.fetchone()[0] > 0
+        exists = cursor.fetchone()[0] > 0
+        if exists:
+            _SCHEMA_READY.add(key)
+        return exists
     finally:
         cursor.close()
 
@@ -358,11 +472,14 @@ def check_if_table_exists(conn, table_name: str, schema_name: str='dbo') -> bool
 def create_contracts_table_if_not_exist(conn):
     """
     Create Contracts table if missing, with FLOAT types for numeric columns.
+
+    Table and index are ensured in a single idempotent batch, once per process.
     """
+    key = _schema_key("dbo.Contracts")
+    if key in _SCHEMA_READY:
+        return
     cursor = conn.cursor()
     try:
-        if check_if_table_exists(conn, 'Contracts'):
-            return
         contracts_sql = (
             "IF OBJECT_ID('dbo.Contracts','U') IS NULL CREATE TABLE dbo.Contracts ("
             "id INT IDENTITY(1,1) PRIMARY KEY, _SourceDocumentFileName VARCHAR(500),"
@@ -373,14 +490,14 @@ def create_contracts_table_if_not_exist(conn):
             "DeliveryPenaltyRate FLOAT, DeliveryPenaltyRateperDay FLOAT, MaximumTaxCharge FLOAT,"
             "OtherRuleBreakClausesAmount FLOAT, OtherRuleBreakClausesRate FLOAT, _RawExtractedItemJsonData NVARCHAR(MAX)"
             ");"
-        )
-        cursor.execute(contracts_sql)
-        cursor.execute(
+            "IF NOT EXISTS(SELECT * FROM sys.indexes WHERE name='IX_Contracts_SourceDocumentFileName') "
             "CREATE INDEX IX_Contracts_SourceDocumentFileName "
             "ON dbo.Contracts(_SourceDocumentFileName);"
         )
+        cursor.execute(contracts_sql)
         conn.commit()
-    except pymssql.Error as e:
+        _SCHEMA_READY.add(key)
+    except DB_ERRORS as e:
         conn.rollback()
         logging.error(f"Error creating Contracts table: {e}", exc_info=True)
         raise
@@ -388,68 +505,90 @@ def create_contracts_table_if_not_exist(conn):
         cursor.close()
 
 
+# SQL Server caps a single statement at 2100 parameters and 1000 row constructors.
+_MAX_SQL_PARAMS = 2100
+_MAX_ROWS_PER_INSERT = 1000
+
+
+def max_rows_per_insert(column_count: int) -> int:
+    """
+    Rows a single multi-row INSERT of `column_count` columns can carry within
+    SQL Server's parameter and row constructor limits.
+    """
+    return max(1, min(_MAX_ROWS_PER_INSERT, (_MAX_SQL_PARAMS - 1) // max(1, column_count)))
+
+# Item fields copied as-is and fields converted with safe_decimal, in the
+# order they appear in _CONTRACT_COLUMNS.
+_CONTRACT_TEXT_FIELDS = ("SupplierName", "BuyerName", "ItemName", "ItemDescription")
+_CONTRACT_DECIMAL_FIELDS = (
+    "UnitPrice", "MaxItem", "DeliveryPenaltyAmount", "DeliveryPenaltyAmountperDay",
+    "DeliveryPenaltyRate", "DeliveryPenaltyRateperDay", "MaximumTaxCharge",
+    "OtherRuleBreakClausesAmount", "OtherRuleBreakClausesRate"
+)
+_CONTRACT_COLUMNS = (
+    "_SourceDocumentFileName", "_ProcessingTimestampUTC",
+    *_CONTRACT_TEXT_FIELDS,
+    "ContractValidityStartDate", "ContractValidityEndDate", "DeliveryDays",
+    *_CONTRACT_DECIMAL_FIELDS,
+    "_RawExtractedItemJsonData"
+)
+
+
+def _insert_rows_batched(cursor, table: str, columns: tuple, rows: list[tuple]):
+    """
+    Insert rows using multi-row VALUES statements, one round trip per chunk.
+    """
+    columns_sql = ",".join(columns)
+    row_placeholders = "(" + ",".join(["%s"] * len(columns)) + ")"
+    rows_per_stmt = max_rows_per_insert(len(columns))
+    for start in range(0, len(rows), rows_per_stmt):
+        chunk = rows[start:start + rows_per_stmt]
+        sql = (
+            f"INSERT INTO {table} ({columns_sql}) "
+            f"VALUES {','.join([row_placeholders] * len(chunk))};"
+        )
+        cursor.execute(adapt_placeholders(sql), tuple(v for row in chunk for v in row))
+
+
 def insert_contract_data(conn, contract_items_list: list[dict], source_document_filename: str, processing_timestamp_utc: str) -> int:
     """
     Insert extracted contract item rows into the Contracts table.
+
+    Rows are built up front and sent as multi-row INSERT batches instead of
+    one statement per item.
     """
     if not contract_items_list:
         return 0
+
+    rows = []
+    for item in contract_items_list:
+        get = item.get
+        rows.append((
+            source_document_filename,
+            processing_timestamp_utc,
+            *map(get, _CONTRACT_TEXT_FIELDS),
+            _parse_iso_date(get('ContractValidityStartDate')),
+            _parse_iso_date(get('ContractValidityEndDate')),
+            get('DeliveryDays'),
+            *map(safe_decimal, map(get, _CONTRACT_DECIMAL_FIELDS)),
+            json_dumps(item)
+        ))
+
     cursor = conn.cursor()
     try:
-        count = 0
-        for item in contract_items_list:
-            start_date = None
-            if item.get('ContractValidityStartDate'):
-                try:
-                    start_date = datetime.datetime.strptime(
-                        item['ContractValidityStartDate'], '%Y-%m-%d'
-                    ).date()
-                except ValueError:
-                    pass
-            end_date = None
-            if item.get('ContractValidityEndDate'):
-                try:
-                    end_date = datetime.datetime.strptime(
-                        item['ContractValidityEndDate'], '%Y-%m-%d'
-                    ).date()
-                except ValueError:
-                    pass
-
-            cursor.execute(
-                "INSERT INTO dbo.Contracts ("
-                "_SourceDocumentFileName, _ProcessingTimestampUTC, SupplierName, BuyerName,"
-                "ContractValidityStartDate, ContractValidityEndDate, ItemName, ItemDescription,"
-                "UnitPrice, MaxItem, DeliveryDays, DeliveryPenaltyAmount,"
-                "DeliveryPenaltyAmountperDay, DeliveryPenaltyRate, DeliveryPenaltyRateperDay,"
-                "MaximumTaxCharge, OtherRuleBreakClausesAmount, OtherRuleBreakClausesRate,"
-                "_RawExtractedItemJsonData"
-                ") VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s);",
-                (
-                    source_document_filename,
-                    processing_timestamp_utc,
-                    item.get('SupplierName'),
-                    item.get('BuyerName'),
-                    start_date,
-                    end_date,
-                    item.get('ItemName'),
-                    item.get('ItemDescription'),
-                    safe_decimal(item.get('UnitPrice')),
-                    safe_decimal(item.get('MaxItem')),
-                    item.get('DeliveryDays'),
-                    safe_decimal(item.get('DeliveryPenaltyAmount')),
-                    safe_decimal(item.get('DeliveryPenaltyAmountperDay')),
-                    safe_decimal(item.get('DeliveryPenaltyRate')),
-                    safe_decimal(item.get('DeliveryPenaltyRateperDay')),
-                    safe_decimal(item.get('MaximumTaxCharge')),
-                    safe_decimal(item.get('OtherRuleBreakClausesAmount')),
-                    safe_decimal(item.get('OtherRuleBreakClausesRate')),
-                    json.dumps(item)
-                )
+        if pyodbc:
+            # pyodbc sends the whole parameter array in one round trip.
+            cursor.fast_executemany = True
+            cursor.executemany(
+                f"INSERT INTO dbo.Contracts ({','.join(_CONTRACT_COLUMNS)}) "
+                f"VALUES ({','.join(['?'] * len(_CONTRACT_COLUMNS))});",
+                rows
             )
-            count += 1
+        else:
+            _insert_rows_batched(cursor, "dbo.Contracts", _CONTRACT_COLUMNS, rows)
         conn.commit()
-        return count
-    except pymssql.Error as e:
+        return len(rows)
+    except DB_ERRORS as e:
         conn.rollback()
         logging.error(f"Error inserting contract data: {e}", exc_info=True)
         raise
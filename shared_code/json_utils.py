@@ -0,0 +1,42 @@
+# INVOICEPROCESSINGAPP/shared_code/json_utils.py
+"""
+JSON encode/decode helpers that use orjson when it is installed.
+
+orjson is several times faster than the stdlib `json` module on the large
+model responses and item payloads this app handles. It is an optional
+dependency: without it, these helpers fall back to `json` with the same
+call signatures.
+
+Decode errors are raised as `JSONDecodeError` (orjson's is a subclass of
+`json.JSONDecodeError`, so existing `except json.JSONDecodeError` handlers
+keep working).
+"""
+import json
+
+try:
+    import orjson
+except ImportError:  # optional speedup; stdlib json is used when absent
+    orjson = None
+
+JSONDecodeError = orjson.JSONDecodeError if orjson else json.JSONDecodeError
+
+
+def json_loads(data: str | bytes):
+    """
+    Parse a JSON document from str or bytes.
+    """
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def json_dumps(obj, indent: bool = False) -> str:
+    """
+    Serialize to a JSON string; compact by default, two-space indented when `indent` is set.
+    """
+    if orjson:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0).decode()
+        except TypeError:
+            pass  # e.g. non-str keys or Decimal; let the stdlib encoder handle/raise
+    return json.dumps(obj, indent=2 if indent else None)
@@ -6,17 +6,186 @@ This module centralizes the creation of AzureOpenAI clients for different
 purposes (e.g., agent LLM, vision LLM). It reads configuration details
 (endpoint, API key, deployment name, API version) from environment variables
 and ensures that only one instance of each client type is created and reused.
+
+openai and httpx are imported on the first client build, not at import, so
+cold starts that never reach an LLM call don't pay for loading them.
 """
+from __future__ import annotations
+
 import os
+import time
+import atexit
 import logging
-from openai import AzureOpenAI
+import threading
+from functools import lru_cache
+from importlib.util import find_spec
+from types import MappingProxyType
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import httpx
+    from openai import AzureOpenAI, AsyncAzureOpenAI
+
+logger = logging.getLogger(__name__)
+
+# Each variable is read once, in a single pass; agent and vision share
+# endpoint, key and version.
+_ENV = os.environ
+_ENV_KEYS = (
+    "AZURE_OPENAI_ENDPOINT",
+    "AZURE_OPENAI_API_KEY",
+    "AZURE_OPENAI_API_VERSION",
+    "AZURE_OPENAI_AGENT_DEPLOYMENT_NAME",
+    "AZURE_OPENAI_VISION_DEPLOYMENT_NAME",
+)
+_ENDPOINT, _KEY, _API_VERSION, _AGENT_DEPLOY, _VISION_DEPLOY = (_ENV.get(k) for k in _ENV_KEYS)
+
+AGENT_AZURE_OAI_ENDPOINT = _ENDPOINT
+AGENT_AZURE_OAI_KEY = _KEY
+AGENT_AZURE_OAI_DEPLOYMENT_NAME = _AGENT_DEPLOY
+AGENT_AZURE_OAI_API_VERSION = _API_VERSION
+
+VISION_AZURE_OAI_ENDPOINT = _ENDPOINT
+VISION_AZURE_OAI_KEY = _KEY
+VISION_AZURE_OAI_DEPLOYMENT_NAME = _VISION_DEPLOY
+VISION_AZURE_OAI_API_VERSION = _API_VERSION
+
+_shared_http_client = None
+_http_client_lock = threading.Lock()
+# (detach time, pool) for pools dropped by reset_oai_clients; see there.
+_detached_http_clients = []
+
+# Sized for many concurrent vision calls against one endpoint.
+_MAX_CONNECTIONS = 100
+_MAX_KEEPALIVE_CONNECTIONS = 50
+_READ_TIMEOUT_SECONDS = 600.0
+
+@lru_cache(maxsize=None)
+def _http_client_kwargs() -> MappingProxyType:
+    """
+    Pool limits, timeout and protocol settings shared by the sync and async
+    HTTP clients. HTTP/2 (one multiplexed connection per host) is enabled when
+    the optional `h2` package is installed. The timeout mirrors the openai SDK
+    default (long read for vision calls, short connect).
+    """
+    import httpx
+    return MappingProxyType({
+        "limits": httpx.Limits(max_connections=_MAX_CONNECTIONS, max_keepalive_connections=_MAX_KEEPALIVE_CONNECTIONS),
+        "timeout": httpx.Timeout(_READ_TIMEOUT_SECONDS, connect=5.0),
+        "http2": find_spec("h2") is not None,
+    })
 
-AGENT_AZURE_OAI_ENDPOINT = os.environ.get("AZURE_OPENAI_ENDPOINT")
-AGENT_AZURE_OAI_KEY = os.environ.get("AZURE_OPENAI_API_KEY")
-AGENT_AZURE_OAI_DEPLOYMENT_NAME = os.environ.get("AZURE_OPENAI_AGENT_DEPLOYMENT_NAME")
-AGENT_AZURE_OAI_API_VERSION = os.environ.get("AZURE_OPENAI_API_VERSION")
+def _get_shared_httpx():
+    """
+    Returns the httpx.Client shared by all AzureOpenAI clients in this module.
+
+    Agent and vision talk to the same endpoint, so one connection pool lets
+    them reuse each other's keep-alive TLS connections.
+    """
+    global _shared_http_client
+    client = _shared_http_client
+    if client is not None:
+        return client
+    with _http_client_lock:
+        if _shared_http_client is None:
+            import httpx
+            _shared_http_client = httpx.Client(**_http_client_kwargs())
+        return _shared_http_client
+
+def new_async_http_client():
+    """
+    Returns a new httpx.AsyncClient with the same pool settings as the shared
+    sync client, for `AsyncAzureOpenAI(http_client=...)`.
+
+    Async clients are bound to the event loop they are used on, so one is
+    created per async client instead of sharing a module-level instance;
+    closing the AsyncAzureOpenAI client closes it.
+    """
+    import httpx
+    return httpx.AsyncClient(**_http_client_kwargs())
+
+def _make_ctor_kwargs(deployment):
+    """Returns the AzureOpenAI constructor arguments, or None if any setting is missing."""
+    if _ENDPOINT and _KEY and deployment and _API_VERSION:
+        return MappingProxyType({"azure_endpoint": _ENDPOINT, "api_key": _KEY, "api_version": _API_VERSION})
+    return None
+
+# kind -> (log label, constructor arguments or None when misconfigured); validated once at import.
+_CTORS = MappingProxyType({
+    "agent": ("Agent", _make_ctor_kwargs(_AGENT_DEPLOY)),
+    "vision": ("Vision", _make_ctor_kwargs(_VISION_DEPLOY)),
+})
 
-_agent_oai_client = None
+@lru_cache(maxsize=None)
+def _build_client(kind: str):
+    """
+    Builds the AzureOpenAI client for `kind`, or returns None if its
+    configuration is missing. Both outcomes are cached, so a misconfigured
+    kind is reported once rather than on every call. A failed build raises
+    and is not cached; the next call tries again.
+    """
+    label, ctor_kwargs = _CTORS[kind]
+    if ctor_kwargs is None:
+        logger.error("%s AzureOpenAI client configuration missing.", label)
+        return None
+    from openai import AzureOpenAI
+    client = AzureOpenAI(**ctor_kwargs, http_client=_get_shared_httpx())
+    logger.info("%s AzureOpenAI client initialized.", label)
+    return client
+
+@lru_cache(maxsize=4)
+def get_azure_oai_client(endpoint: str, api_key: str, api_version: str):
+    """
+    Returns a shared AzureOpenAI client for the given resource settings.
+
+    For callers that read their own deployment settings (the per-task models in
+    openai_service). Clients are cached per (endpoint, key, version) and use the
+    module's shared HTTP pool. Raises if the client cannot be built.
+    """
+    from openai import AzureOpenAI
+    return AzureOpenAI(azure_endpoint=endpoint, api_key=api_key, api_version=api_version,
+                       http_client=_get_shared_httpx())
+
+def new_async_azure_oai_client(endpoint: str, api_key: str, api_version: str):
+    """
+    Returns a new AsyncAzureOpenAI client for the given resource settings, with the
+    same pool settings as the sync clients. The caller owns and closes it.
+    """
+    from openai import AsyncAzureOpenAI
+    return AsyncAzureOpenAI(azure_endpoint=endpoint, api_key=api_key, api_version=api_version,
+                            http_client=new_async_http_client())
+
+def new_async_oai_client(kind: str):
+    """
+    Returns a new AsyncAzureOpenAI client for `kind` ("agent" or "vision"), or
+    None if its configuration is missing.
+
+    Not cached: async clients belong to the event loop they are used on, so the
+    caller owns the client and should close it (e.g. `async with client:`).
+    """
+    label, ctor_kwargs = _CTORS[kind]
+    if ctor_kwargs is None:
+        logger.error("%s AzureOpenAI client configuration missing.", label)
+        return None
+    from openai import AsyncAzureOpenAI
+    return AsyncAzureOpenAI(**ctor_kwargs, http_client=new_async_http_client())
+
+def _get_client(kind: str, _build=_build_client, _ctors=_CTORS):
+    """
+    Returns the cached AzureOpenAI client for `kind` ("agent" or "vision"),
+    building it on first use. Returns None if configuration is missing or
+    initialization fails. The defaulted arguments bind the builder and table
+    as locals; they are not meant to be passed.
+    """
+    try:
+        return _build(kind)
+    except Exception as e:
+        if logger.isEnabledFor(logging.ERROR):
+            # The message carries the error; the traceback is only worth
+            # formatting when someone is debugging.
+            logger.error("Failed to initialize %s AzureOpenAI client: %s", _ctors[kind][0], e,
+                         exc_info=logger.isEnabledFor(logging.DEBUG))
+        return None
 
 def get_agent_oai_client():
     """
@@ -32,30 +201,7 @@ def get_agent_oai_client():
         AzureOpenAI | None: The initialized client instance, or None if configuration
                             is missing or initialization fails.
     """
-    global _agent_oai_client
-    if _agent_oai_client is None:
-        if AGENT_AZURE_OAI_ENDPOINT and AGENT_AZURE_OAI_KEY and AGENT_AZURE_OAI_DEPLOYMENT_NAME and AGENT_AZURE_OAI_API_VERSION:
-            try:
-                _agent_oai_client = AzureOpenAI(
-                    azure_endpoint=AGENT_AZURE_OAI_ENDPOINT,
-                    api_key=AGENT_AZURE_OAI_KEY,
-                    api_version=AGENT_AZURE_OAI_API_VERSION
-                )
-                logging.info("Agent AzureOpenAI client initialized.")
-            except Exception as e:
-                logging.error(f"Failed to initialize Agent AzureOpenAI client: {e}", exc_info=True)
-                return None
-        else:
-            logging.error("Agent AzureOpenAI client configuration missing.")
-            return None
-    return _agent_oai_client
-
-VISION_AZURE_OAI_ENDPOINT = os.environ.get("AZURE_OPENAI_ENDPOINT")
-VISION_AZURE_OAI_KEY = os.environ.get("AZURE_OPENAI_API_KEY")
-VISION_AZURE_OAI_DEPLOYMENT_NAME = os.environ.get("AZURE_OPENAI_VISION_DEPLOYMENT_NAME")
-VISION_AZURE_OAI_API_VERSION = os.environ.get("AZURE_OPENAI_API_VERSION")
-
-_vision_oai_client = None
+    return _get_client("agent")
 
 def get_vision_oai_client():
     """
@@ -71,20 +217,62 @@ def get_vision_oai_client():
         AzureOpenAI | None: The initialized client instance, or None if configuration
                             is missing or initialization fails.
     """
-    global _vision_oai_client
-    if _vision_oai_client is None:
-        if VISION_AZURE_OAI_ENDPOINT and VISION_AZURE_OAI_KEY and VISION_AZURE_OAI_DEPLOYMENT_NAME and VISION_AZURE_OAI_API_VERSION:
-            try:
-                _vision_oai_client = AzureOpenAI(
-                    azure_endpoint=VISION_AZURE_OAI_ENDPOINT,
-                    api_key=VISION_AZURE_OAI_KEY,
-                    api_version=VISION_AZURE_OAI_API_VERSION
-                )
-                logging.info("Vision AzureOpenAI client initialized.")
-            except Exception as e:
-                logging.error(f"Failed to initialize Vision AzureOpenAI client: {e}", exc_info=True)
-                return None
-        else:
-            logging.error("Vision AzureOpenAI client configuration missing.")
-            return None
-    return _vision_oai_client
\ No newline at end of file
+    return _get_client("vision")
+
+def _close_http_clients(http_clients: list):
+    for http_client in http_clients:
+        try:
+            http_client.close()
+        except Exception:
+            pass
+
+@atexit.register
+def close_clients():
+    """
+    Closes the shared HTTP connection pool, and any pools detached by
+    `reset_oai_clients`, and drops the cached clients.
+
+    Registered with atexit; also safe to call from tests. The next getter call
+    builds fresh clients on a new pool.
+    """
+    global _shared_http_client
+    with _http_client_lock:
+        http_client, _shared_http_client = _shared_http_client, None
+        _build_client.cache_clear()
+        get_azure_oai_client.cache_clear()
+        http_clients = [client for _, client in _detached_http_clients]
+        _detached_http_clients.clear()
+    if http_client is not None:
+        http_clients.append(http_client)
+    _close_http_clients(http_clients)
+
+def reset_oai_clients():
+    """
+    Drops the cached clients and detaches their connection pool so the next
+    getter call reconnects from scratch.
+
+    Meant for callers that hit `openai.APIConnectionError` (stale keep-alive
+    or TLS connections after DNS rotation or long idle). Agent and vision
+    share the pool, so both are rebuilt. Requests on other threads may still
+    be using the old pool, so it is closed by a later reset once the longest
+    request timeout has passed, or by `close_clients`.
+    """
+    global _shared_http_client
+    now = time.monotonic()
+    with _http_client_lock:
+        if _shared_http_client is not None:
+            _detached_http_clients.append((now, _shared_http_client))
+        _shared_http_client = None
+        _build_client.cache_clear()
+        get_azure_oai_client.cache_clear()
+        expired = [client for detached_at, client in _detached_http_clients if now - detached_at >= _READ_TIMEOUT_SECONDS]
+        _detached_http_clients[:] = [(detached_at, client) for detached_at, client in _detached_http_clients
+                                     if now - detached_at < _READ_TIMEOUT_SECONDS]
+    _close_http_clients(expired)
+    logger.info("AzureOpenAI clients reset; they will be rebuilt on next use.")
+
+# Opt-in warm-up: build both clients while the worker is loading instead of on
+# the first request that needs them.
+if _ENV.get("AZURE_OPENAI_EAGER_INIT") == "1":
+    get_agent_oai_client()
+    get_vision_oai_client()
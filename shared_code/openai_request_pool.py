@@ -0,0 +1,176 @@
+# INVOICEPROCESSINGAPP/shared_code/openai_request_pool.py
+"""
+Client-side rate limiting for concurrent Azure OpenAI calls.
+
+A `RequestPool` keeps a requests-per-minute and a tokens-per-minute budget
+(matching the deployment's RPM/TPM quota) that refill continuously. Each
+submitted call waits until both budgets can cover it, so a burst of
+concurrent calls queues locally instead of collecting 429s from the service.
+Rate-limit errors that still get through are retried with backoff, and the
+whole pool pauses while it cools down.
+
+This follows the token-bucket approach of the OpenAI cookbook's
+`api_request_parallel_processor.py`, adapted to awaitables.
+
+Budgets default to the `AZURE_OPENAI_MAX_RPM` and `AZURE_OPENAI_MAX_TPM`
+environment variables; `AZURE_OPENAI_MAX_CONCURRENCY` caps how many calls the
+batch helpers keep in flight at once.
+"""
+from __future__ import annotations
+
+import os
+import time
+import random
+import asyncio
+import logging
+
+DEFAULT_MAX_REQUESTS_PER_MINUTE = int(os.environ.get("AZURE_OPENAI_MAX_RPM", "60"))
+DEFAULT_MAX_TOKENS_PER_MINUTE = int(os.environ.get("AZURE_OPENAI_MAX_TPM", "60000"))
+# Upper bound on in-flight calls for the `*_many` helpers, independent of RPM/TPM.
+DEFAULT_MAX_CONCURRENCY = int(os.environ.get("AZURE_OPENAI_MAX_CONCURRENCY", "8"))
+
+# Azure counts an image at roughly 85 base tokens plus 170 per 512px tile; a
+# rendered A4 page at 'auto' detail usually lands on six tiles.
+IMAGE_TOKEN_ESTIMATE = 85 + 170 * 6
+
+_encoding = None
+
+def count_text_tokens(text: str) -> int:
+    """Counts tokens with tiktoken when it is installed, else approximates 4 characters per token."""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+def estimate_tokens(chat_completion_params: dict) -> int:
+    """
+    Estimates the tokens a chat completion request will consume against the TPM quota.
+
+    Counts the text of every message, a fixed cost per image part, and the
+    requested `max_tokens` (Azure reserves the completion budget up front).
+    """
+    total = 0
+    for message in chat_completion_params.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            total += count_text_tokens(content)
+        elif content:
+            for part in content:
+                if part.get("type") == "text":
+                    total += count_text_tokens(part.get("text", ""))
+                elif part.get("type") == "image_url":
+                    total += IMAGE_TOKEN_ESTIMATE
+    return total + (chat_completion_params.get("max_tokens") or 0)
+
+# Client errors worth retrying; any other 4xx (bad request, auth, not found, content
+# filter...) fails the same way every time.
+_RETRYABLE_CLIENT_STATUSES = (408, 409, 429)
+# Longest server-requested Retry-After we are willing to honour.
+_MAX_RETRY_AFTER_SECONDS = 60.0
+
+def retry_delay(error: Exception | None, attempt: int, base_delay: float = 1.0, max_delay: float = 30.0) -> float | None:
+    """
+    Returns how long to wait before retrying after `error`, or None if it should not be retried.
+
+    A Retry-After (or Azure's retry-after-ms) header on the error's response is used
+    as-is; otherwise the delay grows exponentially from `base_delay` with up to
+    `base_delay` of random jitter, capped at `max_delay`. Errors with a 4xx status
+    other than 408/409/429 are permanent. Errors without a status (timeouts,
+    connection errors, invalid model output; or `None`) are retried.
+
+    Args:
+        error: The exception from the failed attempt, or None for a non-API failure.
+        attempt (int): Zero-based number of the attempt that just failed.
+    """
+    status = getattr(error, "status_code", None)
+    if isinstance(status, int) and 400 <= status < 500 and status not in _RETRYABLE_CLIENT_STATUSES:
+        return None
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if headers:
+        try:
+            if headers.get("retry-after-ms"):
+                return min(float(headers["retry-after-ms"]) / 1000.0, _MAX_RETRY_AFTER_SECONDS)
+            if headers.get("retry-after"):
+                return min(float(headers["retry-after"]), _MAX_RETRY_AFTER_SECONDS)
+        except ValueError:
+            pass  # HTTP-date or garbage; fall back to our own backoff
+    return min(max_delay, base_delay * 2 ** attempt + random.uniform(0, base_delay))
+
+class RequestPool:
+    """
+    Async RPM/TPM throttle shared by concurrent Azure OpenAI calls.
+
+    Create one pool per batch (or per event loop) and pass it to every call in
+    that batch; the pool is not thread-safe.
+    """
+
+    def __init__(self, max_requests_per_minute: int = DEFAULT_MAX_REQUESTS_PER_MINUTE,
+                 max_tokens_per_minute: int = DEFAULT_MAX_TOKENS_PER_MINUTE,
+                 max_attempts: int = 3):
+        self.max_requests_per_minute = max_requests_per_minute
+        self.max_tokens_per_minute = max_tokens_per_minute
+        self.max_attempts = max_attempts
+        self.available_request_capacity = float(max_requests_per_minute)
+        self.available_token_capacity = float(max_tokens_per_minute)
+        self._last_update = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._last_update
+        self._last_update = now
+        self.available_request_capacity = min(
+            self.max_requests_per_minute,
+            self.available_request_capacity + elapsed * self.max_requests_per_minute / 60.0)
+        self.available_token_capacity = min(
+            self.max_tokens_per_minute,
+            self.available_token_capacity + elapsed * self.max_tokens_per_minute / 60.0)
+
+    async def _acquire(self, tokens: int):
+        # A single request larger than the whole budget would otherwise wait forever.
+        tokens = min(tokens, self.max_tokens_per_minute)
+        async with self._lock:
+            while True:
+                pause = self._paused_until - time.monotonic()
+                if pause > 0:
+                    await asyncio.sleep(pause)
+                self._refill()
+                if self.available_request_capacity >= 1 and self.available_token_capacity >= tokens:
+                    self.available_request_capacity -= 1
+                    self.available_token_capacity -= tokens
+                    return
+                wait_requests = (1 - self.available_request_capacity) * 60.0 / self.max_requests_per_minute
+                wait_tokens = (tokens - self.available_token_capacity) * 60.0 / self.max_tokens_per_minute
+                await asyncio.sleep(max(wait_requests, wait_tokens, 0.01))
+
+    async def submit(self, request_fn, token_estimate: int):
+        """
+        Waits for capacity, then awaits `request_fn()` and returns its result.
+
+        Args:
+            request_fn: Zero-argument callable returning an awaitable, e.g.
+                        `lambda: client.chat.completions.create(**params)`.
+            token_estimate (int): Tokens to charge against the TPM budget (see `estimate_tokens`).
+
+        Raises:
+            openai.RateLimitError: If the call is still throttled after `max_attempts`.
+            Exception: Any other error from `request_fn` is raised immediately.
+        """
+        from openai import RateLimitError
+        for attempt in range(self.max_attempts):
+            await self._acquire(token_estimate)
+            try:
+                return await request_fn()
+            except RateLimitError as e_rate:
+                if attempt + 1 >= self.max_attempts:
+                    raise
+                delay = retry_delay(e_rate, attempt, max_delay=60.0)
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                logging.warning(f"Azure OpenAI rate limit hit (attempt {attempt + 1}/{self.max_attempts}); pausing pool for {delay:.1f}s: {e_rate}")
@@ -3,68 +3,87 @@
 This module provides services for interacting with Azure OpenAI models
 for various tasks related to invoice and contract processing. It includes
 functions for:
-- Mapping columns from source data to a target schema.
+- Mapping columns from source data to a target schema (online, or in bulk via
+  the Batch API).
 - Correcting extracted invoice JSON data using vision capabilities by comparing
   against invoice images.
 - Extracting structured data from contract documents (images and text) into a
-  JSON array of items.
+  JSON array of items, or item by item as the response streams in.
 - Directly generating structured invoice data (header and line items) from
   invoice images using a vision model.
+
+The vision correction, contract extraction, invoice extraction and agent chat
+calls also have `async` variants (`*_async`, `correct_many`,
+`generate_invoice_data_many`, `achat_complete`) for processing many documents
+concurrently.
+
+openai itself is imported where a call needs it (see openai_clients), so
+importing this module does not load the SDK.
 """
+from __future__ import annotations
+
 import os
 import json
 import logging
 import time
-from openai import AzureOpenAI
+import asyncio
 import re
+import hashlib
+import threading
+from typing import TYPE_CHECKING
+from cachetools import TTLCache
 from .openai_clients import get_agent_oai_client, AGENT_AZURE_OAI_DEPLOYMENT_NAME
-from .openai_clients import get_vision_oai_client
+from .openai_clients import get_vision_oai_client, get_azure_oai_client, reset_oai_clients
+from .openai_clients import new_async_azure_oai_client, new_async_oai_client
+from .openai_request_pool import RequestPool, estimate_tokens, count_text_tokens, retry_delay, DEFAULT_MAX_CONCURRENCY
+from .json_utils import json_loads, json_dumps
+from . import pdf_utils
 
-def get_column_mappings_from_openai(actual_headers: list, target_schema_with_descriptions: dict, retries=2) -> dict:
-    """
-    Uses Azure OpenAI to map actual column headers from a dataset to a target schema.
+if TYPE_CHECKING:
+    from openai import AzureOpenAI, AsyncAzureOpenAI
 
-    Args:
-        actual_headers (list): A list of actual column header strings from the dataset.
-        target_schema_with_descriptions (dict): A dictionary where keys are target
-                                                semantic names and values are their descriptions.
-        retries (int, optional): The number of times to retry the OpenAI API call on failure.
-                                 Defaults to 2.
+# Markdown code fence some models wrap JSON in despite being told not to.
+_FENCE_RE = re.compile(r"```(?:json)?\s*\n?(.*?)\n?\s*```", re.DOTALL | re.IGNORECASE)
 
-    Returns:
-        dict: A dictionary where keys are target semantic names and values are the
-              mapped actual header names, or None if no match is found or an error occurs.
-              Returns a dictionary with all target names mapped to None on complete failure.
+def _strip_json_fence(cleaned_response: str) -> tuple[str, bool]:
+    """
+    Returns (json_text, stripped): the content of a markdown fence around the
+    (already stripped) response, or the response itself if it is unfenced.
+    """
+    # JSON mode and tool calls almost never fence their output; skip the scan then.
+    if cleaned_response[:1] in ("{", "[") and cleaned_response[-1:] in ("}", "]"):
+        return cleaned_response, False
+    match = _FENCE_RE.search(cleaned_response) if "```" in cleaned_response else None
+    return (match.group(1).strip(), True) if match else (cleaned_response, False)
+
+# Validated column mappings keyed by header layout + schema. PO exports from the
+# same system share a layout, so only the first file of each layout hits the model.
+_COLUMN_MAPPING_CACHE = TTLCache(maxsize=256, ttl=24 * 3600)
+_COLUMN_MAPPING_LOCK = threading.Lock()
+
+def _column_mapping_cache_key(actual_headers: list, target_schema_with_descriptions: dict) -> str:
+    payload = json_dumps({"h": sorted(map(str, actual_headers)), "s": list(target_schema_with_descriptions.items())})
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+def _column_mapping_config() -> tuple:
+    """
+    Returns (endpoint, key, deployment, api_version) for the column mapping model.
 
     Raises:
-        ValueError: If Azure OpenAI configuration is incomplete or client initialization fails.
+        ValueError: If any of the settings is missing.
     """
-    azure_oai_endpoint = os.environ.get("AZURE_OPENAI_ENDPOINT")
-    azure_oai_key = os.environ.get("AZURE_OPENAI_API_KEY")
-    azure_oai_column_map_deployment_name = os.environ.get("AZURE_OPENAI_COLUMN_MAP_DEPLOYMENT_NAME")
-    azure_oai_api_version = os.environ.get("AZURE_OPENAI_API_VERSION")
-
-    if not all([azure_oai_endpoint, azure_oai_key, azure_oai_column_map_deployment_name, azure_oai_api_version]):
+    config = (
+        os.environ.get("AZURE_OPENAI_ENDPOINT"),
+        os.environ.get("AZURE_OPENAI_API_KEY"),
+        os.environ.get("AZURE_OPENAI_COLUMN_MAP_DEPLOYMENT_NAME"),
+        os.environ.get("AZURE_OPENAI_API_VERSION"),
+    )
+    if not all(config):
         logging.error("Azure OpenAI configuration for Column Mapping Model not fully set.")
         raise ValueError("Azure OpenAI Column Mapping Model configuration not complete.")
+    return config
 
-    try:
-        client = AzureOpenAI(
-            azure_endpoint=azure_oai_endpoint,
-            api_key=azure_oai_key,
-            api_version=azure_oai_api_version
-        )
-    except Exception as e_client:
-        logging.error(f"Failed to initialize AzureOpenAI client for Column Mapping: {e_client}", exc_info=True)
-        raise ValueError(f"AzureOpenAI client initialization for Column Mapping failed: {e_client}")
-
-    target_schema_for_prompt = "\n".join([
-        f"- Target Semantic Name: \"{name}\", Description: \"{desc}\""
-        for name, desc in target_schema_with_descriptions.items()
-    ])
-    actual_headers_for_prompt = ", ".join([f'"{h}"' for h in actual_headers])
-
-    system_prompt_content = """
+_COLUMN_MAPPING_SYSTEM_PROMPT = """
 You are an expert data mapping assistant. Your task is to map a list of target semantic column names
 to a list of actual column headers found in a dataset.
 You MUST return your response as a single, valid JSON object.
@@ -74,15 +93,16 @@ or the exact string "NO_MATCH_FOUND" if no reasonable match is found.
 Prioritize direct or very close matches. Consider the provided "Description" for each target field.
 Be reasonably lenient if an exact wording match isn't present but the meaning is clear.
 """
-    user_prompt_content = f"""
+# Filled with str.format; literal braces in the example are doubled.
+_COLUMN_MAPPING_USER_PROMPT_TEMPLATE = """
 Here are the actual column headers from the dataset:
 --- ACTUAL HEADERS ---
-[{actual_headers_for_prompt}]
+[{actual_headers}]
 --- END ACTUAL HEADERS ---
 
 Here is my target schema, with the semantic meaning of each field I am looking for:
 --- TARGET SCHEMA ---
-{target_schema_for_prompt}
+{target_schema}
 --- END TARGET SCHEMA ---
 
 Provide ONLY the JSON object in your response. Example format:
@@ -92,108 +112,328 @@ Provide ONLY the JSON object in your response. Example format:
   "ItemName": "NO_MATCH_FOUND"
 }}
 """
-    logging.info(f"Sending request to Azure OpenAI Column Mapping Deployment '{azure_oai_column_map_deployment_name}'...")
-    response_content_str = None
-    for attempt in range(retries + 1):
-        try:
-            chat_completion = client.chat.completions.create(
-                model=azure_oai_column_map_deployment_name,
-                messages=[
-                    {"role": "system", "content": system_prompt_content},
-                    {"role": "user", "content": user_prompt_content}
-                ],
-                response_format={"type": "json_object"},
-                temperature=0.1
-            )
-            response_content_str = chat_completion.choices[0].message.content
-            if not response_content_str:
-                logging.warning(f"Attempt {attempt + 1}: Column Mapping Model returned empty content.")
-                if attempt < retries: time.sleep(2 * (attempt + 1)); continue
-                return {name: None for name in target_schema_with_descriptions.keys()}
-
-            mappings = json.loads(response_content_str)
-            validated_mappings = {}
-            logging.info("--- Column Mapping Model's Raw Suggestions ---")
-            for target_name_llm, actual_header_llm in mappings.items():
-                logging.info(f"  LLM suggested: '{target_name_llm}' -> '{actual_header_llm}'")
-                normalized_target_name_llm = None
-                for schema_target_name in target_schema_with_descriptions.keys():
-                    if schema_target_name.lower() == target_name_llm.lower():
-                        normalized_target_name_llm = schema_target_name; break
-                if not normalized_target_name_llm:
-                    logging.warning(f"  LLM returned target '{target_name_llm}' not in schema. Skipping.")
-                    continue
-                if actual_header_llm == "NO_MATCH_FOUND":
-                    validated_mappings[normalized_target_name_llm] = None
-                elif actual_header_llm in actual_headers:
-                    validated_mappings[normalized_target_name_llm] = actual_header_llm
-                else:
-                    found_case_insensitive = False
-                    for original_header in actual_headers:
-                        if str(original_header).lower() == str(actual_header_llm).lower():
-                            validated_mappings[normalized_target_name_llm] = original_header
-                            found_case_insensitive = True
-                            logging.info(f"    Info: Case-insensitive match for '{normalized_target_name_llm}': '{original_header}' (LLM said '{actual_header_llm}')")
-                            break
-                    if not found_case_insensitive:
-                        logging.warning(f"    LLM suggested '{actual_header_llm}' for '{normalized_target_name_llm}', not in actual headers. Marking as no match.")
-                        validated_mappings[normalized_target_name_llm] = None
-            for target_name_key in target_schema_with_descriptions.keys():
-                if target_name_key not in validated_mappings:
-                    logging.warning(f"  Target schema name '{target_name_key}' missing from LLM's response. Marking as no match.")
-                    validated_mappings[target_name_key] = None
-            return validated_mappings
-        except json.JSONDecodeError as e_json:
-            logging.error(f"Attempt {attempt + 1}: Column Mapping Model response not valid JSON. Error: {e_json}")
-            if response_content_str: logging.error(f"Response Text (first 500 chars): {response_content_str[:500]}")
-        except Exception as e_api:
-            logging.error(f"Attempt {attempt + 1}: Error calling Column Mapping Model: {e_api}", exc_info=True)
-            if hasattr(e_api, 'status_code'): logging.error(f"API Status Code: {e_api.status_code}")
-            if hasattr(e_api, 'response') and e_api.response is not None and hasattr(e_api.response, 'text'):
-                logging.error(f"API Response (first 500 chars): {e_api.response.text[:500]}")
-        if attempt < retries:
-            logging.info(f"Retrying Column Mapping Model call ({attempt + 1}/{retries})...")
-            time.sleep(3 * (attempt + 1))
+
+def _column_mapping_messages(actual_headers: list, target_schema_with_descriptions: dict) -> list[dict]:
+    """Builds the system and user messages asking the model to map `actual_headers` onto the target schema."""
+    target_schema_for_prompt = "\n".join([
+        f"- Target Semantic Name: \"{name}\", Description: \"{desc}\""
+        for name, desc in target_schema_with_descriptions.items()
+    ])
+    actual_headers_for_prompt = ", ".join([f'"{h}"' for h in actual_headers])
+
+    user_prompt_content = _COLUMN_MAPPING_USER_PROMPT_TEMPLATE.format(
+        actual_headers=actual_headers_for_prompt, target_schema=target_schema_for_prompt)
+    return [
+        {"role": "system", "content": _COLUMN_MAPPING_SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt_content}
+    ]
+
+def _validate_column_mappings(mappings: dict, actual_headers: list, target_schema_with_descriptions: dict) -> dict:
+    """
+    Checks the model's suggested mappings against the real headers and schema.
+
+    Target names are matched case-insensitively to the schema; suggested headers must
+    exist in `actual_headers` (exactly or case-insensitively). Anything else, and any
+    schema name the model left out, maps to None.
+    """
+    validated_mappings = {}
+    headers_set = set(actual_headers)
+    # Lowercase -> original; setdefault keeps the first of any case-colliding names,
+    # matching the first-hit behaviour of a linear scan.
+    headers_ci = {}
+    for original_header in actual_headers:
+        headers_ci.setdefault(str(original_header).lower(), original_header)
+    schema_ci = {}
+    for schema_target_name in target_schema_with_descriptions:
+        schema_ci.setdefault(schema_target_name.lower(), schema_target_name)
+
+    logging.info("--- Column Mapping Model's Raw Suggestions ---")
+    for target_name_llm, actual_header_llm in mappings.items():
+        logging.info(f"  LLM suggested: '{target_name_llm}' -> '{actual_header_llm}'")
+        normalized_target_name_llm = schema_ci.get(target_name_llm.lower())
+        if not normalized_target_name_llm:
+            logging.warning(f"  LLM returned target '{target_name_llm}' not in schema. Skipping.")
+            continue
+        if actual_header_llm == "NO_MATCH_FOUND":
+            validated_mappings[normalized_target_name_llm] = None
+        elif actual_header_llm in headers_set:
+            validated_mappings[normalized_target_name_llm] = actual_header_llm
         else:
-            logging.error("Max retries for Column Mapping Model. Failed to get mappings.")
-            return {name: None for name in target_schema_with_descriptions.keys()}
-    return {name: None for name in target_schema_with_descriptions.keys()}
+            original_header = headers_ci.get(str(actual_header_llm).lower())
+            if original_header is not None:
+                validated_mappings[normalized_target_name_llm] = original_header
+                logging.info(f"    Info: Case-insensitive match for '{normalized_target_name_llm}': '{original_header}' (LLM said '{actual_header_llm}')")
+            else:
+                logging.warning(f"    LLM suggested '{actual_header_llm}' for '{normalized_target_name_llm}', not in actual headers. Marking as no match.")
+                validated_mappings[normalized_target_name_llm] = None
+    for target_name_key in target_schema_with_descriptions.keys():
+        if target_name_key not in validated_mappings:
+            logging.warning(f"  Target schema name '{target_name_key}' missing from LLM's response. Marking as no match.")
+            validated_mappings[target_name_key] = None
+    return validated_mappings
 
-def correct_invoice_json_with_vision(images_base64: list[str], current_json_data_str: str, retries=2) -> str | None:
+def get_column_mappings_from_openai(actual_headers: list, target_schema_with_descriptions: dict, retries=2) -> dict:
     """
-    Uses an Azure OpenAI vision model to correct invoice JSON data based on provided images.
+    Uses Azure OpenAI to map actual column headers from a dataset to a target schema.
 
     Args:
-        images_base64 (list[str]): A list of base64 encoded PNG image strings of the invoice pages.
-        current_json_data_str (str): A string containing the current JSON data extracted
-                                     from the invoice, which needs verification and correction.
+        actual_headers (list): A list of actual column header strings from the dataset.
+        target_schema_with_descriptions (dict): A dictionary where keys are target
+                                                semantic names and values are their descriptions.
         retries (int, optional): The number of times to retry the OpenAI API call on failure.
                                  Defaults to 2.
 
     Returns:
-        str | None: A string containing the corrected JSON data if successful,
-                    otherwise None. The output is a JSON string.
+        dict: A dictionary where keys are target semantic names and values are the
+              mapped actual header names, or None if no match is found or an error occurs.
+              Returns a dictionary with all target names mapped to None on complete failure.
+
+    Raises:
+        ValueError: If Azure OpenAI configuration is incomplete or client initialization fails.
     """
-    azure_oai_endpoint = os.environ.get("AZURE_OPENAI_ENDPOINT")
-    azure_oai_key = os.environ.get("AZURE_OPENAI_API_KEY")
-    azure_oai_vision_deployment_name = os.environ.get("AZURE_OPENAI_VISION_CORRECTION_DEPLOYMENT_NAME")
-    azure_oai_api_version = os.environ.get("AZURE_OPENAI_API_VERSION")
+    azure_oai_endpoint, azure_oai_key, azure_oai_column_map_deployment_name, azure_oai_api_version = _column_mapping_config()
 
-    if not all([azure_oai_endpoint, azure_oai_key, azure_oai_vision_deployment_name, azure_oai_api_version]):
-        logging.error("Azure OpenAI configuration for Vision Correction Model not fully set.")
-        return None
+    cache_key = _column_mapping_cache_key(actual_headers, target_schema_with_descriptions)
+    with _COLUMN_MAPPING_LOCK:
+        cached_mappings = _COLUMN_MAPPING_CACHE.get(cache_key)
+    if cached_mappings is not None:
+        logging.info("Using cached column mappings for this header layout.")
+        return dict(cached_mappings)
 
     try:
-        client = AzureOpenAI(
-            azure_endpoint=azure_oai_endpoint,
-            api_key=azure_oai_key,
-            api_version=azure_oai_api_version
-        )
+        get_azure_oai_client(azure_oai_endpoint, azure_oai_key, azure_oai_api_version)
     except Exception as e_client:
-        logging.error(f"Failed to initialize AzureOpenAI client for Vision Correction: {e_client}", exc_info=True)
+        logging.error(f"Failed to initialize AzureOpenAI client for Column Mapping: {e_client}", exc_info=True)
+        raise ValueError(f"AzureOpenAI client initialization for Column Mapping failed: {e_client}")
+
+    chat_completion_params = {
+        "model": azure_oai_column_map_deployment_name,
+        "messages": _column_mapping_messages(actual_headers, target_schema_with_descriptions),
+        "response_format": {"type": "json_object"},
+        "temperature": 0.1
+    }
+    logging.info(f"Sending request to Azure OpenAI Column Mapping Deployment '{azure_oai_column_map_deployment_name}'...")
+    validated_mappings = _call_with_retries(
+        "Column Mapping Model", lambda: get_azure_oai_client(azure_oai_endpoint, azure_oai_key, azure_oai_api_version),
+        chat_completion_params, lambda raw: _validate_column_mappings(json_loads(raw), actual_headers, target_schema_with_descriptions),
+        retries)
+    if validated_mappings is None:
+        return {name: None for name in target_schema_with_descriptions.keys()}
+    with _COLUMN_MAPPING_LOCK:
+        _COLUMN_MAPPING_CACHE[cache_key] = dict(validated_mappings)
+    return validated_mappings
+
+_BATCH_TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+def _run_chat_batch(client: AzureOpenAI, requests: list[dict], poll_interval_seconds: float = 60,
+                    timeout_seconds: float = 24 * 3600) -> list[str | None]:
+    """
+    Runs chat completion requests through the Azure OpenAI Batch API and waits for the results.
+
+    Each request dict is a complete chat completion body (including "model", which must be a
+    Global Batch deployment). The requests are uploaded as one JSONL file, submitted as a
+    batch with a 24h completion window, and polled until the batch finishes.
+
+    Args:
+        client (AzureOpenAI): Client for the resource hosting the batch deployment.
+        requests (list[dict]): Chat completion request bodies.
+        poll_interval_seconds (float, optional): Delay between status checks. Defaults to 60.
+        timeout_seconds (float, optional): Give up (and cancel the batch) after this long.
+                                           Defaults to 24 hours.
+
+    Returns:
+        list[str | None]: The message content (or, for a forced tool call, the tool call's
+                          arguments) for each request, in input order; None for requests
+                          that failed or when the batch did not complete.
+    """
+    results = [None] * len(requests)
+    if not requests:
+        return results
+
+    jsonl = "\n".join(
+        json_dumps({"custom_id": str(idx), "method": "POST", "url": "/chat/completions", "body": body})
+        for idx, body in enumerate(requests)
+    )
+    batch_file = client.files.create(file=("batch_input.jsonl", jsonl.encode("utf-8")), purpose="batch")
+    batch = client.batches.create(input_file_id=batch_file.id, endpoint="/chat/completions", completion_window="24h")
+    logging.info(f"Submitted batch '{batch.id}' with {len(requests)} requests.")
+
+    deadline = time.monotonic() + timeout_seconds
+    while batch.status not in _BATCH_TERMINAL_STATUSES:
+        if time.monotonic() > deadline:
+            logging.error(f"Batch '{batch.id}' did not finish within {timeout_seconds}s (status '{batch.status}'). Cancelling.")
+            try: client.batches.cancel(batch.id)
+            except Exception as e_cancel: logging.warning(f"Could not cancel batch '{batch.id}': {e_cancel}")
+            return results
+        time.sleep(poll_interval_seconds)
+        batch = client.batches.retrieve(batch.id)
+
+    if batch.status != "completed" or not batch.output_file_id:
+        logging.error(f"Batch '{batch.id}' ended with status '{batch.status}'. Errors: {batch.errors}")
+        return results
+
+    for line in client.files.content(batch.output_file_id).text.splitlines():
+        if not line.strip():
+            continue
+        record = json_loads(line)
+        response = record.get("response") or {}
+        if response.get("status_code") != 200:
+            logging.warning(f"Batch '{batch.id}' request {record.get('custom_id')} failed: {record.get('error') or response.get('body')}")
+            continue
+        message = response["body"]["choices"][0]["message"]
+        tool_calls = message.get("tool_calls")
+        results[int(record["custom_id"])] = tool_calls[0]["function"]["arguments"] if tool_calls else message.get("content")
+    return results
+
+def get_column_mappings_batch(inputs: list[tuple[list, dict]], poll_interval_seconds: float = 60,
+                              timeout_seconds: float = 24 * 3600) -> list[dict]:
+    """
+    Maps the columns of many datasets at once through the Azure OpenAI Batch API.
+
+    Batch requests are billed at a discount and don't count against the online
+    deployment's rate limit, at the cost of latency (results can take up to 24h).
+    Meant for bulk/offline jobs; interactive callers should keep using
+    `get_column_mappings_from_openai`.
+
+    Uses `AZURE_OPENAI_COLUMN_MAP_BATCH_DEPLOYMENT_NAME` (a Global Batch deployment),
+    falling back to `AZURE_OPENAI_COLUMN_MAP_DEPLOYMENT_NAME`.
+
+    Args:
+        inputs (list[tuple[list, dict]]): (actual_headers, target_schema_with_descriptions) per dataset.
+        poll_interval_seconds (float, optional): Delay between batch status checks. Defaults to 60.
+        timeout_seconds (float, optional): Maximum time to wait for the batch. Defaults to 24 hours.
+
+    Returns:
+        list[dict]: One validated mapping per input, in order. Datasets whose request failed
+                    get every target name mapped to None.
+
+    Raises:
+        ValueError: If Azure OpenAI configuration is incomplete or client initialization fails.
+    """
+    azure_oai_endpoint, azure_oai_key, azure_oai_column_map_deployment_name, azure_oai_api_version = _column_mapping_config()
+    deployment_name = os.environ.get("AZURE_OPENAI_COLUMN_MAP_BATCH_DEPLOYMENT_NAME", azure_oai_column_map_deployment_name)
+
+    try:
+        client = get_azure_oai_client(azure_oai_endpoint, azure_oai_key, azure_oai_api_version)
+    except Exception as e_client:
+        logging.error(f"Failed to initialize AzureOpenAI client for Column Mapping batch: {e_client}", exc_info=True)
+        raise ValueError(f"AzureOpenAI client initialization for Column Mapping failed: {e_client}")
+
+    requests = [
+        {
+            "model": deployment_name,
+            "messages": _column_mapping_messages(actual_headers, target_schema),
+            "response_format": {"type": "json_object"},
+            "temperature": 0.1
+        }
+        for actual_headers, target_schema in inputs
+    ]
+    try:
+        contents = _run_chat_batch(client, requests, poll_interval_seconds, timeout_seconds)
+    except Exception as e_batch:
+        logging.error(f"Column Mapping batch failed: {e_batch}", exc_info=True)
+        contents = [None] * len(inputs)
+
+    results = []
+    for (actual_headers, target_schema), content in zip(inputs, contents):
+        try:
+            results.append(_validate_column_mappings(json_loads(content), actual_headers, target_schema) if content
+                           else {name: None for name in target_schema.keys()})
+        except (json.JSONDecodeError, AttributeError) as e_parse:
+            logging.error(f"Column Mapping batch result not valid JSON mappings: {e_parse}")
+            results.append({name: None for name in target_schema.keys()})
+    return results
+
+def _log_api_error(model_label: str, attempt: int, e_api: Exception):
+    """
+    Logs an exception raised by a chat completion call. The traceback is left to the
+    final "Max retries" log; the HTTP response body is only logged at DEBUG level.
+    """
+    logging.error("Attempt %d: Error calling %s: %s (status %s) - %s", attempt + 1, model_label,
+                  type(e_api).__name__, getattr(e_api, 'status_code', 'n/a'), e_api)
+    if not logging.root.isEnabledFor(logging.DEBUG):
+        return
+    if getattr(e_api, 'response', None) is not None:
+        try: logging.debug("API Error details (JSON): %s", e_api.response.json())
+        except (json.JSONDecodeError, ValueError): logging.debug("API Error details (text, first 500): %.500s", getattr(e_api.response, 'text', 'N/A'))
+    elif hasattr(e_api, 'message'): logging.debug("API Error message: %s", e_api.message)
+
+def _log_usage(model_label: str, usage) -> None:
+    """Logs a completion's token usage, including prompt tokens served from Azure's prompt cache."""
+    if usage is None or not logging.root.isEnabledFor(logging.INFO):
+        return
+    cached_tokens = getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", None) or 0
+    logging.info("%s usage: %s prompt tokens (%s cached), %s completion tokens.", model_label,
+                 usage.prompt_tokens, cached_tokens, usage.completion_tokens)
+
+def _log_json_error(model_label: str, attempt: int, e_json: json.JSONDecodeError, raw_model_response_str: str | None):
+    """Logs a JSON parse failure together with the raw and (if different) the de-fenced response text."""
+    logging.error("Attempt %d: Failed to parse JSON from %s. Error: %s", attempt + 1, model_label, e_json)
+    if raw_model_response_str: logging.error("Raw Model Response (first 500 chars): %.500s", raw_model_response_str)
+    if e_json.doc and e_json.doc != raw_model_response_str: logging.error("Attempted to parse (first 500 chars): %.500s", e_json.doc)
+
+def _vision_correction_config() -> tuple | None:
+    """Returns (endpoint, key, deployment, api_version) for the vision correction model, or None if incomplete."""
+    config = (
+        os.environ.get("AZURE_OPENAI_ENDPOINT"),
+        os.environ.get("AZURE_OPENAI_API_KEY"),
+        os.environ.get("AZURE_OPENAI_VISION_CORRECTION_DEPLOYMENT_NAME"),
+        os.environ.get("AZURE_OPENAI_API_VERSION"),
+    )
+    if not all(config):
+        logging.error("Azure OpenAI configuration for Vision Correction Model not fully set.")
         return None
+    return config
+
+def _vision_image_part(img_b64: str) -> dict:
+    """
+    Builds an image_url message part for a page image, shrunk and JPEG-encoded
+    first (see `pdf_utils.shrink_image_base64`). Small images use low detail,
+    which skips high-resolution tiling.
+    """
+    image_b64, mime_type, long_side = pdf_utils.shrink_image_base64(img_b64)
+    detail = "low" if 0 < long_side <= pdf_utils.VISION_LOW_DETAIL_MAX_SIDE else "auto"
+    return {"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{image_b64}", "detail": detail}}
+
+def _page_digest(img_b64: str) -> bytes:
+    """Identifies a page image by content, for spotting pages that repeat an earlier one."""
+    return hashlib.blake2b(img_b64.encode(), digest_size=16).digest()
 
-    system_prompt_content = """
+def _dedupe_pages(images_base64: list[str]) -> tuple[list[str], str | None]:
+    """
+    Drops pages whose image is identical to an earlier page (scanned PDFs often repeat
+    terms, cover or separator sheets). Returns the unique images and a note telling the
+    model which pages were left out, or None if there were no duplicates.
+    """
+    first_page = {}
+    unique_images = []
+    repeats = []
+    for page_num, img_b64 in enumerate(images_base64, start=1):
+        digest = _page_digest(img_b64)
+        if digest in first_page:
+            repeats.append(f"page {page_num} (same as page {first_page[digest]})")
+        else:
+            first_page[digest] = page_num
+            unique_images.append(img_b64)
+    if not repeats:
+        return images_base64, None
+    logging.info(f"Skipped {len(repeats)} duplicate page image(s).")
+    return unique_images, "These pages repeat an earlier page and are not included again: " + ", ".join(repeats) + "."
+
+def _vision_image_parts(images_base64: list[str]) -> list[dict]:
+    """Builds image_url parts for a document's pages, skipping exact duplicates (see `_dedupe_pages`)."""
+    unique_images, _ = _dedupe_pages(images_base64)
+    return [_vision_image_part(img_b64) for img_b64 in unique_images]
+
+# Fixed text parts of the user messages; the API client only reads them, so they are shared across requests.
+_CORRECTION_INSTRUCTION_PART = {"type": "text", "text": "Please review the following invoice images and correct the provided JSON data based on the visual information. Ensure all values accurately reflect the content of the images. Here is the JSON data that needs verification and correction (ensure your response is ONLY the corrected JSON object, without any markdown wrappers):"}
+_BATCH_CORRECTION_INSTRUCTION_PART = {"type": "text", "text": "Please review the following invoices and correct each one's JSON data based on its own images."}
+_BATCH_DOC_END_PART = {"type": "text", "text": "</doc>"}
+_CONTRACT_INSTRUCTION_PART = {"type": "text", "text": "Please analyze the following contract document (images and text content) and extract the information into the specified JSON format. Here is the extracted text from the PDF:"}
+_CONTRACT_NO_TEXT_PART = {"type": "text", "text": "No text content could be extracted from the PDF. Please rely on the images."}
+_INVOICE_EXTRACTION_INSTRUCTION_PART = {"type": "text", "text": "Please analyze the following invoice images and extract all header and line item data into the specified JSON format."}
+
+_VISION_CORRECTION_SYSTEM_PROMPT = """
 You are a meticulous AI data verification assistant. Your task is to review the provided invoice images
 and the associated JSON data extracted from a database.
 Your goal is to correct any discrepancies in the JSON data based *solely* on the visual information present in the images.
@@ -207,105 +447,539 @@ only modifying the values where necessary. Ensure the output is a single, valid
 You can remove the line items if you think they are not the actual line items based on the images I give you. Do not correct any calculation; just give me the JSON file which truly represents current data.
 Remove any line items which aren't actual line items (for example, if freight amount or something else which isn't a line item is passed in the JSON as a line item, REMOVE THAT).
 """
+
+# Output caps for the vision calls. The requested max_tokens is reserved against the
+# deployment's TPM quota up front, so it is sized from the input instead of always the cap.
+_CORRECTION_MAX_OUTPUT_TOKENS = 4096
+_CONTRACT_MAX_OUTPUT_TOKENS = 8192
+# A contract answer cut off at max_tokens is retried with double the budget up to this.
+_CONTRACT_RETRY_MAX_OUTPUT_TOKENS = 16384
+# Every item repeats all of its keys and the contract-level fields, so one line of a
+# price list costs far more output tokens than input tokens.
+_CONTRACT_TOKENS_PER_ITEM = 128
+_DIGIT_RE = re.compile(r"\d")
+
+def _correction_max_tokens(current_json_data_str: str) -> int:
+    """The corrected JSON is about as long as the input JSON; allow 30% growth plus headroom."""
+    return min(_CORRECTION_MAX_OUTPUT_TOKENS, int(count_text_tokens(current_json_data_str) * 1.3) + 512)
+
+def _contract_max_tokens(pdf_text_content: str) -> int:
+    """
+    Sized from the contract text: its token count, or one item per line with a number
+    on it (price lists), whichever is larger. Scanned contracts without a text layer
+    get the full cap.
+    """
+    if not pdf_text_content:
+        return _CONTRACT_MAX_OUTPUT_TOKENS
+    item_lines = sum(1 for line in pdf_text_content.splitlines() if _DIGIT_RE.search(line))
+    estimate = max(count_text_tokens(pdf_text_content), item_lines * _CONTRACT_TOKENS_PER_ITEM) + 1024
+    return min(_CONTRACT_MAX_OUTPUT_TOKENS, max(2048, estimate))
+
+def _vision_correction_params(images_base64: list[str], current_json_data_str: str, deployment_name: str, api_version: str,
+                              max_tokens: int | None = None) -> dict:
+    """Builds the chat completion request for correcting invoice JSON against page images."""
     user_message_content = [
-        {"type": "text", "text": "Please review the following invoice images and correct the provided JSON data based on the visual information. Ensure all values accurately reflect the content of the images. Here is the JSON data that needs verification and correction (ensure your response is ONLY the corrected JSON object, without any markdown wrappers):"},
-        {"type": "text", "text": current_json_data_str}
+        _CORRECTION_INSTRUCTION_PART,
+        {"type": "text", "text": current_json_data_str},
+        *_vision_image_parts(images_base64)
     ]
-    for img_b64 in images_base64:
-        user_message_content.append({"type": "image_url", "image_url": {"url": f"data:image/png;base64,{img_b64}", "detail": "auto"}})
 
-    logging.info(f"Sending request with {len(images_base64)} images to Azure OpenAI Vision Correction Deployment '{azure_oai_vision_deployment_name}'.")
-    raw_model_response_str = None
-    json_to_parse = None
+    chat_completion_params = {
+        "model": deployment_name,
+        "messages": [{"role": "system", "content": _VISION_CORRECTION_SYSTEM_PROMPT}, {"role": "user", "content": user_message_content}],
+        "temperature": 0.1,
+        "max_tokens": max_tokens or _correction_max_tokens(current_json_data_str)
+    }
+    if api_version >= "2023-12-01-preview":
+        chat_completion_params["response_format"] = {"type": "json_object"}
+        logging.info("Attempting to use response_format: json_object for vision correction.")
+    return chat_completion_params
+
+def _parse_vision_correction_response(raw_model_response_str: str) -> dict:
+    """
+    Strips any markdown fence from the model output and returns the parsed
+    corrected JSON. Raises json.JSONDecodeError on invalid JSON.
+    """
+    cleaned_response = raw_model_response_str.strip()
+    json_to_parse, stripped = _strip_json_fence(cleaned_response)
+    if stripped: logging.info(f"Stripped markdown from vision model response. Original len: {len(cleaned_response)}, Cleaned len: {len(json_to_parse)}")
+    else: logging.info("No markdown detected in vision model response.")
+
+    return json_loads(json_to_parse)
+
+async def _acreate(client: AsyncAzureOpenAI, chat_completion_params: dict, pool: RequestPool | None, token_estimate: int = 0):
+    """Awaits a chat completion, throttled through `pool` when one is given."""
+    if pool is None:
+        return await client.chat.completions.create(**chat_completion_params)
+    return await pool.submit(lambda: client.chat.completions.create(**chat_completion_params), token_estimate)
+
+def _check_json_start(parts: list[str]) -> bool:
+    """
+    Returns True once the streamed text has a first non-whitespace character and it
+    opens a JSON object (or a markdown fence around one); False while nothing has
+    arrived yet. Raises json.JSONDecodeError as soon as the output clearly isn't JSON.
+    """
+    head = "".join(parts).lstrip()
+    if not head:
+        return False
+    if head[0] not in "{`":
+        raise json.JSONDecodeError("Model output does not start with a JSON object", head, 0)
+    return True
+
+class _TruncatedOutputError(ValueError):
+    """The model stopped at `max_tokens`, so its JSON output is incomplete."""
+
+def _grow_max_tokens(chat_completion_params: dict, max_output_tokens: int) -> bool:
+    """
+    Doubles the request's max_tokens, up to `max_output_tokens`, after a truncated
+    answer. Returns False if it is already at the limit, since retrying with the same
+    budget would be cut off again.
+    """
+    if chat_completion_params["max_tokens"] >= max_output_tokens:
+        return False
+    chat_completion_params["max_tokens"] = min(2 * chat_completion_params["max_tokens"], max_output_tokens)
+    logging.warning("Model output hit the token limit; retrying with max_tokens=%d.", chat_completion_params["max_tokens"])
+    return True
+
+def _stream_choice_text(choice) -> str | None:
+    """
+    Returns the text a streamed choice adds: its content delta, or the argument delta
+    of a (forced) tool call. Raises _TruncatedOutputError on the chunk that ends the
+    answer at the token limit.
+    """
+    if choice.finish_reason == "length":
+        raise _TruncatedOutputError("Model output was cut off at max_tokens.")
+    delta = choice.delta
+    if delta is None:
+        return None
+    if delta.content:
+        return delta.content
+    if delta.tool_calls and delta.tool_calls[0].function:
+        return delta.tool_calls[0].function.arguments
+    return None
+
+def _iter_stream_deltas(stream):
+    """Yields the non-empty text deltas of a chat completion stream, closing the stream when done."""
+    try:
+        for chunk in stream:
+            if not chunk.choices:
+                # Azure sends content-filter results in choice-less chunks; with
+                # include_usage the last chunk carries the token usage.
+                _log_usage(chunk.model, getattr(chunk, "usage", None))
+                continue
+            delta = _stream_choice_text(chunk.choices[0])
+            if delta:
+                yield delta
+    finally:
+        stream.close()
+
+def _stream_completion_content(client: AzureOpenAI, chat_completion_params: dict) -> str:
+    """
+    Runs a streamed chat completion and returns the assembled message content.
+
+    Streaming lets a malformed answer fail on its first token instead of after the
+    whole (often multi-thousand-token) response has been generated.
+    """
+    parts = []
+    started = False
+    deltas = _iter_stream_deltas(client.chat.completions.create(**chat_completion_params, stream=True))
+    try:
+        for delta in deltas:
+            parts.append(delta)
+            if not started:
+                started = _check_json_start(parts)
+    finally:
+        deltas.close()
+    return "".join(parts)
+
+async def _astream_completion_content(client: AsyncAzureOpenAI, chat_completion_params: dict,
+                                      pool: RequestPool | None = None, token_estimate: int = 0) -> str:
+    """Async counterpart of `_stream_completion_content`, throttled through `pool` when given."""
+    parts = []
+    started = False
+    stream = await _acreate(client, {**chat_completion_params, "stream": True}, pool, token_estimate)
+    try:
+        async for chunk in stream:
+            if not chunk.choices:
+                _log_usage(chunk.model, getattr(chunk, "usage", None))
+                continue
+            delta = _stream_choice_text(chunk.choices[0])
+            if delta:
+                parts.append(delta)
+                if not started:
+                    started = _check_json_start(parts)
+    finally:
+        await stream.close()
+    return "".join(parts)
+
+class _EmptyOutputError(ValueError):
+    """The model returned no content."""
+
+def _after_failed_attempt(model_label: str, chat_completion_params: dict, max_output_tokens: int | None,
+                          attempt: int, retries: int, error: Exception, raw_model_response_str: str | None) -> float | None:
+    """
+    Handles a failed attempt of a streamed JSON call: logs it, adjusts the request where
+    that lets the next attempt succeed, and returns the seconds to wait before retrying,
+    or None to give up.
+
+    A truncated answer is retried straight away with double the max_tokens (up to
+    `max_output_tokens`; not at all when it is None), and a rejected structured-output
+    request straight away in json_object mode. Other failures are retried after `retry_delay`.
+    """
+    retry_error = None
+    retry_now = False
+    if isinstance(error, json.JSONDecodeError):
+        _log_json_error(model_label, attempt, error, raw_model_response_str)
+    elif isinstance(error, _TruncatedOutputError):
+        if max_output_tokens is None or not _grow_max_tokens(chat_completion_params, max_output_tokens):
+            logging.error("Attempt %d: %s output does not fit in max_tokens=%s. Giving up.",
+                          attempt + 1, model_label, chat_completion_params.get("max_tokens"))
+            return None
+        retry_now = True
+    elif isinstance(error, _EmptyOutputError):
+        logging.warning("Attempt %d: %s returned empty content.", attempt + 1, model_label)
+    elif isinstance(error, ValueError):
+        logging.error("Attempt %d: %s: %s", attempt + 1, model_label, error)
+    else:
+        retry_now = _fall_back_to_json_object(chat_completion_params, error)
+        retry_error = None if retry_now else error
+        _log_api_error(model_label, attempt, error)
+    delay = (0 if retry_now else retry_delay(retry_error, attempt)) if attempt < retries else None
+    if delay is None:
+        logging.error("Max retries for %s. Failed to get valid JSON.", model_label, exc_info=retry_error)
+    else:
+        logging.info("Retrying %s call (%d/%d)...", model_label, attempt + 2, retries + 1)
+    return delay
+
+def _call_with_retries(model_label: str, get_client, chat_completion_params: dict, parse, retries: int,
+                       max_output_tokens: int | None = None):
+    """
+    Streams `chat_completion_params` through the client from `get_client()` and returns
+    `parse(content)`. Failed attempts are handled by `_after_failed_attempt`; returns
+    None once it gives up.
+
+    A connection error resets the shared clients (see `reset_oai_clients`), so
+    `get_client` should fetch the client anew on every call.
+    """
+    from openai import APIConnectionError
     for attempt in range(retries + 1):
+        raw_model_response_str = None
         try:
-            chat_completion_params = {
-                "model": azure_oai_vision_deployment_name,
-                "messages": [{"role": "system", "content": system_prompt_content}, {"role": "user", "content": user_message_content}],
-                "temperature": 0.1,
-                "max_tokens": 4096
-            }
-            if azure_oai_api_version >= "2023-12-01-preview":
-                try:
-                    chat_completion_params["response_format"] = {"type": "json_object"}
-                    logging.info("Attempting to use response_format: json_object for vision correction.")
-                except Exception as e_rf:
-                    logging.warning(f"Could not set response_format for vision correction: {e_rf}")
-
-            chat_completion = client.chat.completions.create(**chat_completion_params)
-            raw_model_response_str = chat_completion.choices[0].message.content
+            raw_model_response_str = _stream_completion_content(get_client(), chat_completion_params)
             if not raw_model_response_str:
-                logging.warning(f"Attempt {attempt + 1}: Vision Correction Model returned empty content.")
-                if attempt < retries: time.sleep(5 * (attempt + 1)); continue
-                return None
-
-            cleaned_response = raw_model_response_str.strip()
-            match = re.search(r"```(?:json)?\s*\n?(.*?)\n?\s*```", cleaned_response, re.DOTALL | re.IGNORECASE)
-            json_to_parse = match.group(1).strip() if match else cleaned_response
-            if match: logging.info(f"Stripped markdown from vision model response. Original len: {len(cleaned_response)}, Cleaned len: {len(json_to_parse)}")
-            else: logging.info("No markdown detected in vision model response.")
-
-            parsed_json = json.loads(json_to_parse)
-            logging.info(f"Attempt {attempt + 1}: Vision Correction Model returned valid JSON.")
-            return json.dumps(parsed_json, indent=2)
-        except json.JSONDecodeError as e_json:
-            logging.error(f"Attempt {attempt + 1}: Failed to parse JSON from Vision Model. Error: {e_json}")
-            if raw_model_response_str: logging.error(f"Raw Model Response (first 500 chars): {raw_model_response_str[:500]}")
-            if json_to_parse and json_to_parse != raw_model_response_str: logging.error(f"Attempted to parse (first 500 chars): {json_to_parse[:500]}")
-        except Exception as e_api:
-            logging.error(f"Attempt {attempt + 1}: Error calling Vision Model: {type(e_api).__name__} - {e_api}", exc_info=True)
-            if hasattr(e_api, 'status_code'): logging.error(f"API Status Code: {e_api.status_code}")
-            if hasattr(e_api, 'response') and e_api.response is not None:
-                 try: logging.error(f"API Error details (JSON): {e_api.response.json()}")
-                 except json.JSONDecodeError: logging.error(f"API Error details (text, first 500): {e_api.response.text[:500] if hasattr(e_api.response, 'text') else 'N/A'}")
-            elif hasattr(e_api, 'message'): logging.error(f"API Error message: {e_api.message}")
-        if attempt < retries:
-            logging.info(f"Retrying Vision Correction Model call ({attempt + 2}/{retries + 1})...")
-            time.sleep(5 * (attempt + 1))
-        else:
-            logging.error("Max retries for Vision Correction Model. Failed to get corrected JSON.")
+                raise _EmptyOutputError()
+            result = parse(raw_model_response_str)
+            logging.info("Attempt %d: %s returned valid JSON.", attempt + 1, model_label)
+            return result
+        except Exception as error:
+            delay = _after_failed_attempt(model_label, chat_completion_params, max_output_tokens, attempt, retries,
+                                          error, raw_model_response_str)
+            if isinstance(error, APIConnectionError) and delay is not None:
+                reset_oai_clients()
+        if delay is None:
             return None
+        time.sleep(delay)
     return None
 
-def extract_contract_data_as_json(images_base64: list[str], pdf_text_content: str, original_filename: str, retries=2) -> str | None:
+async def _acall_with_retries(model_label: str, client: AsyncAzureOpenAI, chat_completion_params: dict, parse, retries: int,
+                              max_output_tokens: int | None = None, pool: RequestPool | None = None, new_client=None):
     """
-    Extracts structured data from contract document images and text using an Azure OpenAI vision model.
+    Async counterpart of `_call_with_retries`, throttled through `pool` when given.
 
-    The model is prompted to return a JSON object containing a "contract_items" array,
-    where each element represents a distinct item, service, or agreement from the contract.
+    `client` may be shared with other calls, so after a connection error the
+    remaining attempts use a client of their own from `new_client()` (when given),
+    closed before returning.
+    """
+    from openai import APIConnectionError
+    token_estimate = estimate_tokens(chat_completion_params) if pool is not None else 0
+    replacement_client = None
+    try:
+        for attempt in range(retries + 1):
+            raw_model_response_str = None
+            try:
+                raw_model_response_str = await _astream_completion_content(replacement_client or client, chat_completion_params,
+                                                                           pool, token_estimate)
+                if not raw_model_response_str:
+                    raise _EmptyOutputError()
+                result = parse(raw_model_response_str)
+                logging.info("Attempt %d: %s returned valid JSON.", attempt + 1, model_label)
+                return result
+            except Exception as error:
+                delay = _after_failed_attempt(model_label, chat_completion_params, max_output_tokens, attempt, retries,
+                                              error, raw_model_response_str)
+                if isinstance(error, APIConnectionError) and delay is not None and new_client is not None:
+                    if replacement_client is not None:
+                        await replacement_client.close()
+                    replacement_client = new_client()
+            if delay is None:
+                return None
+            if pool is not None:
+                token_estimate = estimate_tokens(chat_completion_params)  # max_tokens may have grown
+            await asyncio.sleep(delay)
+        return None
+    finally:
+        if replacement_client is not None:
+            await replacement_client.close()
+
+def correct_invoice_json_with_vision(images_base64: list[str], current_json_data_str: str, retries=2,
+                                     max_tokens: int | None = None) -> str | None:
+    """
+    Uses an Azure OpenAI vision model to correct invoice JSON data based on provided images.
+
+    String wrapper around `correct_invoice_json_with_vision_as_dict`, for callers that
+    store or forward the JSON text.
 
     Args:
-        images_base64 (list[str]): A list of base64 encoded PNG image strings of the contract pages.
-        pdf_text_content (str): Text content extracted from the PDF, used as supplementary information.
-        original_filename (str): The original filename of the contract document, for context.
+        images_base64, current_json_data_str, retries, max_tokens: As for `correct_invoice_json_with_vision_as_dict`.
+
+    Returns:
+        str | None: The corrected JSON as a compact string if successful, otherwise None.
+    """
+    corrected = correct_invoice_json_with_vision_as_dict(images_base64, current_json_data_str, retries, max_tokens)
+    return json_dumps(corrected) if corrected is not None else None
+
+def correct_invoice_json_with_vision_as_dict(images_base64: list[str], current_json_data_str: str, retries=2,
+                                             max_tokens: int | None = None) -> dict | None:
+    """
+    Uses an Azure OpenAI vision model to correct invoice JSON data based on provided images.
+
+    Args:
+        images_base64 (list[str]): A list of base64 encoded page images (JPEG or PNG) of the invoice pages.
+        current_json_data_str (str): A string containing the current JSON data extracted
+                                     from the invoice, which needs verification and correction.
         retries (int, optional): The number of times to retry the OpenAI API call on failure.
                                  Defaults to 2.
+        max_tokens (int, optional): Output token limit. Defaults to an estimate from the size
+                                    of `current_json_data_str`, capped at 4096.
 
     Returns:
-        str | None: A JSON string representing a list of extracted contract items if successful,
-                    otherwise None. The root of the JSON string will be an array.
+        dict | None: The corrected invoice data if successful, otherwise None.
     """
-    azure_oai_endpoint = os.environ.get("AZURE_OPENAI_ENDPOINT")
-    azure_oai_key = os.environ.get("AZURE_OPENAI_API_KEY")
-    azure_oai_contract_extraction_deployment_name = os.environ.get("AZURE_OPENAI_CONTRACT_ITEM_EXTRACTION_DEPLOYMENT_NAME",
-                                                                  os.environ.get("AZURE_OPENAI_VISION_CORRECTION_DEPLOYMENT_NAME")) # Fallback
-    azure_oai_api_version = os.environ.get("AZURE_OPENAI_API_VERSION")
+    config = _vision_correction_config()
+    if not config:
+        return None
+    azure_oai_endpoint, azure_oai_key, azure_oai_vision_deployment_name, azure_oai_api_version = config
 
-    if not all([azure_oai_endpoint, azure_oai_key, azure_oai_contract_extraction_deployment_name, azure_oai_api_version]):
-        logging.error("Azure OpenAI configuration for Contract Item Extraction Model not fully set.")
+    try:
+        get_azure_oai_client(azure_oai_endpoint, azure_oai_key, azure_oai_api_version)
+    except Exception as e_client:
+        logging.error(f"Failed to initialize AzureOpenAI client for Vision Correction: {e_client}", exc_info=True)
         return None
 
+    chat_completion_params = _vision_correction_params(images_base64, current_json_data_str, azure_oai_vision_deployment_name,
+                                                       azure_oai_api_version, max_tokens)
+    logging.info(f"Sending request with {len(images_base64)} images to Azure OpenAI Vision Correction Deployment '{azure_oai_vision_deployment_name}'.")
+    return _call_with_retries("Vision Correction Model",
+                              lambda: get_azure_oai_client(azure_oai_endpoint, azure_oai_key, azure_oai_api_version),
+                              chat_completion_params, _parse_vision_correction_response, retries, _CORRECTION_MAX_OUTPUT_TOKENS)
+
+async def correct_invoice_json_with_vision_async(images_base64: list[str], current_json_data_str: str, retries=2,
+                                                 client: AsyncAzureOpenAI | None = None,
+                                                 pool: RequestPool | None = None,
+                                                 max_tokens: int | None = None) -> str | None:
+    """
+    Async variant of `correct_invoice_json_with_vision`, for running many corrections
+    concurrently on one event loop (see `correct_many`).
+
+    Args:
+        images_base64, current_json_data_str, retries, max_tokens: As for `correct_invoice_json_with_vision_as_dict`.
+        client (AsyncAzureOpenAI, optional): Client to share across concurrent calls. When
+                                             omitted, one is created and closed for this call.
+        pool (RequestPool, optional): RPM/TPM throttle shared across concurrent calls.
+
+    Returns:
+        str | None: The corrected JSON string, or None on failure.
+    """
+    config = _vision_correction_config()
+    if not config:
+        return None
+    azure_oai_endpoint, azure_oai_key, azure_oai_vision_deployment_name, azure_oai_api_version = config
+
+    if client is None:
+        try:
+            own_client = new_async_azure_oai_client(azure_oai_endpoint, azure_oai_key, azure_oai_api_version)
+        except Exception as e_client:
+            logging.error(f"Failed to initialize AsyncAzureOpenAI client for Vision Correction: {e_client}", exc_info=True)
+            return None
+        async with own_client:
+            return await correct_invoice_json_with_vision_async(images_base64, current_json_data_str, retries, client=own_client,
+                                                                pool=pool, max_tokens=max_tokens)
+
+    # Shrinking the page images is CPU work; keep it off the event loop.
+    chat_completion_params = await asyncio.to_thread(_vision_correction_params, images_base64, current_json_data_str,
+                                                     azure_oai_vision_deployment_name, azure_oai_api_version, max_tokens)
+    logging.info(f"Sending async request with {len(images_base64)} images to Azure OpenAI Vision Correction Deployment '{azure_oai_vision_deployment_name}'.")
+    return await _acall_with_retries("Vision Correction Model", client, chat_completion_params,
+                                     lambda raw: json_dumps(_parse_vision_correction_response(raw)),
+                                     retries, _CORRECTION_MAX_OUTPUT_TOKENS, pool,
+                                     lambda: new_async_azure_oai_client(azure_oai_endpoint, azure_oai_key, azure_oai_api_version))
+
+async def correct_many(docs: list[tuple[list[str], str]], retries=2, pool: RequestPool | None = None) -> list[str | None]:
+    """
+    Corrects several invoices concurrently with one shared AsyncAzureOpenAI client.
+
+    Args:
+        docs (list[tuple[list[str], str]]): (images_base64, current_json_data_str) per invoice.
+        retries (int, optional): Retries per invoice. Defaults to 2.
+        pool (RequestPool, optional): RPM/TPM throttle for the batch. Defaults to a new
+                                      pool sized from AZURE_OPENAI_MAX_RPM/AZURE_OPENAI_MAX_TPM.
+
+    Returns:
+        list[str | None]: Corrected JSON strings (or None on failure), in the order of `docs`.
+    """
+    config = _vision_correction_config()
+    if not config:
+        return [None] * len(docs)
+    azure_oai_endpoint, azure_oai_key, _, azure_oai_api_version = config
     try:
-        client = AzureOpenAI(
-            azure_endpoint=azure_oai_endpoint,
-            api_key=azure_oai_key,
-            api_version=azure_oai_api_version
-        )
+        client = new_async_azure_oai_client(azure_oai_endpoint, azure_oai_key, azure_oai_api_version)
     except Exception as e_client:
-        logging.error(f"Failed to initialize AzureOpenAI client for Contract Item Extraction: {e_client}", exc_info=True)
+        logging.error(f"Failed to initialize AsyncAzureOpenAI client for Vision Correction: {e_client}", exc_info=True)
+        return [None] * len(docs)
+    if pool is None:
+        pool = RequestPool()
+    async with client:
+        return list(await asyncio.gather(*(
+            correct_invoice_json_with_vision_async(images_base64, current_json_data_str, retries, client=client, pool=pool)
+            for images_base64, current_json_data_str in docs
+        )))
+
+_VISION_CORRECTION_BATCH_INSTRUCTIONS = """
+You will receive several invoices in one message. Each invoice starts with a text part `<doc idx="N">`
+followed by its JSON data, then that invoice's page images, and ends with `</doc>`.
+Correct each invoice independently, using only its own images, following all the rules above.
+Return a single JSON object of the form {"results": [{"idx": N, "json": {...the corrected JSON object...}}, ...]}
+with exactly one entry per invoice, using the idx values given.
+"""
+# Output budget for one batched request; invoices are grouped so their JSON fits in it.
+_BATCH_CORRECTION_MAX_OUTPUT_TOKENS = 16384
+
+def _vision_correction_batch_params(group: list[tuple[int, list[str], str]], deployment_name: str, api_version: str,
+                                    max_tokens: int) -> dict:
+    """Builds one chat completion request that corrects every (idx, images, json) document in `group`."""
+    user_message_content = [_BATCH_CORRECTION_INSTRUCTION_PART]
+    for idx, images_base64, current_json_data_str in group:
+        user_message_content += [
+            {"type": "text", "text": f'<doc idx="{idx}">\n{current_json_data_str}'},
+            *_vision_image_parts(images_base64),
+            _BATCH_DOC_END_PART
+        ]
+
+    chat_completion_params = {
+        "model": deployment_name,
+        "messages": [
+            {"role": "system", "content": _VISION_CORRECTION_SYSTEM_PROMPT + _VISION_CORRECTION_BATCH_INSTRUCTIONS},
+            {"role": "user", "content": user_message_content}
+        ],
+        "temperature": 0.1,
+        "max_tokens": max_tokens
+    }
+    if api_version >= "2023-12-01-preview":
+        chat_completion_params["response_format"] = {"type": "json_object"}
+    return chat_completion_params
+
+def _parse_vision_correction_batch_response(raw_model_response_str: str, expected_indices: set[int]) -> dict[int, str]:
+    """
+    Returns {idx: corrected JSON string} for every well-formed entry of a batched correction
+    response. Entries with an unknown idx or a non-object `json` are dropped.
+    Raises json.JSONDecodeError on invalid JSON and ValueError if `results` is missing.
+    """
+    parsed_root_object = json_loads(_strip_json_fence(raw_model_response_str.strip())[0])
+    results = parsed_root_object.get("results") if isinstance(parsed_root_object, dict) else None
+    if not isinstance(results, list):
+        raise ValueError("Batched Vision Correction response is missing the 'results' array.")
+
+    corrected = {}
+    for entry in results:
+        if not isinstance(entry, dict):
+            continue
+        idx, corrected_json = entry.get("idx"), entry.get("json")
+        if idx in expected_indices and isinstance(corrected_json, dict):
+            corrected[idx] = json_dumps(corrected_json)
+        else:
+            logging.warning(f"Ignoring batched correction entry with idx {idx!r} (expected one of {sorted(expected_indices)}).")
+    return corrected
+
+def correct_invoice_json_with_vision_batch(batches: list[tuple[list[str], str]], max_docs_per_request: int = 4,
+                                           retries=2) -> list[str | None]:
+    """
+    Corrects several invoices with fewer requests by packing up to `max_docs_per_request`
+    of them into one prompt.
+
+    Invoices are grouped in order; a group also closes early when the estimated size of
+    its JSON (the model's output) would exceed the per-request output budget. Each group
+    is one request whose answer is `{"results": [{"idx": ..., "json": {...}}]}`.
+
+    Args:
+        batches (list[tuple[list[str], str]]): (images_base64, current_json_data_str) per invoice.
+        max_docs_per_request (int, optional): Maximum invoices per request. Defaults to 4.
+        retries (int, optional): Retries per request. Defaults to 2.
+
+    Returns:
+        list[str | None]: Corrected JSON strings in the order of `batches`; None for any
+                          invoice the model did not return a valid correction for.
+    """
+    results = [None] * len(batches)
+    config = _vision_correction_config()
+    if not config:
+        return results
+    azure_oai_endpoint, azure_oai_key, azure_oai_vision_deployment_name, azure_oai_api_version = config
+    try:
+        get_azure_oai_client(azure_oai_endpoint, azure_oai_key, azure_oai_api_version)
+    except Exception as e_client:
+        logging.error(f"Failed to initialize AzureOpenAI client for Vision Correction: {e_client}", exc_info=True)
+        return results
+
+    groups, group, group_tokens = [], [], 0
+    for idx, (images_base64, current_json_data_str) in enumerate(batches):
+        # Corrected JSON is about the size of the input JSON; leave headroom for the wrapper.
+        doc_tokens = int(count_text_tokens(current_json_data_str) * 1.2) + 64
+        if group and (len(group) >= max_docs_per_request or group_tokens + doc_tokens > _BATCH_CORRECTION_MAX_OUTPUT_TOKENS):
+            groups.append((group, group_tokens))
+            group, group_tokens = [], 0
+        group.append((idx, images_base64, current_json_data_str))
+        group_tokens += doc_tokens
+    if group:
+        groups.append((group, group_tokens))
+
+    for group, group_tokens in groups:
+        expected_indices = {idx for idx, _, _ in group}
+        max_tokens = min(_BATCH_CORRECTION_MAX_OUTPUT_TOKENS, group_tokens + 512)
+        chat_completion_params = _vision_correction_batch_params(group, azure_oai_vision_deployment_name, azure_oai_api_version, max_tokens)
+        logging.info(f"Sending batched vision correction for {len(group)} invoices to '{azure_oai_vision_deployment_name}'.")
+        corrected = _call_with_retries("Vision Correction Model (batch)",
+                                       lambda: get_azure_oai_client(azure_oai_endpoint, azure_oai_key, azure_oai_api_version),
+                                       chat_completion_params,
+                                       lambda raw: _parse_vision_correction_batch_response(raw, expected_indices),
+                                       retries, _BATCH_CORRECTION_MAX_OUTPUT_TOKENS)
+        if corrected is None:
+            logging.error("Batched Vision Correction failed. Invoices %s not corrected.", sorted(expected_indices))
+            continue
+        for idx, corrected_json_str in corrected.items():
+            results[idx] = corrected_json_str
+        missing = expected_indices - corrected.keys()
+        if missing:
+            logging.warning(f"Batched Vision Correction returned no valid result for invoices {sorted(missing)}.")
+    return results
+
+def _contract_extraction_config() -> tuple | None:
+    """Returns (endpoint, key, deployment, api_version) for the contract item model, or None if incomplete."""
+    config = (
+        os.environ.get("AZURE_OPENAI_ENDPOINT"),
+        os.environ.get("AZURE_OPENAI_API_KEY"),
+        os.environ.get("AZURE_OPENAI_CONTRACT_ITEM_EXTRACTION_DEPLOYMENT_NAME",
+                       os.environ.get("AZURE_OPENAI_VISION_CORRECTION_DEPLOYMENT_NAME")), # Fallback
+        os.environ.get("AZURE_OPENAI_API_VERSION"),
+    )
+    if not all(config):
+        logging.error("Azure OpenAI configuration for Contract Item Extraction Model not fully set.")
         return None
+    return config
 
-    prompt_for_llm = f"""
+# The system prompts hold no per-document values (the file name goes in the user
+# message), so every request shares the same prefix and Azure's prompt caching
+# (API version 2024-10-01-preview or later) can reuse it.
+_CONTRACT_EXTRACTION_SYSTEM_PROMPT = """
 You are an expert AI assistant specialized in extracting structured information from contract documents.
 Your task is to identify distinct items, services, or specific agreements within the provided contract document (images and text). For EACH such distinct item/service/agreement, you must extract the specified details.
 
@@ -348,9 +1022,9 @@ If a field (especially an item-specific one) is not found or not applicable for
 Ensure dates are in YYYY-MM-DD format if possible. For rates, provide them as decimal numbers (e.g., 5% as 0.05). For absolute amounts, provide the number.
 
 Example of expected JSON object output format:
-{{
+{
   "contract_items": [
-    {{
+    {
       "SupplierName": "Global Tech Inc.",
       "BuyerName": "Client Corp.",
       "ContractValidityStartDate": "2023-01-01",
@@ -367,8 +1041,8 @@ Example of expected JSON object output format:
       "MaximumTaxCharge": null,
       "OtherRuleBreakClausesAmount": 1000.00,
       "OtherRuleBreakClausesRate": null
-    }},
-    {{
+    },
+    {
       "SupplierName": "Global Tech Inc.",
       "BuyerName": "Client Corp.",
       "ContractValidityStartDate": "2023-01-01",
@@ -385,141 +1059,334 @@ Example of expected JSON object output format:
       "MaximumTaxCharge": 18.0,
       "OtherRuleBreakClausesAmount": null,
       "OtherRuleBreakClausesRate": null
-    }}
+    }
   ]
-}}
+}
 Do not include any explanatory text, greetings, or markdown backticks (```json ... ```) around the root JSON object.
-The contract document being processed is named: '{original_filename}'.
 """
 
+def _contract_extraction_params(images_base64: list[str], pdf_text_content: str, original_filename: str,
+                                deployment_name: str, api_version: str, max_tokens: int | None = None) -> dict:
+    """Builds the chat completion request for extracting contract items from pages and text."""
+
     user_message_content = [
-        {"type": "text", "text": "Please analyze the following contract document (images and text content) and extract the information into the specified JSON format. Here is the extracted text from the PDF:"},
-        {"type": "text", "text": pdf_text_content if pdf_text_content else "No text content could be extracted from the PDF. Please rely on the images."}
+        {"type": "text", "text": f"The contract document being processed is named: '{original_filename}'."},
+        _CONTRACT_INSTRUCTION_PART,
+        {"type": "text", "text": pdf_text_content} if pdf_text_content else _CONTRACT_NO_TEXT_PART,
+        *_vision_image_parts(images_base64)
     ]
-    for img_b64 in images_base64:
-        user_message_content.append({"type": "image_url", "image_url": {"url": f"data:image/png;base64,{img_b64}", "detail": "auto"}})
 
-    logging.info(f"Sending request for contract item extraction: {len(images_base64)} images, text to '{azure_oai_contract_extraction_deployment_name}'.")
-    raw_model_response_str, json_to_parse = None, None
-    target_item_keys = [
-        "SupplierName", "BuyerName", "ContractValidityStartDate", "ContractValidityEndDate",
-        "ItemName", "ItemDescription", "UnitPrice", "MaxItem", "DeliveryDays",
-        "DeliveryPenaltyAmount", "DeliveryPenaltyAmountperDay", "DeliveryPenaltyRate",
-        "DeliveryPenaltyRateperDay", "MaximumTaxCharge", "OtherRuleBreakClausesAmount",
-        "OtherRuleBreakClausesRate"
+    chat_completion_params = {
+        "model": deployment_name,
+        "messages": [{"role": "system", "content": _CONTRACT_EXTRACTION_SYSTEM_PROMPT}, {"role": "user", "content": user_message_content}],
+        "temperature": 0.0,
+        "max_tokens": max_tokens or _contract_max_tokens(pdf_text_content)
+    }
+    if api_version >= _JSON_SCHEMA_MIN_API_VERSION and deployment_name not in _JSON_SCHEMA_UNSUPPORTED_DEPLOYMENTS:
+        chat_completion_params["response_format"] = {"type": "json_schema", "json_schema": _CONTRACT_ITEMS_JSON_SCHEMA}
+        logging.info("Using response_format: json_schema (strict) for contract item extraction.")
+    elif api_version >= "2023-12-01-preview":
+        chat_completion_params["response_format"] = {"type": "json_object"}
+        logging.info("Attempting to use response_format: json_object for contract item extraction.")
+    return chat_completion_params
+
+# Keys kept (in this order) for every extracted contract item; anything else the model adds is dropped.
+_CONTRACT_ITEM_KEYS = (
+    "SupplierName", "BuyerName", "ContractValidityStartDate", "ContractValidityEndDate",
+    "ItemName", "ItemDescription", "UnitPrice", "MaxItem", "DeliveryDays",
+    "DeliveryPenaltyAmount", "DeliveryPenaltyAmountperDay", "DeliveryPenaltyRate",
+    "DeliveryPenaltyRateperDay", "MaximumTaxCharge", "OtherRuleBreakClausesAmount",
+    "OtherRuleBreakClausesRate"
+)
+
+# Strict structured output for contract extraction: every item key is required and
+# nullable, text fields are strings and all others numbers.
+_CONTRACT_ITEM_TEXT_KEYS = frozenset(_CONTRACT_ITEM_KEYS[:6])
+_CONTRACT_ITEMS_JSON_SCHEMA = {
+    "name": "contract_items",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "contract_items": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        key: {"type": ["string", "null"] if key in _CONTRACT_ITEM_TEXT_KEYS else ["number", "null"]}
+                        for key in _CONTRACT_ITEM_KEYS
+                    },
+                    "required": list(_CONTRACT_ITEM_KEYS),
+                    "additionalProperties": False
+                }
+            }
+        },
+        "required": ["contract_items"],
+        "additionalProperties": False
+    }
+}
+# First API version that accepts structured outputs (json_schema / strict tools).
+_JSON_SCHEMA_MIN_API_VERSION = "2024-08-01-preview"
+# First API version that reports token usage at the end of a stream.
+_STREAM_USAGE_MIN_API_VERSION = "2024-09-01-preview"
+# Deployments whose model rejected structured outputs; they get json_object from then on.
+_JSON_SCHEMA_UNSUPPORTED_DEPLOYMENTS = set()
+
+def _fall_back_to_json_object(chat_completion_params: dict, error: Exception) -> bool:
+    """
+    If `error` is the service rejecting a structured-output request (a json_schema
+    response_format or strict tool; older model versions do not support them),
+    switches `chat_completion_params` to plain json_object mode in place, remembers
+    the deployment, and returns True.
+    """
+    from openai import BadRequestError
+    uses_json_schema = (chat_completion_params.get("response_format") or {}).get("type") == "json_schema"
+    if not (uses_json_schema or "tools" in chat_completion_params) or not isinstance(error, BadRequestError):
+        return False
+    error_message = str(error)
+    if not any(term in error_message for term in ("response_format", "tools", "tool_choice", "strict")):
+        return False
+    _JSON_SCHEMA_UNSUPPORTED_DEPLOYMENTS.add(chat_completion_params["model"])
+    chat_completion_params.pop("tools", None)
+    chat_completion_params.pop("tool_choice", None)
+    chat_completion_params["response_format"] = {"type": "json_object"}
+    logging.warning(f"Deployment '{chat_completion_params['model']}' does not support structured outputs; falling back to json_object.")
+    return True
+
+def _parse_contract_response(raw_model_response_str: str) -> list[dict]:
+    """
+    Validates the contract model output and returns the normalized `contract_items` list.
+
+    Raises:
+        json.JSONDecodeError: If the output is not valid JSON.
+        ValueError: If the JSON does not have the expected `{"contract_items": [...]}` shape.
+    """
+    json_to_parse, stripped = _strip_json_fence(raw_model_response_str.strip())
+    if stripped: logging.info("Stripped markdown from contract item model response.")
+    else: logging.info("No markdown detected in contract item model response.")
+
+    parsed_root_object = json_loads(json_to_parse)
+
+    if not isinstance(parsed_root_object, dict):
+        raise ValueError(f"Contract Item Extraction Model did not return a root JSON object. Type: {type(parsed_root_object)}")
+
+    contract_items_list_from_llm = parsed_root_object.get("contract_items")
+
+    if contract_items_list_from_llm is None:
+        raise ValueError(f"Root JSON object from LLM is missing the 'contract_items' key. Response: {json_to_parse[:500]}")
+
+    if not isinstance(contract_items_list_from_llm, list):
+        raise ValueError(f"The 'contract_items' field from LLM was not a JSON array. Type: {type(contract_items_list_from_llm)}")
+
+    normalized_items_list = [
+        dict(zip(_CONTRACT_ITEM_KEYS, map(item_dict.get, _CONTRACT_ITEM_KEYS)))
+        for item_dict in contract_items_list_from_llm if isinstance(item_dict, dict)
     ]
+    skipped_count = len(contract_items_list_from_llm) - len(normalized_items_list)
+    if skipped_count:
+        logging.warning(f"Skipped {skipped_count} non-dictionary item(s) in 'contract_items' list.")
 
-    for attempt in range(retries + 1):
-        try:
-            chat_completion_params = {
-                "model": azure_oai_contract_extraction_deployment_name,
-                "messages": [{"role": "system", "content": prompt_for_llm}, {"role": "user", "content": user_message_content}],
-                "temperature": 0.0,
-                "max_tokens": 8192
-            }
-            if azure_oai_api_version >= "2023-12-01-preview":
-                try:
-                    chat_completion_params["response_format"] = {"type": "json_object"}
-                    logging.info("Attempting to use response_format: json_object for contract item extraction.")
-                except Exception as e_rf:
-                    logging.warning(f"Could not set response_format for contract item extraction: {e_rf}")
-
-            chat_completion = client.chat.completions.create(**chat_completion_params)
-            raw_model_response_str = chat_completion.choices[0].message.content
-            if not raw_model_response_str:
-                logging.warning(f"Attempt {attempt + 1}: Contract Item Extraction Model returned empty content.")
-                if attempt < retries: time.sleep(5 * (attempt + 1)); continue
-                return None
+    logging.info(f"Contract Item Extraction Model returned a valid structure with {len(normalized_items_list)} items in 'contract_items' array.")
+    return normalized_items_list
 
-            cleaned_response = raw_model_response_str.strip()
-            match = re.search(r"```(?:json)?\s*\n?(.*?)\n?\s*```", cleaned_response, re.DOTALL | re.IGNORECASE)
-            json_to_parse = match.group(1).strip() if match else cleaned_response
-            if match: logging.info("Stripped markdown from contract item model response.")
-            else: logging.info("No markdown detected in contract item model response.")
+_CONTRACT_ITEMS_ARRAY_RE = re.compile(r'"contract_items"\s*:\s*\[')
 
-            parsed_root_object = json.loads(json_to_parse)
+def _iter_json_array_items(text_chunks, array_start_re: re.Pattern):
+    """
+    Incrementally decodes the elements of the JSON array that `array_start_re` locates
+    in a stream of text chunks, yielding each element as soon as it is complete.
 
-            if not isinstance(parsed_root_object, dict):
-                logging.error(f"Attempt {attempt + 1}: Contract Item Extraction Model did not return a root JSON object. Type: {type(parsed_root_object)}")
-                if attempt < retries: time.sleep(5 * (attempt + 1)); continue
-                return None
+    Raises json.JSONDecodeError if the stream ends before the array is closed.
+    """
+    decoder = json.JSONDecoder()
+    buffer, pos = "", None
+    for chunk in text_chunks:
+        buffer += chunk
+        if pos is None:
+            match = array_start_re.search(buffer)
+            if not match:
+                continue
+            pos = match.end()
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos >= len(buffer):
+                break
+            if buffer[pos] == "]":
+                return
+            try:
+                element, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                break  # element still incomplete; wait for more text
+            if end == len(buffer) and isinstance(element, (int, float)) and not isinstance(element, bool):
+                break  # a number at the end of the buffer may continue in the next chunk
+            pos = end
+            yield element
+        buffer, pos = buffer[pos:], 0
+    raise json.JSONDecodeError("Stream ended before the JSON array was closed", buffer, pos or 0)
+
+def iter_contract_items(images_base64: list[str], pdf_text_content: str, original_filename: str,
+                        max_tokens: int | None = None):
+    """
+    Streams contract item extraction and yields each normalized item dict as soon as
+    the model has finished writing it, so callers can start persisting items while
+    the rest of the response is still being generated.
 
-            contract_items_list_from_llm = parsed_root_object.get("contract_items")
+    Unlike `extract_contract_data_as_list` there are no retries: items already yielded
+    cannot be taken back, so errors propagate to the caller.
 
-            if contract_items_list_from_llm is None:
-                logging.error(f"Attempt {attempt + 1}: Root JSON object from LLM is missing the 'contract_items' key. Response: {json_to_parse[:500]}")
-                if attempt < retries: time.sleep(5 * (attempt + 1)); continue
-                return None
+    Args:
+        images_base64, pdf_text_content, original_filename, max_tokens: As for `extract_contract_data_as_list`.
 
-            if not isinstance(contract_items_list_from_llm, list):
-                logging.error(f"Attempt {attempt + 1}: The 'contract_items' field from LLM was not a JSON array. Type: {type(contract_items_list_from_llm)}")
-                if attempt < retries: time.sleep(5 * (attempt + 1)); continue
-                return None
+    Yields:
+        dict: One contract item with exactly the `_CONTRACT_ITEM_KEYS` keys.
 
-            normalized_items_list = []
-            if contract_items_list_from_llm:
-                for item_dict in contract_items_list_from_llm:
-                    if not isinstance(item_dict, dict):
-                        logging.warning(f"Skipping non-dictionary item in 'contract_items' list: {item_dict}")
-                        continue
-                    normalized_item = {key: item_dict.get(key) for key in target_item_keys}
-                    normalized_items_list.append(normalized_item)
-
-            logging.info(f"Attempt {attempt + 1}: Contract Item Extraction Model returned a valid structure with {len(normalized_items_list)} items in 'contract_items' array.")
-            return json.dumps(normalized_items_list, indent=2)
-
-        except json.JSONDecodeError as e_json:
-            logging.error(f"Attempt {attempt + 1}: Failed to parse JSON from Contract Item Model. Error: {e_json}")
-            if raw_model_response_str: logging.error(f"Raw Model Response (first 500 chars): {raw_model_response_str[:500]}")
-            if json_to_parse and json_to_parse != raw_model_response_str: logging.error(f"Attempted to parse (first 500 chars): {json_to_parse[:500]}")
-        except Exception as e_api:
-            logging.error(f"Attempt {attempt + 1}: Error calling Contract Item Model: {type(e_api).__name__} - {e_api}", exc_info=True)
-            if hasattr(e_api, 'status_code'): logging.error(f"API Status Code: {e_api.status_code}")
-            if hasattr(e_api, 'response') and e_api.response is not None:
-                 try: logging.error(f"API Error details (JSON): {e_api.response.json()}")
-                 except json.JSONDecodeError: logging.error(f"API Error details (text, first 500): {e_api.response.text[:500] if hasattr(e_api.response, 'text') else 'N/A'}")
-            elif hasattr(e_api, 'message'): logging.error(f"API Error message: {e_api.message}")
-        if attempt < retries:
-            logging.info(f"Retrying Contract Item Model call ({attempt + 2}/{retries + 1})...")
-            time.sleep(5 * (attempt + 1))
-        else:
-            logging.error("Max retries for Contract Item Model. Failed to get JSON array.")
-            return None
-    return None
+    Raises:
+        ValueError: If the contract extraction model is not configured.
+        json.JSONDecodeError: If the response ends before the `contract_items` array is complete.
+        openai.OpenAIError: If the API call fails.
+    """
+    from openai import BadRequestError
+    config = _contract_extraction_config()
+    if not config:
+        raise ValueError("Azure OpenAI configuration for Contract Item Extraction Model not fully set.")
+    azure_oai_endpoint, azure_oai_key, azure_oai_contract_extraction_deployment_name, azure_oai_api_version = config
+
+    client = get_azure_oai_client(azure_oai_endpoint, azure_oai_key, azure_oai_api_version)
+    chat_completion_params = _contract_extraction_params(images_base64, pdf_text_content, original_filename,
+                                                         azure_oai_contract_extraction_deployment_name, azure_oai_api_version,
+                                                         max_tokens)
+    logging.info(f"Streaming contract item extraction: {len(images_base64)} images, text to '{azure_oai_contract_extraction_deployment_name}'.")
+    try:
+        stream = client.chat.completions.create(**chat_completion_params, stream=True)
+    except BadRequestError as e_bad:
+        if not _fall_back_to_json_object(chat_completion_params, e_bad):
+            raise
+        stream = client.chat.completions.create(**chat_completion_params, stream=True)
+
+    item_count = 0
+    for item_dict in _iter_json_array_items(_iter_stream_deltas(stream), _CONTRACT_ITEMS_ARRAY_RE):
+        if not isinstance(item_dict, dict):
+            logging.warning("Skipping non-dictionary item in 'contract_items' list.")
+            continue
+        item_count += 1
+        yield dict(zip(_CONTRACT_ITEM_KEYS, map(item_dict.get, _CONTRACT_ITEM_KEYS)))
+    logging.info(f"Contract Item Extraction Model streamed {item_count} items for '{original_filename}'.")
+
+def extract_contract_data_as_json(images_base64: list[str], pdf_text_content: str, original_filename: str, retries=2,
+                                  max_tokens: int | None = None) -> str | None:
+    """
+    Extracts structured data from contract document images and text using an Azure OpenAI vision model.
 
-def generate_invoice_data_from_images_llm(images_base64: list[str], original_filename: str, retries=2) -> str | None:
+    String wrapper around `extract_contract_data_as_list`, for callers that store or
+    forward the JSON text.
+
+    Args:
+        images_base64, pdf_text_content, original_filename, retries, max_tokens: As for `extract_contract_data_as_list`.
+
+    Returns:
+        str | None: A JSON string representing a list of extracted contract items if successful,
+                    otherwise None. The root of the JSON string will be an array.
     """
-    Uses an Azure OpenAI vision model to extract structured invoice data directly from images.
+    items = extract_contract_data_as_list(images_base64, pdf_text_content, original_filename, retries, max_tokens)
+    return json_dumps(items, indent=True) if items is not None else None
 
-    The LLM is prompted to return data in a "final report" like JSON structure,
-    including an invoice header and a 'LineItems' array, suitable for direct
-    database ingestion.
+def extract_contract_data_as_list(images_base64: list[str], pdf_text_content: str, original_filename: str, retries=2,
+                                  max_tokens: int | None = None) -> list[dict] | None:
+    """
+    Extracts structured data from contract document images and text using an Azure OpenAI vision model.
+
+    The model is prompted to return a JSON object containing a "contract_items" array,
+    where each element represents a distinct item, service, or agreement from the contract.
 
     Args:
-        images_base64 (list[str]): A list of base64 encoded PNG image strings of the invoice pages.
-        original_filename (str): The original filename of the invoice PDF, for context and inclusion in the output.
+        images_base64 (list[str]): A list of base64 encoded page images (JPEG or PNG) of the contract pages.
+        pdf_text_content (str): Text content extracted from the PDF, used as supplementary information.
+        original_filename (str): The original filename of the contract document, for context.
         retries (int, optional): The number of times to retry the OpenAI API call on failure.
                                  Defaults to 2.
+        max_tokens (int, optional): Output token limit. Defaults to an estimate from the length
+                                    of `pdf_text_content`, capped at 8192. A truncated answer
+                                    is retried with double the limit, up to 16384.
 
     Returns:
-        str | None: A JSON string containing the extracted structured invoice data if successful,
-                    otherwise None. The JSON structure is designed to be compatible with SQL loading.
+        list[dict] | None: The extracted contract items if successful, otherwise None.
     """
-    vision_client = get_vision_oai_client()
-    if not vision_client:
-        logging.error("Vision LLM client is not initialized for invoice data generation.")
+    config = _contract_extraction_config()
+    if not config:
         return None
+    azure_oai_endpoint, azure_oai_key, azure_oai_contract_extraction_deployment_name, azure_oai_api_version = config
 
-    azure_oai_vision_deployment_name = os.environ.get("AZURE_OPENAI_VISION_DEPLOYMENT_NAME",
-                                                      os.environ.get("AZURE_OPENAI_VISION_CORRECTION_DEPLOYMENT_NAME"))
-    azure_oai_api_version = os.environ.get("AZURE_OPENAI_API_VERSION")
+    try:
+        get_azure_oai_client(azure_oai_endpoint, azure_oai_key, azure_oai_api_version)
+    except Exception as e_client:
+        logging.error(f"Failed to initialize AzureOpenAI client for Contract Item Extraction: {e_client}", exc_info=True)
+        return None
 
+    chat_completion_params = _contract_extraction_params(images_base64, pdf_text_content, original_filename,
+                                                         azure_oai_contract_extraction_deployment_name, azure_oai_api_version,
+                                                         max_tokens)
+    logging.info(f"Sending request for contract item extraction: {len(images_base64)} images, text to '{azure_oai_contract_extraction_deployment_name}'.")
+    return _call_with_retries("Contract Item Model",
+                              lambda: get_azure_oai_client(azure_oai_endpoint, azure_oai_key, azure_oai_api_version),
+                              chat_completion_params, _parse_contract_response, retries, _CONTRACT_RETRY_MAX_OUTPUT_TOKENS)
+
+async def extract_contract_data_as_json_async(images_base64: list[str], pdf_text_content: str, original_filename: str, retries=2,
+                                              client: AsyncAzureOpenAI | None = None,
+                                              pool: RequestPool | None = None,
+                                              max_tokens: int | None = None) -> str | None:
+    """
+    Async variant of `extract_contract_data_as_json`, so several contracts can be
+    extracted concurrently with `asyncio.gather`.
 
-    if not all([azure_oai_vision_deployment_name, azure_oai_api_version]):
+    Args:
+        images_base64, pdf_text_content, original_filename, retries, max_tokens: As for `extract_contract_data_as_json`.
+        client (AsyncAzureOpenAI, optional): Client to share across concurrent calls. When
+                                             omitted, one is created and closed for this call.
+        pool (RequestPool, optional): RPM/TPM throttle shared across concurrent calls.
+
+    Returns:
+        str | None: A JSON array string of contract items, or None on failure.
+    """
+    config = _contract_extraction_config()
+    if not config:
+        return None
+    azure_oai_endpoint, azure_oai_key, azure_oai_contract_extraction_deployment_name, azure_oai_api_version = config
+
+    if client is None:
+        try:
+            own_client = new_async_azure_oai_client(azure_oai_endpoint, azure_oai_key, azure_oai_api_version)
+        except Exception as e_client:
+            logging.error(f"Failed to initialize AsyncAzureOpenAI client for Contract Item Extraction: {e_client}", exc_info=True)
+            return None
+        async with own_client:
+            return await extract_contract_data_as_json_async(images_base64, pdf_text_content, original_filename, retries,
+                                                             client=own_client, pool=pool, max_tokens=max_tokens)
+
+    # Shrinking the page images is CPU work; keep it off the event loop.
+    chat_completion_params = await asyncio.to_thread(_contract_extraction_params, images_base64, pdf_text_content, original_filename,
+                                                     azure_oai_contract_extraction_deployment_name, azure_oai_api_version,
+                                                     max_tokens)
+    logging.info(f"Sending async request for contract item extraction: {len(images_base64)} images, text to '{azure_oai_contract_extraction_deployment_name}'.")
+    return await _acall_with_retries("Contract Item Model", client, chat_completion_params,
+                                     lambda raw: json_dumps(_parse_contract_response(raw), indent=True),
+                                     retries, _CONTRACT_RETRY_MAX_OUTPUT_TOKENS, pool,
+                                     lambda: new_async_azure_oai_client(azure_oai_endpoint, azure_oai_key, azure_oai_api_version))
+
+def _invoice_extraction_config() -> tuple | None:
+    """Returns (deployment, api_version) for the invoice extraction vision model, or None if incomplete."""
+    config = (
+        os.environ.get("AZURE_OPENAI_VISION_DEPLOYMENT_NAME",
+                       os.environ.get("AZURE_OPENAI_VISION_CORRECTION_DEPLOYMENT_NAME")),
+        os.environ.get("AZURE_OPENAI_API_VERSION"),
+    )
+    if not all(config):
         logging.error("Azure OpenAI Vision configuration for extraction model not fully set (deployment/version).")
         return None
+    return config
 
-    system_prompt_content = f"""
+# Document-independent, like _CONTRACT_EXTRACTION_SYSTEM_PROMPT.
+_INVOICE_EXTRACTION_SYSTEM_PROMPT = """
 You are an expert AI assistant specialized in extracting structured information from invoice images.
 Your task is to analyze the provided invoice page images and extract all relevant header information and all line item details.
 You MUST return your response as a single, valid JSON object.
@@ -567,10 +1434,9 @@ Target LineItem Fields (for each object in the "LineItems" array, use these exac
 
 If a field is not found or not applicable, use `null` as its value (the JSON literal null).
 Ensure all numeric values are numbers, not strings with currency symbols. Dates should be in YYYY-MM-DD format.
-The invoice document being processed is named: '{original_filename}'.
 
 Example of desired JSON output structure (values are illustrative):
-{{
+{
   "InvoiceID": "562759599",
   "InvoiceDate": "2024-05-20",
   "PurchaseOrder": "9200804063",
@@ -596,7 +1462,7 @@ Example of desired JSON output structure (values are illustrative):
   "PreviousUnpaidBalance": null,
   "SourceFileName": "X_562759599_siew-chin_S2512478_Doc7_0.pdf",
   "LineItems": [
-    {{
+    {
       "InvoiceID": "562759599",
       "PONumber": "9200804063",
       "VendorName": "Merck Life Science Pty Ltd",
@@ -607,65 +1473,276 @@ Example of desired JSON output structure (values are illustrative):
       "ExpectedTaxAmount": null,
       "TaxPercentage": null,
       "TotalPriceWithTax": null
-    }}
+    }
   ]
-}}
+}
 Your response must be ONLY this JSON object. Do not include any other text or markdown.
 ALSO DO NOT INCLUDE ANYTHING OTHER THAN CURRENT ITEM (for example if there are any items that will be delivered in future or in other invoice, dont mention them in this) ONLY MENTION CURRENT ITEMS which we are billed for in current invoice.
 """
+
+# Invoice fields in output order; the *_NUMBER_KEYS are numeric, everything else text.
+_INVOICE_HEADER_KEYS = (
+    "InvoiceID", "InvoiceDate", "PurchaseOrder", "DueDate", "VendorName", "VendorTaxID",
+    "VendorPhoneNumber", "CustomerID", "BillingAddress", "ShippingAddress", "ShippingAddressRecipient",
+    "SubTotal", "SubTotalCurrencyCode", "TotalTax", "TotalTaxCurrencyCode", "FreightAmount",
+    "FreightCurrencyCode", "DiscountAmount", "DiscountAmountCurrencyCode", "InvoiceTotal",
+    "InvoiceTotalCurrencyCode", "AmountDue", "PreviousUnpaidBalance", "SourceFileName"
+)
+_INVOICE_HEADER_NUMBER_KEYS = frozenset((
+    "SubTotal", "TotalTax", "FreightAmount", "DiscountAmount", "InvoiceTotal", "AmountDue", "PreviousUnpaidBalance"
+))
+_INVOICE_LINE_ITEM_KEYS = (
+    "InvoiceID", "PONumber", "VendorName", "ItemName", "Quantity", "UnitPrice",
+    "AmountWithoutTax", "ExpectedTaxAmount", "TaxPercentage", "TotalPriceWithTax"
+)
+_INVOICE_LINE_ITEM_NUMBER_KEYS = frozenset(_INVOICE_LINE_ITEM_KEYS[4:])
+
+# Forced strict tool call for invoice extraction: the API constrains the arguments to
+# this schema, so they arrive as a bare, complete JSON object.
+_EMIT_INVOICE_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "emit_invoice",
+        "description": "Records the header fields and current line items extracted from the invoice.",
+        "strict": True,
+        "parameters": {
+            "type": "object",
+            "properties": {
+                **{key: {"type": ["number", "null"] if key in _INVOICE_HEADER_NUMBER_KEYS else ["string", "null"]}
+                   for key in _INVOICE_HEADER_KEYS},
+                "LineItems": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            key: {"type": ["number", "null"] if key in _INVOICE_LINE_ITEM_NUMBER_KEYS else ["string", "null"]}
+                            for key in _INVOICE_LINE_ITEM_KEYS
+                        },
+                        "required": list(_INVOICE_LINE_ITEM_KEYS),
+                        "additionalProperties": False
+                    }
+                }
+            },
+            "required": [*_INVOICE_HEADER_KEYS, "LineItems"],
+            "additionalProperties": False
+        }
+    }
+}
+_EMIT_INVOICE_TOOL_CHOICE = {"type": "function", "function": {"name": "emit_invoice"}}
+
+# A typical invoice is 500-1500 output tokens; long documents start with a larger budget,
+# and an answer cut off at the limit is retried with double the budget up to the maximum.
+_INVOICE_MAX_OUTPUT_TOKENS = 8192
+_INVOICE_LONG_DOCUMENT_PAGES = 10
+
+def _stream_usage_options(api_version: str) -> dict:
+    """Extra request params asking for token usage in the final stream chunk, where the API version supports it."""
+    return {"stream_options": {"include_usage": True}} if api_version >= _STREAM_USAGE_MIN_API_VERSION else {}
+
+def _invoice_max_tokens(page_count: int) -> int:
+    return 4096 if page_count > _INVOICE_LONG_DOCUMENT_PAGES else 2048
+
+def _invoice_extraction_params(images_base64: list[str], original_filename: str, deployment_name: str, api_version: str) -> dict:
+    """Builds the chat completion request for extracting header and line item data from invoice pages."""
+    images_base64, repeated_pages_note = _dedupe_pages(images_base64)
+    # Long documents are sent at low detail (a flat 85 tokens per page) instead of
+    # being tiled; short invoices keep "auto" so small print survives.
+    detail = "low" if len(images_base64) > pdf_utils.LOW_DETAIL_PAGE_THRESHOLD else "auto"
     user_message_content = [
-        {"type": "text", "text": "Please analyze the following invoice images and extract all header and line item data into the specified JSON format."}
+        {"type": "text", "text": f"The invoice document being processed is named: '{original_filename}'."},
+        _INVOICE_EXTRACTION_INSTRUCTION_PART,
+        *([{"type": "text", "text": repeated_pages_note}] if repeated_pages_note else []),
+        *({"type": "image_url", "image_url": {"url": f"data:{pdf_utils.image_mime_type(img_b64)};base64,{img_b64}", "detail": detail}}
+          for img_b64 in images_base64)
     ]
-    for img_b64 in images_base64:
-        user_message_content.append({"type": "image_url", "image_url": {"url": f"data:image/png;base64,{img_b64}", "detail": "auto"}})
+    chat_completion_params = {
+        "model": deployment_name,
+        "messages": [{"role": "system", "content": _INVOICE_EXTRACTION_SYSTEM_PROMPT}, {"role": "user", "content": user_message_content}],
+        "temperature": 0.0,
+        "max_tokens": _invoice_max_tokens(len(images_base64))
+    }
+    if api_version >= _JSON_SCHEMA_MIN_API_VERSION and deployment_name not in _JSON_SCHEMA_UNSUPPORTED_DEPLOYMENTS:
+        chat_completion_params["tools"] = [_EMIT_INVOICE_TOOL]
+        chat_completion_params["tool_choice"] = _EMIT_INVOICE_TOOL_CHOICE
+    elif api_version >= "2023-12-01-preview":
+        chat_completion_params["response_format"] = {"type": "json_object"}
+    return chat_completion_params
+
+def _parse_invoice_extraction_response(raw_model_response_str: str) -> str:
+    """
+    Strips any markdown fence from the model output, checks it is an invoice object
+    and returns the JSON text.
 
-    raw_model_response_str = None
-    json_to_parse = None
-    for attempt in range(retries + 1):
-        try:
-            chat_completion_params = {
-                "model": azure_oai_vision_deployment_name,
-                "messages": [{"role": "system", "content": system_prompt_content}, {"role": "user", "content": user_message_content}],
-                "temperature": 0.0,
-                "max_tokens": 4096
-            }
-            if azure_oai_api_version >= "2023-12-01-preview":
-                 chat_completion_params["response_format"] = {"type": "json_object"}
+    Raises:
+        json.JSONDecodeError: If the output is not valid JSON.
+        ValueError: If it is not an object with 'InvoiceID' and a 'LineItems' array.
+    """
+    json_to_parse, _ = _strip_json_fence(raw_model_response_str.strip())
 
-            chat_completion = vision_client.chat.completions.create(**chat_completion_params)
-            raw_model_response_str = chat_completion.choices[0].message.content
+    parsed_json = json_loads(json_to_parse)
+    if not isinstance(parsed_json, dict) or "LineItems" not in parsed_json or not isinstance(parsed_json.get("LineItems"), list) or "InvoiceID" not in parsed_json:
+        raise ValueError(f"LLM output is not a valid dict or missing critical fields 'InvoiceID' or 'LineItems' array. Content: {json_to_parse[:500]}")
+    return json_to_parse
 
-            if not raw_model_response_str:
-                logging.warning(f"Attempt {attempt + 1}: Vision Model (for extraction) returned empty content for {original_filename}.")
-                if attempt < retries: time.sleep(5 * (attempt + 1)); continue
-                return None
+def _require_vision_client() -> AzureOpenAI:
+    """The shared vision client; raises if it cannot be (re)built, e.g. after a reset."""
+    vision_client = get_vision_oai_client()
+    if not vision_client:
+        raise RuntimeError("Vision LLM client is not initialized.")
+    return vision_client
 
-            cleaned_response = raw_model_response_str.strip()
-            match = re.search(r"```(?:json)?\s*\n?(.*?)\n?\s*```", cleaned_response, re.DOTALL | re.IGNORECASE)
-            json_to_parse = match.group(1).strip() if match else cleaned_response
-            
-            parsed_json = json.loads(json_to_parse) 
-            if not isinstance(parsed_json, dict) or "LineItems" not in parsed_json or not isinstance(parsed_json.get("LineItems"), list) or "InvoiceID" not in parsed_json:
-                logging.error(f"Attempt {attempt + 1}: LLM output for {original_filename} is not a valid dict or missing critical fields 'InvoiceID' or 'LineItems' array. Content: {json_to_parse[:500]}")
-                if attempt < retries: time.sleep(5 * (attempt + 1)); continue
-                return None
+def generate_invoice_data_from_images_llm(images_base64: list[str], original_filename: str, retries=2) -> str | None:
+    """
+    Uses an Azure OpenAI vision model to extract structured invoice data directly from images.
 
-            logging.info(f"Attempt {attempt + 1}: Vision Model successfully generated structured JSON for {original_filename}.")
-            return json_to_parse
-            
-        except json.JSONDecodeError as e_json:
-            logging.error(f"Attempt {attempt + 1}: Failed to parse JSON from Vision Model for {original_filename}. Error: {e_json}. Raw: {raw_model_response_str[:500] if raw_model_response_str else 'N/A'}", exc_info=True)
-        except Exception as e_api:
-            logging.error(f"Attempt {attempt + 1}: Error calling Vision Model for {original_filename}: {type(e_api).__name__} - {e_api}", exc_info=True)
-        if attempt < retries:
-            logging.info(f"Retrying Vision Model call for {original_filename} ({attempt + 2}/{retries + 1})...")
-            time.sleep(5 * (attempt + 1))
-        else:
-            logging.error(f"Max retries for Vision Model on {original_filename}. Failed to get structured JSON.")
+    The LLM is prompted to return data in a "final report" like JSON structure,
+    including an invoice header and a 'LineItems' array, suitable for direct
+    database ingestion.
+
+    Args:
+        images_base64 (list[str]): A list of base64 encoded page images (JPEG or PNG) of the invoice pages.
+        original_filename (str): The original filename of the invoice PDF, for context and inclusion in the output.
+        retries (int, optional): The number of times to retry the OpenAI API call on failure.
+                                 Defaults to 2.
+
+    Returns:
+        str | None: A JSON string containing the extracted structured invoice data if successful,
+                    otherwise None. The JSON structure is designed to be compatible with SQL loading.
+    """
+    if not get_vision_oai_client():
+        logging.error("Vision LLM client is not initialized for invoice data generation.")
+        return None
+
+    config = _invoice_extraction_config()
+    if not config:
+        return None
+    azure_oai_vision_deployment_name, azure_oai_api_version = config
+
+    chat_completion_params = _invoice_extraction_params(images_base64, original_filename, azure_oai_vision_deployment_name, azure_oai_api_version)
+    chat_completion_params.update(_stream_usage_options(azure_oai_api_version))
+    # Streamed (tool call arguments or content), so output that is not JSON fails on its first token.
+    return _call_with_retries(f"Vision Model for {original_filename}", _require_vision_client, chat_completion_params,
+                              _parse_invoice_extraction_response, retries, _INVOICE_MAX_OUTPUT_TOKENS)
+
+async def generate_invoice_data_from_images_llm_async(images_base64: list[str], original_filename: str, retries=2,
+                                                      client: AsyncAzureOpenAI | None = None,
+                                                      pool: RequestPool | None = None) -> str | None:
+    """
+    Async variant of `generate_invoice_data_from_images_llm`, so several invoices can be
+    extracted concurrently (see `generate_invoice_data_many`).
+
+    Args:
+        images_base64, original_filename, retries: As for `generate_invoice_data_from_images_llm`.
+        client (AsyncAzureOpenAI, optional): Vision client to share across concurrent calls. When
+                                             omitted, one is created and closed for this call.
+        pool (RequestPool, optional): RPM/TPM throttle shared across concurrent calls.
+
+    Returns:
+        str | None: The extracted invoice JSON string, or None on failure.
+    """
+    config = _invoice_extraction_config()
+    if not config:
+        return None
+    azure_oai_vision_deployment_name, azure_oai_api_version = config
+
+    if client is None:
+        own_client = new_async_oai_client("vision")
+        if own_client is None:
+            logging.error("Vision LLM client is not initialized for invoice data generation.")
             return None
-    return None
+        async with own_client:
+            return await generate_invoice_data_from_images_llm_async(images_base64, original_filename, retries,
+                                                                     client=own_client, pool=pool)
+
+    chat_completion_params = _invoice_extraction_params(images_base64, original_filename, azure_oai_vision_deployment_name, azure_oai_api_version)
+    chat_completion_params.update(_stream_usage_options(azure_oai_api_version))
+    return await _acall_with_retries(f"Vision Model for {original_filename}", client, chat_completion_params,
+                                     _parse_invoice_extraction_response, retries, _INVOICE_MAX_OUTPUT_TOKENS, pool,
+                                     lambda: new_async_oai_client("vision"))
+
+async def generate_invoice_data_many(docs: list[tuple[list[str], str]], retries=2, pool: RequestPool | None = None,
+                                     max_concurrency: int = DEFAULT_MAX_CONCURRENCY) -> list[str | None]:
+    """
+    Extracts several invoices concurrently with one shared AsyncAzureOpenAI vision client.
 
+    Args:
+        docs (list[tuple[list[str], str]]): (images_base64, original_filename) per invoice.
+        retries (int, optional): Retries per invoice. Defaults to 2.
+        pool (RequestPool, optional): RPM/TPM throttle for the batch. Defaults to a new
+                                      pool sized from AZURE_OPENAI_MAX_RPM/AZURE_OPENAI_MAX_TPM.
+        max_concurrency (int, optional): Invoices in flight at once. Defaults to
+                                         AZURE_OPENAI_MAX_CONCURRENCY (8).
 
+    Returns:
+        list[str | None]: Extracted invoice JSON strings (or None on failure), in the order of `docs`.
+    """
+    client = new_async_oai_client("vision")
+    if client is None:
+        logging.error("Vision LLM client is not initialized for invoice data generation.")
+        return [None] * len(docs)
+    if pool is None:
+        pool = RequestPool()
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _extract(images_base64: list[str], original_filename: str) -> str | None:
+        async with semaphore:
+            return await generate_invoice_data_from_images_llm_async(images_base64, original_filename, retries,
+                                                                     client=client, pool=pool)
+
+    async with client:
+        return list(await asyncio.gather(*(
+            _extract(images_base64, original_filename) for images_base64, original_filename in docs
+        )))
+
+def generate_invoice_data_batch(docs: list[tuple[list[str], str]], poll_interval_seconds: float = 60,
+                                timeout_seconds: float = 24 * 3600) -> dict[str, str | None]:
+    """
+    Extracts many invoices at once through the Azure OpenAI Batch API.
+
+    Like `get_column_mappings_batch`, this is for bulk/offline loads (e.g. a backlog of
+    scanned invoices): batch requests are billed at a discount and don't draw on the
+    online deployment's rate limit, but results can take up to 24h.
+
+    Uses `AZURE_OPENAI_VISION_BATCH_DEPLOYMENT_NAME` (a Global Batch deployment), falling
+    back to the extraction deployment.
+
+    Args:
+        docs (list[tuple[list[str], str]]): (images_base64, original_filename) per invoice.
+        poll_interval_seconds (float, optional): Delay between batch status checks. Defaults to 60.
+        timeout_seconds (float, optional): Maximum time to wait for the batch. Defaults to 24 hours.
+
+    Returns:
+        dict[str, str | None]: Extracted invoice JSON string per filename; None for invoices
+                               whose request failed or returned an invalid invoice.
+    """
+    results = {original_filename: None for _, original_filename in docs}
+    vision_client = get_vision_oai_client()
+    if not vision_client:
+        logging.error("Vision LLM client is not initialized for invoice data generation.")
+        return results
+
+    config = _invoice_extraction_config()
+    if not config:
+        return results
+    azure_oai_vision_deployment_name, azure_oai_api_version = config
+    deployment_name = os.environ.get("AZURE_OPENAI_VISION_BATCH_DEPLOYMENT_NAME", azure_oai_vision_deployment_name)
+
+    requests = [_invoice_extraction_params(images_base64, original_filename, deployment_name, azure_oai_api_version)
+                for images_base64, original_filename in docs]
+    try:
+        contents = _run_chat_batch(vision_client, requests, poll_interval_seconds, timeout_seconds)
+    except Exception as e_batch:
+        logging.error(f"Invoice extraction batch failed: {e_batch}", exc_info=True)
+        return results
+
+    for (_, original_filename), content in zip(docs, contents):
+        if not content:
+            continue
+        try:
+            results[original_filename] = _parse_invoice_extraction_response(content)
+        except (json.JSONDecodeError, ValueError) as e_parse:
+            logging.error(f"Invoice extraction batch result for {original_filename} is not a valid invoice: {e_parse}")
+    return results
 
 def chat_complete(
     messages: list[dict],
@@ -683,16 +1760,81 @@ def chat_complete(
         logging.error("Agent AzureOpenAI client not configured.")
         raise ValueError("Agent LLM client not configured.")
 
+    from openai import APIConnectionError
     try:
-        resp = client.chat.completions.create(
-            model=AGENT_AZURE_OAI_DEPLOYMENT_NAME,
-            messages=messages,
-            temperature=temperature,
-            max_tokens=max_tokens
-        )
+        try:
+            resp = client.chat.completions.create(
+                model=AGENT_AZURE_OAI_DEPLOYMENT_NAME,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens
+            )
+        except APIConnectionError as e_conn:
+            # Pooled connection went stale: rebuild the client once and retry.
+            logging.warning(f"chat_complete connection error, resetting client and retrying: {e_conn}")
+            reset_oai_clients()
+            client = get_agent_oai_client()
+            if not client:
+                raise
+            resp = client.chat.completions.create(
+                model=AGENT_AZURE_OAI_DEPLOYMENT_NAME,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens
+            )
         return resp.choices[0].message.content
     except Exception as e:
         logging.error(f"chat_complete failed: {e}", exc_info=True)
         raise
     
-    
\ No newline at end of file
+    
+
+async def achat_complete(
+    messages: list[dict],
+    temperature: float = 0.0,
+    max_tokens: int = 800,
+    client: AsyncAzureOpenAI | None = None
+) -> str:
+    """
+    Async counterpart of `chat_complete`, for callers that run several agent
+    completions concurrently.
+
+    Args:
+        messages, temperature, max_tokens: As for `chat_complete`.
+        client (AsyncAzureOpenAI, optional): Agent client to share across concurrent calls.
+                                             When omitted, one is created and closed for this call.
+    """
+    if client is None:
+        own_client = new_async_oai_client("agent")
+        if own_client is None:
+            logging.error("Agent AzureOpenAI client not configured.")
+            raise ValueError("Agent LLM client not configured.")
+        async with own_client:
+            return await achat_complete(messages, temperature, max_tokens, client=own_client)
+
+    from openai import APIConnectionError
+    try:
+        try:
+            resp = await client.chat.completions.create(
+                model=AGENT_AZURE_OAI_DEPLOYMENT_NAME,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens
+            )
+        except APIConnectionError as e_conn:
+            # The (possibly shared) client's connections went stale: retry once on a client of our own.
+            logging.warning(f"achat_complete connection error, retrying on a new client: {e_conn}")
+            fresh_client = new_async_oai_client("agent")
+            if fresh_client is None:
+                raise
+            async with fresh_client:
+                resp = await fresh_client.chat.completions.create(
+                    model=AGENT_AZURE_OAI_DEPLOYMENT_NAME,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens
+                )
+        return resp.choices[0].message.content
+    except Exception as e:
+        logging.error(f"achat_complete failed: {e}", exc_info=True)
+        raise
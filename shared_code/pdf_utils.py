@@ -1,37 +1,224 @@
 # InvoiceProcessingApp/shared_code/pdf_utils.py
 """
 This module provides utility functions for processing PDF documents,
-primarily for converting PDF pages into image formats.
+primarily for converting PDF pages into image formats, and for shrinking
+page images before they are sent to a vision model.
 """
+import os
 import fitz
 import base64
 import logging
+import threading
+from itertools import repeat
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
-def convert_pdf_bytes_to_images_base64(pdf_bytes: bytes, dpi=200) -> list[str] | None:
+# High-detail vision input is scaled server-side to fit 2048x2048 and then so
+# its shorter side is 768px; sending more pixels than that only costs upload time.
+VISION_MAX_SIDE = 2048
+VISION_MAX_SHORT_SIDE = 768
+# Images whose longer side fits in one 768px tile gain nothing from high detail.
+VISION_LOW_DETAIL_MAX_SIDE = 768
+
+# Page render resolution. 150 DPI puts an A4 page at ~1240x1754, already more than
+# the model keeps after its own downscaling; 200 DPI only adds rasterization work.
+RENDER_DPI = int(os.environ.get("INVOICE_RENDER_DPI", "150"))
+# Documents with more pages than this are sent at low detail to bound the tile count.
+LOW_DETAIL_PAGE_THRESHOLD = int(os.environ.get("INVOICE_LOW_DETAIL_PAGE_THRESHOLD", "10"))
+
+# Page render encoding: "jpg" (default; several times smaller than PNG for scanned
+# pages) or "png" (lossless). PyMuPDF cannot write WebP, so other values fall back to jpg.
+_SUPPORTED_IMAGE_FORMATS = ("jpg", "png")
+IMAGE_FORMAT = os.environ.get("INVOICE_IMAGE_FORMAT", "jpg").lower().replace("jpeg", "jpg")
+if IMAGE_FORMAT not in _SUPPORTED_IMAGE_FORMATS:
+    logging.warning(f"INVOICE_IMAGE_FORMAT '{IMAGE_FORMAT}' is not supported; using jpg.")
+    IMAGE_FORMAT = "jpg"
+JPEG_QUALITY = 85
+
+# Blank page skipping is off by default: a faint scan can fall under the ink
+# threshold, and a dropped page is lost to extraction. Set INVOICE_SKIP_BLANK_PAGES=true
+# to leave out blank or separator sheets; every dropped page is logged.
+SKIP_BLANK_PAGES = os.environ.get("INVOICE_SKIP_BLANK_PAGES", "false").lower() == "true"
+# A page counts as blank when less than this fraction of its pixels is dark ink.
+# A single printed digit on an A4 page at 150 DPI is about 2e-5.
+BLANK_PAGE_MAX_INK_RATIO = 1e-5
+# Maps a grayscale byte to 1 if it is dark enough to count as ink, else 0.
+_INK_TABLE = bytes(1 if value < 160 else 0 for value in range(256))
+
+def _ink_ratio(pix) -> float:
+    """Fraction of a rendered page's pixels that are dark enough to count as ink."""
+    samples = (pix if pix.n == 1 else fitz.Pixmap(fitz.csGRAY, pix)).samples
+    return samples.translate(_INK_TABLE).count(1) / len(samples)
+
+# PDFs with fewer pages than this are rendered inline: handing them to worker
+# processes costs more than rendering them.
+PARALLEL_RENDER_MIN_PAGES = 8
+_RENDER_POOL = None
+_RENDER_POOL_LOCK = threading.Lock()
+
+def _get_render_pool() -> ProcessPoolExecutor:
+    """
+    Returns the render worker pool shared by all conversions, created on first use.
+    Workers are spawned, not forked, since the host process runs other threads.
+    """
+    global _RENDER_POOL
+    with _RENDER_POOL_LOCK:
+        if _RENDER_POOL is None:
+            _RENDER_POOL = ProcessPoolExecutor(max_workers=os.cpu_count() or 1, mp_context=get_context("spawn"))
+        return _RENDER_POOL
+
+def _discard_render_pool(pool: ProcessPoolExecutor):
+    """Drops a broken render pool so the next conversion starts a new one."""
+    global _RENDER_POOL
+    with _RENDER_POOL_LOCK:
+        if _RENDER_POOL is pool:
+            _RENDER_POOL = None
+    pool.shutdown(wait=False)
+
+# Leading base64 characters of each format's magic bytes.
+_BASE64_MIME_PREFIXES = (("/9j/", "image/jpeg"), ("iVBORw0KGgo", "image/png"), ("UklGR", "image/webp"))
+
+def image_mime_type(img_b64: str) -> str:
+    """Returns the MIME type of a base64 encoded image from its leading bytes; defaults to image/png."""
+    for prefix, mime_type in _BASE64_MIME_PREFIXES:
+        if img_b64.startswith(prefix):
+            return mime_type
+    return "image/png"
+
+def _encode_pixmap(pix, image_format: str) -> bytes:
+    """Encodes a pixmap as JPEG or PNG bytes."""
+    if image_format == "jpg":
+        return pix.tobytes("jpg", jpg_quality=JPEG_QUALITY)
+    return pix.tobytes("png")
+
+def _render_pages(pdf_bytes: bytes, page_numbers: range, dpi: int, image_format: str,
+                  detect_blank: bool = False) -> list[tuple[str, float | None]]:
+    """
+    Renders the given pages of a PDF to (base64 encoded `image_format` string, ink ratio)
+    pairs; the ink ratio is only computed when `detect_blank` is set, else it is None.
+
+    Top-level so it can run in a worker process; each call opens its own copy of
+    the document since fitz documents cannot be shared across processes.
+    """
+    pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
+    try:
+        rendered = []
+        for page_num in page_numbers:
+            page = pdf_document.load_page(page_num)
+            pix = page.get_pixmap(matrix=fitz.Matrix(dpi / 72, dpi / 72))
+            ink_ratio = _ink_ratio(pix) if detect_blank else None
+            img_bytes = _encode_pixmap(pix, image_format)
+            # Drop the raw samples (width*height*3 bytes, the largest buffer) before
+            # base64 allocates its copies, so at most one page's worth is held at a time.
+            pix = None
+            rendered.append((base64.b64encode(img_bytes).decode('ascii'), ink_ratio))
+            img_bytes = None
+        return rendered
+    finally:
+        pdf_document.close()
+
+def convert_pdf_bytes_to_images_base64(pdf_bytes: bytes, dpi: int | None = None, image_format: str | None = None,
+                                       skip_blank_pages: bool | None = None) -> list[str] | None:
     """
-    Converts each page of a PDF, provided as byte content, into a list of base64 encoded PNG image strings.
+    Converts each page of a PDF, provided as byte content, into a list of base64 encoded image strings.
+
+    Rasterizing and encoding pages is CPU-bound, so PDFs of at least
+    PARALLEL_RENDER_MIN_PAGES pages are split into contiguous page ranges rendered
+    in parallel by a shared pool of worker processes (one per CPU). Shorter PDFs,
+    or hosts with one CPU, are rendered inline.
 
     Args:
         pdf_bytes: The byte content of the PDF file.
         dpi: The resolution (dots per inch) for rendering the PDF pages to images.
+             Defaults to INVOICE_RENDER_DPI (150).
+        image_format: "jpg" or "png". Defaults to INVOICE_IMAGE_FORMAT (jpg); use
+                      `image_mime_type` to get the MIME type of the results.
+        skip_blank_pages: Leave out pages with less than BLANK_PAGE_MAX_INK_RATIO ink
+                          (blank or separator sheets), logging each one. If every page
+                          is blank, all of them are kept. Defaults to INVOICE_SKIP_BLANK_PAGES (off).
 
     Returns:
-        A list of base64 encoded PNG image strings, one for each page of the PDF.
+        A list of base64 encoded image strings, one for each (non-blank) page of the PDF.
         Returns None if an error occurs during conversion.
     """
-    base64_images = []
+    dpi = dpi or RENDER_DPI
+    image_format = image_format or IMAGE_FORMAT
+    if skip_blank_pages is None:
+        skip_blank_pages = SKIP_BLANK_PAGES
     try:
-        pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
-        for page_num in range(len(pdf_document)):
-            page = pdf_document.load_page(page_num)
-            pix = page.get_pixmap(dpi=dpi)
-            img_bytes = pix.tobytes("png")
-            base64_encoded_image = base64.b64encode(img_bytes).decode('utf-8')
-            base64_images.append(base64_encoded_image)
-        
-        pdf_document.close()
-        logging.info(f"Successfully converted PDF to {len(base64_images)} base64 PNG images.")
+        with fitz.open(stream=pdf_bytes, filetype="pdf") as pdf_document:
+            page_count = len(pdf_document)
+        workers = min(page_count, os.cpu_count() or 1)
+        rendered = None
+        if page_count >= PARALLEL_RENDER_MIN_PAGES and workers > 1:
+            # One contiguous range per worker, so the PDF bytes are sent to each process once.
+            step = -(-page_count // workers)
+            page_ranges = [range(start, min(start + step, page_count)) for start in range(0, page_count, step)]
+            pool = _get_render_pool()
+            try:
+                rendered = [
+                    page
+                    for chunk in pool.map(_render_pages, repeat(pdf_bytes), page_ranges, repeat(dpi),
+                                          repeat(image_format), repeat(skip_blank_pages))
+                    for page in chunk
+                ]
+            except BrokenProcessPool:
+                logging.warning("PDF render worker pool failed; rendering inline.", exc_info=True)
+                _discard_render_pool(pool)
+        if rendered is None:
+            rendered = _render_pages(pdf_bytes, range(page_count), dpi, image_format, skip_blank_pages)
+
+        base64_images = [img_b64 for img_b64, _ in rendered]
+        if skip_blank_pages:
+            blank_pages = {page_num: ink_ratio for page_num, (_, ink_ratio) in enumerate(rendered)
+                           if ink_ratio < BLANK_PAGE_MAX_INK_RATIO}
+            if len(blank_pages) < len(rendered):
+                for page_num, ink_ratio in blank_pages.items():
+                    logging.warning(f"Skipping blank page {page_num + 1} of {page_count} (ink ratio {ink_ratio:.2e}).")
+                base64_images = [img_b64 for page_num, img_b64 in enumerate(base64_images) if page_num not in blank_pages]
+
+        logging.info(f"Successfully converted PDF to {len(base64_images)} base64 {image_format.upper()} images.")
         return base64_images
     except Exception as e:
         logging.error(f"Error converting PDF to images: {e}", exc_info=True)
-        return None
\ No newline at end of file
+        return None
+
+def shrink_image_base64(img_b64: str, max_side: int = VISION_MAX_SIDE, max_short_side: int = VISION_MAX_SHORT_SIDE,
+                        jpeg_quality: int = JPEG_QUALITY) -> tuple[str, str, int]:
+    """
+    Downscales a base64 encoded page image to the size the vision model actually
+    uses (longer side at most `max_side`, shorter side at most `max_short_side`)
+    and re-encodes it as JPEG, which for scanned pages is several times smaller
+    than a PNG render.
+
+    Args:
+        img_b64: Base64 encoded image (as produced by `convert_pdf_bytes_to_images_base64`).
+        max_side: Maximum length in pixels of the longer side.
+        max_short_side: Maximum length in pixels of the shorter side.
+        jpeg_quality: JPEG quality (1-100).
+
+    Returns:
+        A tuple (base64_image, mime_type, longer_side_px). An image that needs no
+        resizing and is already JPEG or smaller than its JPEG version, or that
+        cannot be decoded, is returned unchanged with its detected MIME type
+        (and a side of 0 if undecodable).
+    """
+    try:
+        pix = fitz.Pixmap(base64.b64decode(img_b64))
+        if pix.alpha:
+            pix = fitz.Pixmap(pix, 0)  # JPEG has no alpha channel
+        long_side, short_side = max(pix.width, pix.height), min(pix.width, pix.height)
+        scale = min(1.0, max_side / long_side, max_short_side / short_side)
+        if scale < 1.0:
+            pix = fitz.Pixmap(pix, max(1, round(pix.width * scale)), max(1, round(pix.height * scale)), None)
+            long_side = max(pix.width, pix.height)
+        elif image_mime_type(img_b64) == "image/jpeg":
+            return img_b64, "image/jpeg", long_side  # re-encoding would only add artifacts
+        jpeg_b64 = base64.b64encode(pix.tobytes("jpg", jpg_quality=jpeg_quality)).decode('ascii')
+        if scale == 1.0 and len(jpeg_b64) >= len(img_b64):
+            return img_b64, image_mime_type(img_b64), long_side
+        return jpeg_b64, "image/jpeg", long_side
+    except Exception as e:
+        logging.warning(f"Could not shrink image, sending it unchanged: {e}")
+        return img_b64, image_mime_type(img_b64), 0
@@ -15,10 +15,15 @@ Database utilities (connection, existence checks) come from `database_service`.
 Configuration via env vars: SQL_SERVER_NAME, SQL_DATABASE_NAME, SQL_USERNAME, SQL_PASSWORD.
 """
 import os
+import csv
 import pandas as pd
 import logging
 import re
+import threading
 from io import BytesIO
+from importlib.util import find_spec
+from functools import lru_cache
+from cachetools import TTLCache
 from sqlalchemy import create_engine
 from sqlalchemy.exc import SQLAlchemyError
 from urllib.parse import quote_plus
@@ -27,6 +32,64 @@ from shared_code.database_service import get_sql_connection
 
 from . import database_service as general_db_service
 
+# PONumber is stored as NVARCHAR(255) so it can be indexed.
+_PO_NUMBER_MAX_LENGTH = 255
+
+# get_po_data_by_number results keyed by (table, PONumber). The same PO is looked up
+# several times per invoice; misses are kept briefly so a newly loaded PO shows up soon.
+_PO_HITS = TTLCache(maxsize=1024, ttl=300)
+_PO_MISSES = TTLCache(maxsize=1024, ttl=30)
+_PO_CACHE_LOCK = threading.Lock()
+
+
+def _copy_po_data(po_data: dict) -> dict:
+    """Copy of a cached PO lookup, so callers can modify it without changing the cache."""
+    return {**po_data, "line_items": [dict(item) for item in po_data["line_items"]]}
+
+
+def invalidate_po_cache(po_number: str | None = None):
+    """
+    Drops cached PO lookups for `po_number`, or all of them when it is None.
+    """
+    with _PO_CACHE_LOCK:
+        if po_number is None:
+            _PO_HITS.clear()
+            _PO_MISSES.clear()
+            return
+        for cache in (_PO_HITS, _PO_MISSES):
+            for key in [k for k in cache if k[1] == po_number]:
+                cache.pop(key, None)
+
+# Optional faster parsers: pyarrow's multithreaded CSV reader and the Rust-based
+# calamine Excel reader. Without them pandas' default engines are used.
+_HAS_PYARROW = find_spec("pyarrow") is not None
+_EXCEL_ENGINE = "calamine" if find_spec("python_calamine") is not None else None
+
+
+def _read_csv_with_pyarrow(file_bytes: bytes) -> pd.DataFrame | None:
+    """
+    Reads a CSV with pyarrow, keeping every cell as the exact string in the file.
+
+    pyarrow infers column types, so every column is declared as string up front
+    (otherwise "007" would come back as "7"). Returns None when the file is not
+    something this path handles (e.g. duplicate headers), so the caller can fall
+    back to pandas' parser.
+    """
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    first_line = file_bytes.split(b"\n", 1)[0].decode("utf-8-sig").rstrip("\r")
+    header = next(csv.reader([first_line]), [])
+    if not header or len(set(header)) != len(header):
+        return None
+    try:
+        table = pa_csv.read_csv(BytesIO(file_bytes), convert_options=pa_csv.ConvertOptions(
+            column_types={name: pa.string() for name in header}, null_values=[], strings_can_be_null=False))
+    except (pa.ArrowInvalid, UnicodeDecodeError):
+        return None
+    if table.column_names != header:
+        return None
+    return table.to_pandas().fillna("")
+
 
 def read_po_file_to_dataframe(file_bytes: bytes, filename: str) -> pd.DataFrame | None:
     """
@@ -35,9 +98,11 @@ def read_po_file_to_dataframe(file_bytes: bytes, filename: str) -> pd.DataFrame
     try:
         bio = BytesIO(file_bytes)
         if filename.lower().endswith('.csv'):
-            df = pd.read_csv(bio, na_filter=False, dtype=str)
+            df = _read_csv_with_pyarrow(file_bytes) if _HAS_PYARROW else None
+            if df is None:
+                df = pd.read_csv(bio, na_filter=False, dtype=str)
         elif filename.lower().endswith(('.xls', '.xlsx')):
-            df = pd.read_excel(bio, na_filter=False, dtype=str)
+            df = pd.read_excel(bio, na_filter=False, dtype=str, engine=_EXCEL_ENGINE)
         else:
             raise ValueError("Unsupported file type. Provide CSV or Excel.")
         original = list(df.columns)
@@ -71,15 +136,19 @@ def create_standardized_po_dataframe(df_original: pd.DataFrame, column_mappings:
     return df_std
 
 
-def pandas_dtype_to_sql_type(dtype: str) -> str:
-    d = dtype.lower()
-    if 'int' in d: return 'BIGINT'
-    if 'float' in d or 'decimal' in d: return 'FLOAT'
-    if 'bool' in d: return 'BIT'
-    if 'datetime' in d: return 'DATETIME2'
-    if 'date' in d: return 'DATE'
-    if 'time' in d: return 'TIME'
-    return 'VARCHAR(MAX)'
+# SQL Server column type per numpy dtype kind; anything else (object, string, category) is text.
+_KIND_TO_SQL = {'i': 'BIGINT', 'u': 'BIGINT', 'f': 'FLOAT', 'b': 'BIT', 'M': 'DATETIME2', 'm': 'BIGINT', 'O': 'VARCHAR(MAX)'}
+
+
+def pandas_dtype_to_sql_type(dtype) -> str:
+    """
+    Maps a pandas dtype (or its string name) to a SQL Server column type.
+    """
+    try:
+        kind = pd.api.types.pandas_dtype(dtype).kind
+    except TypeError:
+        return 'VARCHAR(MAX)'
+    return _KIND_TO_SQL.get(kind, 'VARCHAR(MAX)')
 
 
 def create_po_table_from_dataframe(conn: pymssql.Connection, df_standardized: pd.DataFrame, table_name: str) -> bool:
@@ -92,7 +161,8 @@ def create_po_table_from_dataframe(conn: pymssql.Connection, df_standardized: pd
     if general_db_service.check_if_table_exists(conn, table_name):
         return True
     cols = ["[id] INT IDENTITY(1,1) PRIMARY KEY"]
-    explicit = {'OrderDate':'DATE'}
+    # PONumber is the lookup key, so it needs an indexable (non-MAX) type.
+    explicit = {'OrderDate':'DATE', 'PONumber':f'NVARCHAR({_PO_NUMBER_MAX_LENGTH}) NULL'}
     for col in df_standardized.columns:
         col_sql = re.sub(r'\W+', '_', col)
         if col_sql.lower()=='id':
@@ -100,15 +170,20 @@ def create_po_table_from_dataframe(conn: pymssql.Connection, df_standardized: pd
         if col in explicit:
             sql_type = explicit[col]
         else:
-            sql_type = pandas_dtype_to_sql_type(str(df_standardized[col].dtype)) + ' NULL'
+            sql_type = pandas_dtype_to_sql_type(df_standardized[col].dtype) + ' NULL'
         cols.append(f"[{col_sql}] {sql_type}")
     ddl = f"CREATE TABLE dbo.{table_name} ({', '.join(cols)});"
+    if 'PONumber' in df_standardized.columns:
+        # Covering index for get_po_data_by_number, so lookups seek instead of scanning the table.
+        included = [c for c in ('ItemName', 'Quantity', 'UnitPrice') if c in df_standardized.columns]
+        ddl += f" CREATE NONCLUSTERED INDEX IX_{table_name}_PONumber ON dbo.{table_name} (PONumber)"
+        ddl += f" INCLUDE ({', '.join(included)});" if included else ";"
     try:
         cur = conn.cursor()
         cur.execute(ddl)
         conn.commit()
         return True
-    except pymssql.Error as e:
+    except general_db_service.DB_ERRORS as e:
         conn.rollback()
         logging.error(f"Error creating PO table {table_name}: {e}", exc_info=True)
         return False
@@ -116,6 +191,28 @@ def create_po_table_from_dataframe(conn: pymssql.Connection, df_standardized: pd
         cur.close()
 
 
+@lru_cache(maxsize=4)
+def _get_engine(user: str, pwd: str, srv: str, db: str):
+    """
+    Returns a pooled SQLAlchemy engine for the given server/database, created once per process.
+
+    Reusing it keeps connections open between loads instead of paying the
+    TCP/TLS handshake and login on every file; pre-ping replaces connections the
+    server dropped while idle.
+    """
+    url = f"mssql+pymssql://{user}:{quote_plus(pwd)}@{srv}:{1433}/{db}"
+    return create_engine(url, pool_size=5, pool_pre_ping=True, pool_recycle=1800)
+
+
+def _clear_table_statement(conn, table_name: str) -> str:
+    """
+    Returns TRUNCATE (minimally logged) when the login may alter the table, else DELETE.
+    Both roll back with the surrounding transaction.
+    """
+    can_truncate = conn.exec_driver_sql(f"SELECT HAS_PERMS_BY_NAME('dbo.{table_name}', 'OBJECT', 'ALTER')").scalar()
+    return f"TRUNCATE TABLE dbo.{table_name}" if can_truncate else f"DELETE FROM dbo.{table_name}"
+
+
 def load_po_dataframe_to_sql(df_standardized: pd.DataFrame, table_name: str, if_exists_strategy='replace') -> bool:
     """
     Load DataFrame into SQL table via SQLAlchemy+pymssql.
@@ -133,7 +230,14 @@ def load_po_dataframe_to_sql(df_standardized: pd.DataFrame, table_name: str, if_
             if general_db_service.check_if_table_exists(conn, table_name):
                 cur=conn.cursor(); cur.execute(f"DELETE FROM dbo.{table_name}"); conn.commit(); cur.close()
             conn.close()
+            invalidate_po_cache()
         return True
+    if 'PONumber' in df.columns:
+        too_long = df.loc[df['PONumber'].astype(str).str.len() > _PO_NUMBER_MAX_LENGTH, 'PONumber']
+        if not too_long.empty:
+            logging.error(f"{len(too_long)} PONumber value(s) are longer than {_PO_NUMBER_MAX_LENGTH} characters "
+                          f"and cannot be loaded, e.g. '{str(too_long.iloc[0])[:50]}...'. Nothing was loaded.")
+            return False
     # build engine
     user=os.environ.get('SQL_USERNAME'); pwd=os.environ.get('SQL_PASSWORD')
     srv=os.environ.get('SQL_SERVER_NAME'); db=os.environ.get('SQL_DATABASE_NAME')
@@ -141,11 +245,16 @@ def load_po_dataframe_to_sql(df_standardized: pd.DataFrame, table_name: str, if_
         logging.error("Missing env vars for SQLAlchemy engine.")
         return False
     try:
-        url=f"mssql+pymssql://{user}:{quote_plus(pwd)}@{srv}:{1433}/{db}"
-        engine=create_engine(url)
-        if if_exists_strategy=='replace':
-            conn=general_db_service.get_sql_connection(); cur=conn.cursor(); cur.execute(f"DELETE FROM dbo.{table_name}"); conn.commit(); cur.close(); conn.close()
-        df.to_sql(name=table_name, con=engine, if_exists='append', index=False, schema='dbo', chunksize=1000)
+        engine = _get_engine(user, pwd, srv, db)
+        # Multi-row INSERTs sized to the parameter limit, instead of one round-trip per row.
+        rows_per_insert = general_db_service.max_rows_per_insert(len(df.columns))
+        # Wipe and reload in one transaction: readers never see the table empty or
+        # half-loaded, and a failed load leaves the previous data in place.
+        with engine.begin() as conn:
+            if if_exists_strategy=='replace':
+                conn.exec_driver_sql(_clear_table_statement(conn, table_name))
+            df.to_sql(name=table_name, con=conn, if_exists='append', index=False, schema='dbo',
+                      chunksize=rows_per_insert, method='multi')
         return True
     except SQLAlchemyError as e:
         logging.error(f"Error loading PO data: {e}", exc_info=True)
@@ -154,8 +263,7 @@ def load_po_dataframe_to_sql(df_standardized: pd.DataFrame, table_name: str, if_
         logging.error(f"Unexpected error loading PO: {e}", exc_info=True)
         return False
     finally:
-        try: engine.dispose()
-        except: pass
+        invalidate_po_cache()  # the table may have changed even if the load failed part-way
 
 
 
@@ -165,6 +273,7 @@ def load_po_dataframe_to_sql(df_standardized: pd.DataFrame, table_name: str, if_
 def get_po_data_by_number(po_number: str) -> dict | None:
     """
     Queries the Master PO SQL table for all line items under the given PONumber.
+    Results are cached for a few minutes (see `invalidate_po_cache`).
     Returns None if no rows are found, else returns:
     {
       "po_number": "<po_number>",
@@ -179,37 +288,46 @@ def get_po_data_by_number(po_number: str) -> dict | None:
     }
     """
     table = os.getenv("PO_MASTER_TABLE_NAME", "MasterPOData")
-    sql = (
-        f"SELECT ItemName, Quantity, UnitPrice "
+    cache_key = (table, po_number)
+    with _PO_CACHE_LOCK:
+        if cache_key in _PO_HITS:
+            return _copy_po_data(_PO_HITS[cache_key])
+        if cache_key in _PO_MISSES:
+            return None
+    # Numeric conversion happens in SQL; values that do not parse are returned as stored.
+    sql = general_db_service.adapt_placeholders(
+        f"SELECT ItemName, Quantity, UnitPrice, "
+        f"TRY_CAST(Quantity AS FLOAT) AS QuantityNumber, TRY_CAST(UnitPrice AS FLOAT) AS UnitPriceNumber "
         f"FROM dbo.{table} "
         f"WHERE PONumber = %s"
     )
     try:
         conn = get_sql_connection()
-        cursor = conn.cursor(as_dict=True)
+        cursor = conn.cursor()
         cursor.execute(sql, (po_number,))
-        rows = cursor.fetchall()
+        rows = general_db_service.fetchall_as_dicts(cursor)
         cursor.close()
         conn.close()
         if not rows:
+            with _PO_CACHE_LOCK:
+                _PO_MISSES[cache_key] = True
             return None
 
-        # Normalize numeric types if returned as Decimal
-        def _to_py(val):
-            try: return float(val)
-            except: return val
-
-        return {
+        result = {
             "po_number": po_number,
             "line_items": [
                 {
                     "description": row["ItemName"],
-                    "quantity": _to_py(row["Quantity"]),
-                    "unit_price": _to_py(row["UnitPrice"])
+                    "quantity": row["Quantity"] if row["QuantityNumber"] is None else row["QuantityNumber"],
+                    "unit_price": row["UnitPrice"] if row["UnitPriceNumber"] is None else row["UnitPriceNumber"]
                 }
                 for row in rows
             ]
         }
+        with _PO_CACHE_LOCK:
+            _PO_HITS[cache_key] = _copy_po_data(result)
+            _PO_MISSES.pop(cache_key, None)
+        return result
     except Exception as e:
         logging.error(f"Error fetching PO '{po_number}' data: {e}", exc_info=True)
         return None
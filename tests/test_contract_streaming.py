@@ -0,0 +1,84 @@
+import json
+import os
+import unittest
+from unittest import mock
+
+from shared_code import openai_service
+
+from tests.test_contract_truncation import _CONTRACT_ENV
+
+_ITEMS_RE = openai_service._CONTRACT_ITEMS_ARRAY_RE
+
+def _chunks(text, size):
+    return [text[start:start + size] for start in range(0, len(text), size)]
+
+class JsonArrayItemsTests(unittest.TestCase):
+    def _items(self, text_chunks):
+        return list(openai_service._iter_json_array_items(iter(text_chunks), _ITEMS_RE))
+
+    def test_items_split_across_chunks(self):
+        items = [{"item_code": f"A{n}", "unit_price": n * 1.5} for n in range(5)]
+        text = json.dumps({"contract_items": items})
+        for size in (1, 2, 7, len(text)):
+            with self.subTest(chunk_size=size):
+                self.assertEqual(self._items(_chunks(text, size)), items)
+
+    def test_number_split_across_chunks(self):
+        self.assertEqual(self._items(['{"contract_items": [1', '23, 4', '.5]}']), [123, 4.5])
+
+    def test_items_are_yielded_before_the_array_closes(self):
+        items = openai_service._iter_json_array_items(
+            iter(['{"contract_items": [{"item_code": "A1"}, ', '{"item_co']), _ITEMS_RE)
+        self.assertEqual(next(items), {"item_code": "A1"})
+
+    def test_truncated_array_raises_after_the_complete_items(self):
+        items = openai_service._iter_json_array_items(
+            iter(['{"contract_items": [{"item_code": "A1"}, ', '{"item_code": "A']), _ITEMS_RE)
+        self.assertEqual(next(items), {"item_code": "A1"})
+        with self.assertRaises(json.JSONDecodeError):
+            next(items)
+
+    def test_stream_without_the_array_raises(self):
+        with self.assertRaises(json.JSONDecodeError):
+            self._items(['{"items": []}'])
+
+    def test_prose_before_the_array_is_skipped(self):
+        text = 'Here are the items: [not these] ```json\n{"contract_items": [{"item_code": "A1"}]}\n```'
+        self.assertEqual(self._items(_chunks(text, 5)), [{"item_code": "A1"}])
+
+    def test_nested_brackets_stay_inside_their_item(self):
+        items = [
+            {"item_description": "Bolt [M8] ], {x}", "sizes": [[1, 2], [3]], "meta": {"tags": ["a]", "b"]}},
+            {"item_description": "Nut", "sizes": []},
+        ]
+        text = json.dumps({"contract_items": items})
+        self.assertEqual(self._items(_chunks(text, 3)), items)
+
+    def test_empty_array(self):
+        self.assertEqual(self._items(['{"contract_items": [', ' ]}']), [])
+
+class IterContractItemsTests(unittest.TestCase):
+    def setUp(self):
+        patches = [
+            mock.patch.dict(os.environ, _CONTRACT_ENV),
+            mock.patch.object(openai_service, "get_azure_oai_client"),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_items_are_normalized_and_non_dicts_skipped(self):
+        text = json.dumps({"contract_items": [{"ItemName": "A1", "extra": 1}, "not an item"]})
+        with mock.patch.object(openai_service, "_iter_stream_deltas", return_value=iter(_chunks(text, 4))):
+            items = list(openai_service.iter_contract_items([], "A1 1.00", "contract.pdf"))
+        expected = dict.fromkeys(openai_service._CONTRACT_ITEM_KEYS)
+        expected["ItemName"] = "A1"
+        self.assertEqual(items, [expected])
+
+    def test_missing_configuration_raises(self):
+        with mock.patch.dict(os.environ, {"AZURE_OPENAI_CONTRACT_ITEM_EXTRACTION_DEPLOYMENT_NAME": ""}):
+            with self.assertRaises(ValueError):
+                list(openai_service.iter_contract_items([], "", "contract.pdf"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+import os
+import unittest
+from unittest import mock
+
+from shared_code import openai_service
+
+_CONTRACT_ENV = {
+    "AZURE_OPENAI_ENDPOINT": "https://example.openai.azure.com",
+    "AZURE_OPENAI_API_KEY": "key",
+    "AZURE_OPENAI_CONTRACT_ITEM_EXTRACTION_DEPLOYMENT_NAME": "contract-model",
+    "AZURE_OPENAI_API_VERSION": "2024-10-21",
+}
+_ITEM = dict.fromkeys(openai_service._CONTRACT_ITEM_KEYS)
+
+class ContractTruncationTests(unittest.TestCase):
+    def setUp(self):
+        patches = [
+            mock.patch.dict(os.environ, _CONTRACT_ENV),
+            mock.patch.object(openai_service, "get_azure_oai_client"),
+            mock.patch.object(openai_service.time, "sleep"),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def _extract(self, stream, max_tokens=None, retries=2):
+        budgets = []
+        def fake_stream(client, params):
+            budgets.append(params["max_tokens"])
+            return stream(params)
+        with mock.patch.object(openai_service, "_stream_completion_content", side_effect=fake_stream):
+            items = openai_service.extract_contract_data_as_list([], "Widget 1.00", "contract.pdf", retries, max_tokens)
+        return items, budgets
+
+    def test_truncated_response_is_retried_with_a_larger_budget(self):
+        def stream(params):
+            if params["max_tokens"] < 8192:
+                raise openai_service._TruncatedOutputError("Model output was cut off at max_tokens.")
+            return openai_service.json_dumps({"contract_items": [_ITEM]})
+
+        items, budgets = self._extract(stream, max_tokens=2048)
+        self.assertEqual(items, [_ITEM])
+        self.assertEqual(budgets, [2048, 4096, 8192])
+
+    def test_truncated_response_at_the_limit_is_not_retried(self):
+        def stream(params):
+            raise openai_service._TruncatedOutputError("Model output was cut off at max_tokens.")
+
+        items, budgets = self._extract(stream, max_tokens=openai_service._CONTRACT_RETRY_MAX_OUTPUT_TOKENS)
+        self.assertIsNone(items)
+        self.assertEqual(budgets, [openai_service._CONTRACT_RETRY_MAX_OUTPUT_TOKENS])
+
+    def test_price_list_budget_counts_item_lines(self):
+        price_list = "\n".join(f"A{n} 1.00" for n in range(40))
+        self.assertGreaterEqual(openai_service._contract_max_tokens(price_list), 40 * openai_service._CONTRACT_TOKENS_PER_ITEM)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+import os
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from shared_code import openai_service
+
+_VISION_ENV = {
+    "AZURE_OPENAI_VISION_DEPLOYMENT_NAME": "vision-model",
+    "AZURE_OPENAI_VISION_BATCH_DEPLOYMENT_NAME": "vision-batch",
+    "AZURE_OPENAI_API_VERSION": "2024-10-21",
+}
+
+def _invoice(invoice_id):
+    return openai_service.json_dumps({"InvoiceID": invoice_id, "LineItems": []})
+
+class GenerateInvoiceDataBatchTests(unittest.TestCase):
+    def setUp(self):
+        patches = [
+            mock.patch.dict(os.environ, _VISION_ENV),
+            mock.patch.object(openai_service, "get_vision_oai_client"),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_results_are_keyed_by_filename_and_invalid_ones_dropped(self):
+        docs = [([], "a.pdf"), ([], "b.pdf"), ([], "c.pdf"), ([], "d.pdf")]
+        contents = [_invoice("A"), None, '{"InvoiceID": "C"}', "```json\n" + _invoice("D") + "\n```"]
+        with mock.patch.object(openai_service, "_run_chat_batch", return_value=contents) as run_batch:
+            results = openai_service.generate_invoice_data_batch(docs, poll_interval_seconds=1, timeout_seconds=5)
+
+        self.assertEqual(results, {"a.pdf": _invoice("A"), "b.pdf": None, "c.pdf": None, "d.pdf": _invoice("D")})
+        _, requests, poll_interval_seconds, timeout_seconds = run_batch.call_args.args
+        self.assertEqual([request["model"] for request in requests], ["vision-batch"] * len(docs))
+        self.assertEqual((poll_interval_seconds, timeout_seconds), (1, 5))
+
+    def test_batch_deployment_falls_back_to_the_extraction_deployment(self):
+        with mock.patch.dict(os.environ), mock.patch.object(openai_service, "_run_chat_batch", return_value=[None]) as run_batch:
+            del os.environ["AZURE_OPENAI_VISION_BATCH_DEPLOYMENT_NAME"]
+            openai_service.generate_invoice_data_batch([([], "a.pdf")])
+        self.assertEqual(run_batch.call_args.args[1][0]["model"], "vision-model")
+
+    def test_batch_failure_returns_none_for_every_invoice(self):
+        with mock.patch.object(openai_service, "_run_chat_batch", side_effect=RuntimeError("quota")):
+            results = openai_service.generate_invoice_data_batch([([], "a.pdf"), ([], "b.pdf")])
+        self.assertEqual(results, {"a.pdf": None, "b.pdf": None})
+
+    def test_missing_client_returns_none_for_every_invoice(self):
+        openai_service.get_vision_oai_client.return_value = None
+        with mock.patch.object(openai_service, "_run_chat_batch") as run_batch:
+            results = openai_service.generate_invoice_data_batch([([], "a.pdf")])
+        self.assertEqual(results, {"a.pdf": None})
+        run_batch.assert_not_called()
+
+class RunChatBatchTests(unittest.TestCase):
+    def _client(self, statuses, output_lines):
+        client = mock.Mock()
+        client.files.create.return_value = SimpleNamespace(id="file-in")
+        batches = [SimpleNamespace(id="batch-1", status=status, output_file_id="file-out", errors=None)
+                   for status in statuses]
+        client.batches.create.return_value = batches[0]
+        client.batches.retrieve.side_effect = batches[1:]
+        client.files.content.return_value = SimpleNamespace(text="\n".join(output_lines))
+        return client
+
+    @staticmethod
+    def _output_line(custom_id, message, status_code=200):
+        return openai_service.json_dumps({
+            "custom_id": custom_id,
+            "response": {"status_code": status_code, "body": {"choices": [{"message": message}]}},
+        })
+
+    def test_results_are_placed_by_custom_id(self):
+        client = self._client(["validating", "in_progress", "completed"], [
+            self._output_line("1", {"content": "second"}),
+            self._output_line("0", {"tool_calls": [{"function": {"arguments": "{}"}}]}),
+            self._output_line("2", {"content": "error"}, status_code=500),
+        ])
+        with mock.patch.object(openai_service.time, "sleep") as sleep:
+            results = openai_service._run_chat_batch(client, [{}, {}, {}], poll_interval_seconds=7)
+
+        self.assertEqual(results, ["{}", "second", None])
+        self.assertEqual(sleep.call_args_list, [mock.call(7), mock.call(7)])
+
+    def test_unfinished_batch_is_cancelled_at_the_timeout(self):
+        client = self._client(["in_progress", "in_progress"], [])
+        with mock.patch.object(openai_service.time, "sleep"), \
+             mock.patch.object(openai_service.time, "monotonic", side_effect=[0, 0, 11]):
+            results = openai_service._run_chat_batch(client, [{}], timeout_seconds=10)
+
+        self.assertEqual(results, [None])
+        client.batches.cancel.assert_called_once_with("batch-1")
+        client.files.content.assert_not_called()
+
+if __name__ == "__main__":
+    unittest.main()
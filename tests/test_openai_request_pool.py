@@ -0,0 +1,153 @@
+import asyncio
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import httpx
+from openai import RateLimitError
+
+from shared_code import openai_request_pool
+from shared_code.openai_request_pool import RequestPool, retry_delay
+
+class FakeClock:
+    """Stands in for time.monotonic and asyncio.sleep; sleeping advances the clock instantly."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+def _api_error(status_code, headers=None):
+    return SimpleNamespace(status_code=status_code, response=SimpleNamespace(headers=headers or {}))
+
+def _rate_limit_error(headers=None):
+    response = httpx.Response(429, headers=headers, request=httpx.Request("POST", "https://example.openai.azure.com"))
+    return RateLimitError("Rate limit exceeded", response=response, body=None)
+
+class RequestPoolTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patches = [
+            mock.patch.object(openai_request_pool.time, "monotonic", self.clock.monotonic),
+            mock.patch.object(openai_request_pool.asyncio, "sleep", self.clock.sleep),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def _submit_all(self, pool, token_estimates, request_fn=None):
+        started = []
+        async def default_request():
+            started.append(self.clock.now)
+            return len(started)
+        async def run():
+            return [await pool.submit(request_fn or default_request, tokens) for tokens in token_estimates]
+        return asyncio.run(run()), started
+
+    def test_request_bucket_refills_at_the_per_minute_rate(self):
+        pool = RequestPool(max_requests_per_minute=2, max_tokens_per_minute=1000)
+        _, started = self._submit_all(pool, [1, 1, 1, 1])
+        self.assertEqual(started, [1000.0, 1000.0, 1030.0, 1060.0])
+
+    def test_token_bucket_refills_at_the_per_minute_rate(self):
+        pool = RequestPool(max_requests_per_minute=100, max_tokens_per_minute=600)
+        _, started = self._submit_all(pool, [500, 300])
+        # 200 tokens short at 10 tokens/s.
+        self.assertEqual(started, [1000.0, 1020.0])
+
+    def test_capacity_does_not_refill_past_the_limit(self):
+        pool = RequestPool(max_requests_per_minute=100, max_tokens_per_minute=600)
+        self.clock.now += 3600
+        self._submit_all(pool, [1])
+        self.assertEqual(pool.available_token_capacity, 599)
+        self.assertEqual(pool.available_request_capacity, 99)
+
+    def test_oversized_request_is_charged_the_whole_budget_instead_of_waiting_forever(self):
+        pool = RequestPool(max_requests_per_minute=100, max_tokens_per_minute=600)
+        _, started = self._submit_all(pool, [5000, 5000])
+        self.assertEqual(started, [1000.0, 1060.0])
+        self.assertEqual(pool.available_token_capacity, 0)
+
+    def test_rate_limit_pauses_the_pool_for_retry_after(self):
+        pool = RequestPool(max_requests_per_minute=100, max_tokens_per_minute=1000)
+        started = []
+        async def request_fn():
+            started.append(self.clock.now)
+            if len(started) == 1:
+                raise _rate_limit_error({"retry-after": "7"})
+            return "ok"
+        results, _ = self._submit_all(pool, [1], request_fn)
+        self.assertEqual(results, ["ok"])
+        self.assertEqual(started, [1000.0, 1007.0])
+
+    def test_rate_limit_is_raised_after_max_attempts(self):
+        pool = RequestPool(max_requests_per_minute=100, max_tokens_per_minute=1000, max_attempts=2)
+        calls = []
+        async def request_fn():
+            calls.append(self.clock.now)
+            raise _rate_limit_error({"retry-after-ms": "1500"})
+        with self.assertRaises(RateLimitError):
+            self._submit_all(pool, [1], request_fn)
+        self.assertEqual(calls, [1000.0, 1001.5])
+
+    def test_other_errors_are_raised_immediately(self):
+        pool = RequestPool()
+        calls = []
+        async def request_fn():
+            calls.append(1)
+            raise ValueError("bad output")
+        with self.assertRaises(ValueError):
+            self._submit_all(pool, [1], request_fn)
+        self.assertEqual(calls, [1])
+
+class RetryDelayTests(unittest.TestCase):
+    def test_retry_after_header_is_used(self):
+        self.assertEqual(retry_delay(_api_error(429, {"retry-after": "12"}), 0), 12.0)
+        self.assertEqual(retry_delay(_api_error(503, {"retry-after": "2.5"}), 3), 2.5)
+
+    def test_retry_after_ms_takes_precedence(self):
+        self.assertEqual(retry_delay(_api_error(429, {"retry-after-ms": "250", "retry-after": "12"}), 0), 0.25)
+
+    def test_retry_after_is_capped(self):
+        self.assertEqual(retry_delay(_api_error(429, {"retry-after": "3600"}), 0), openai_request_pool._MAX_RETRY_AFTER_SECONDS)
+
+    def test_unparseable_retry_after_falls_back_to_backoff(self):
+        with mock.patch.object(openai_request_pool.random, "uniform", return_value=0.0):
+            delay = retry_delay(_api_error(429, {"retry-after": "Wed, 21 Oct 2026 07:28:00 GMT"}), 2)
+        self.assertEqual(delay, 4.0)
+
+    def test_backoff_jitter_stays_within_bounds(self):
+        for attempt in range(6):
+            expected_min = min(30.0, 2.0 * 2 ** attempt)
+            expected_max = min(30.0, 2.0 * 2 ** attempt + 2.0)
+            for _ in range(50):
+                with self.subTest(attempt=attempt):
+                    delay = retry_delay(_api_error(500), attempt, base_delay=2.0)
+                    self.assertGreaterEqual(delay, expected_min)
+                    self.assertLessEqual(delay, expected_max)
+
+    def test_jitter_extremes(self):
+        for jitter in (0.0, 1.0):
+            with self.subTest(jitter=jitter), \
+                 mock.patch.object(openai_request_pool.random, "uniform", return_value=jitter) as uniform:
+                self.assertEqual(retry_delay(None, 1), 2.0 + jitter)
+                uniform.assert_called_once_with(0, 1.0)
+
+    def test_permanent_client_errors_are_not_retried(self):
+        for status in (400, 401, 403, 404, 422):
+            with self.subTest(status=status):
+                self.assertIsNone(retry_delay(_api_error(status, {"retry-after": "1"}), 0))
+
+    def test_retryable_statuses_and_errors_without_status_are_retried(self):
+        for error in (_api_error(408), _api_error(409), _api_error(429), _api_error(500), TimeoutError(), None):
+            with self.subTest(error=error):
+                self.assertIsNotNone(retry_delay(error, 0))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import os
+import re
+import unittest
+from unittest import mock
+
+from shared_code import openai_service
+
+_VISION_ENV = {
+    "AZURE_OPENAI_ENDPOINT": "https://example.openai.azure.com",
+    "AZURE_OPENAI_API_KEY": "key",
+    "AZURE_OPENAI_VISION_CORRECTION_DEPLOYMENT_NAME": "vision-model",
+    "AZURE_OPENAI_API_VERSION": "2024-10-21",
+}
+_DOC_IDX_RE = re.compile(r'<doc idx="(\d+)">')
+
+def _doc(n):
+    return [], openai_service.json_dumps({"InvoiceID": f"INV-{n}", "LineItems": []})
+
+def _request_indices(params):
+    return [int(idx) for part in params["messages"][1]["content"]
+            if part.get("type") == "text" for idx in _DOC_IDX_RE.findall(part["text"])]
+
+def _corrected(idx):
+    return {"idx": idx, "json": {"InvoiceID": f"FIXED-{idx}", "LineItems": []}}
+
+class VisionCorrectionBatchTests(unittest.TestCase):
+    def setUp(self):
+        patches = [
+            mock.patch.dict(os.environ, _VISION_ENV),
+            mock.patch.object(openai_service, "get_azure_oai_client"),
+            mock.patch.object(openai_service.time, "sleep"),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def _correct(self, docs, answer, **kwargs):
+        requests = []
+        def fake_stream(client, params):
+            indices = _request_indices(params)
+            requests.append(indices)
+            return answer(indices)
+        with mock.patch.object(openai_service, "_stream_completion_content", side_effect=fake_stream):
+            results = openai_service.correct_invoice_json_with_vision_batch(docs, **kwargs)
+        return results, requests
+
+    def test_invoices_are_grouped_and_results_kept_in_order(self):
+        def answer(indices):
+            # Answer out of order to check results are placed by idx.
+            return openai_service.json_dumps({"results": [_corrected(idx) for idx in reversed(indices)]})
+
+        results, requests = self._correct([_doc(n) for n in range(5)], answer, max_docs_per_request=2)
+        self.assertEqual(requests, [[0, 1], [2, 3], [4]])
+        self.assertEqual([openai_service.json_loads(r)["InvoiceID"] for r in results],
+                         [f"FIXED-{n}" for n in range(5)])
+
+    def test_missing_and_unknown_entries_leave_none(self):
+        def answer(indices):
+            return openai_service.json_dumps({"results": [_corrected(indices[0]), _corrected(99), {"idx": indices[1], "json": "bad"}]})
+
+        results, _ = self._correct([_doc(0), _doc(1)], answer)
+        self.assertEqual(openai_service.json_loads(results[0])["InvoiceID"], "FIXED-0")
+        self.assertIsNone(results[1])
+
+    def test_failed_group_does_not_affect_other_groups(self):
+        def answer(indices):
+            if indices == [0]:
+                return "not json"
+            return openai_service.json_dumps({"results": [_corrected(idx) for idx in indices]})
+
+        results, requests = self._correct([_doc(0), _doc(1)], answer, max_docs_per_request=1, retries=1)
+        self.assertEqual(requests, [[0], [0], [1]])
+        self.assertIsNone(results[0])
+        self.assertEqual(openai_service.json_loads(results[1])["InvoiceID"], "FIXED-1")
+
+    def test_group_closes_early_at_the_output_budget(self):
+        large = " ".join(f"w{n}" for n in range(openai_service._BATCH_CORRECTION_MAX_OUTPUT_TOKENS))
+        docs = [_doc(0), ([], openai_service.json_dumps({"InvoiceID": large, "LineItems": []})), _doc(2)]
+
+        def answer(indices):
+            return openai_service.json_dumps({"results": [_corrected(idx) for idx in indices]})
+
+        _, requests = self._correct(docs, answer, max_docs_per_request=4)
+        self.assertEqual(requests, [[0], [1], [2]])
+
+    def test_missing_configuration_returns_none_for_every_invoice(self):
+        with mock.patch.dict(os.environ, {"AZURE_OPENAI_VISION_CORRECTION_DEPLOYMENT_NAME": ""}):
+            results, requests = self._correct([_doc(0), _doc(1)], lambda indices: "")
+        self.assertEqual(results, [None, None])
+        self.assertEqual(requests, [])
+
+if __name__ == "__main__":
+    unittest.main()
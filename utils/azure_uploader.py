@@ -2,20 +2,61 @@
 
 import os
 import logging
+import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from azure.storage.blob import BlobServiceClient
 from azure.core.exceptions import AzureError
+from azure.core.pipeline.transport import RequestsTransport
 
 logger = logging.getLogger(__name__)
 
+# Uploads are network-bound, so several run at once from a thread pool.
+MAX_CONCURRENT_UPLOADS = 16
+# Parallel block uploads per (large) file.
+UPLOAD_CONCURRENCY = 4
+# Sized so every upload thread's block uploads get a connection; urllib3's default
+# pool of 10 would otherwise discard and reopen connections.
+_HTTP_POOL_MAXSIZE = MAX_CONCURRENT_UPLOADS * UPLOAD_CONCURRENCY
+
+def _new_http_session() -> requests.Session:
+    session = requests.Session()
+    # Retries are handled by the Azure SDK pipeline, not urllib3.
+    adapter = HTTPAdapter(
+        pool_maxsize=_HTTP_POOL_MAXSIZE,
+        max_retries=Retry(total=False, redirect=False, raise_on_status=False)
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def _upload_one(blob_service_client: BlobServiceClient, container_name: str, folder_path: str, file) -> str:
+    """Uploads one Streamlit UploadedFile and returns its name."""
+    blob_name = f"{folder_path.strip('/')}/{file.name}"
+    blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_name)
+
+    # Stream Streamlit's UploadedFile (a BytesIO) directly rather than copying it with
+    # getvalue(); the SDK reads it in blocks and uploads large files in parallel.
+    file.seek(0)
+    blob_client.upload_blob(file, overwrite=True, length=getattr(file, "size", None),
+                            blob_type="BlockBlob", max_concurrency=UPLOAD_CONCURRENCY)
+
+    logger.info(f"Successfully uploaded '{file.name}' to '{container_name}/{blob_name}'.")
+    return file.name
+
 def upload_files_to_blob(files: list, container_name: str, folder_path: str) -> tuple[list[str], str | None]:
     """
     Uploads a list of files to a specific folder in an Azure Blob container.
     This function contains NO Streamlit UI elements.
 
+    Files are uploaded concurrently (up to MAX_CONCURRENT_UPLOADS at a time)
+    through one shared client. A failed file does not stop the others.
+
     Returns:
         A tuple containing:
         - A list of successfully uploaded filenames.
-        - An error message string if an error occurred, otherwise None.
+        - An error message string naming the files that failed, otherwise None.
     """
     connect_str = os.getenv("AZURE_STORAGE_CONNECTION_STRING")
     if not connect_str:
@@ -24,19 +65,30 @@ def upload_files_to_blob(files: list, container_name: str, folder_path: str) ->
         return [], err_msg
 
     try:
-        blob_service_client = BlobServiceClient.from_connection_string(connect_str)
-        successful_uploads = []
-        
-        for file in files:
-            blob_name = f"{folder_path.strip('/')}/{file.name}"
-            blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_name)
-            
-            # Use getvalue() to read bytes from Streamlit's UploadedFile
-            blob_client.upload_blob(file.getvalue(), overwrite=True)
-            
-            logger.info(f"Successfully uploaded '{file.name}' to '{container_name}/{blob_name}'.")
-            successful_uploads.append(file.name)
-            
+        if not files:
+            return [], None
+
+        blob_service_client = BlobServiceClient.from_connection_string(
+            connect_str, transport=RequestsTransport(session=_new_http_session()))
+        uploaded_by_index = {}
+        failures = []
+        with blob_service_client, ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT_UPLOADS, len(files))) as executor:
+            futures = {
+                executor.submit(_upload_one, blob_service_client, container_name, folder_path, file): (index, file.name)
+                for index, file in enumerate(files)
+            }
+            for future in as_completed(futures):
+                index, file_name = futures[future]
+                try:
+                    uploaded_by_index[index] = future.result()
+                except Exception as e:
+                    logger.error(f"Failed to upload '{file_name}': {e}")
+                    failures.append(f"{file_name} ({e})")
+
+        successful_uploads = [uploaded_by_index[index] for index in sorted(uploaded_by_index)]
+        if failures:
+            err_msg = f"Uploaded {len(successful_uploads)} of {len(files)} file(s). Failed: {'; '.join(failures)}"
+            return successful_uploads, err_msg # <-- Return partial success with an error message
         return successful_uploads, None # <-- Return success (no error message)
 
     except AzureError as e: